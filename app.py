@@ -1,76 +1,152 @@
 from flask import Flask, render_template
+import click
 from flask_login import LoginManager, current_user
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from serialization import BSONJSONProvider
 
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY') or 'dev-secret-key'  
-
 # Flask-Login setup
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'auth.login' 
+login_manager.login_view = 'auth.login'
 
-# Import database after app initialization to avoid circular imports
-from database import db
 
-# Import user model after app initialization to avoid circular imports
+# Importing the database module does not connect; the client is created on first use
+from database import db, index_report
 from models import User
 
+
 @login_manager.user_loader
 def load_user(user_id):
-    from bson import ObjectId
-    user_data = db.users.find_one({'_id': ObjectId(user_id)})
-    if user_data:
-        return User(user_data)
-    return None
-
-# Now import blueprints AFTER creating the app and login_manager
-from auth import auth_bp
-from routes.money import money_bp
-from routes.events import events_bp
-from routes.reports import reports_bp
-from routes.settings import settings_bp
-
-# Register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(money_bp)
-app.register_blueprint(events_bp)
-app.register_blueprint(reports_bp)
-app.register_blueprint(settings_bp)
-
-@app.context_processor
-def inject_now():
-    return {'now': datetime.now()}
-
-
-# Error handlers
-@app.errorhandler(404)
-def not_found(e):
-    return render_template('404.html'), 404
-
-@app.errorhandler(500)
-def internal_error(e):
-    return render_template('500.html'), 500
-
-# Context processor to make current_user available in all templates
-@app.context_processor
-def inject_user():
-    return dict(current_user=current_user)
-
-# Home route
-@app.route('/')
-def index():
-    if current_user.is_authenticated:
-        return render_template('dashboard.html')
-    return render_template('login.html')
+    return User.get(db, user_id)
+
+
+def register_blueprints(app):
+    """Import and register the blueprints; deferred until an app is created."""
+    from auth import auth_bp
+    from routes.money import money_bp
+    from routes.events import events_bp
+    from routes.reports import reports_bp
+    from routes.settings import settings_bp
+    from routes.dashboard import dashboard_bp
+    from routes.metrics import metrics_bp
+    from routes.profiling import profiling_bp
+    from routes.health import health_bp
+    from routes.sync import sync_bp
+    from routes.stream import stream_bp
+    from routes.items import items_bp
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(money_bp)
+    app.register_blueprint(events_bp)
+    app.register_blueprint(reports_bp)
+    app.register_blueprint(settings_bp)
+    app.register_blueprint(dashboard_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(profiling_bp)
+    app.register_blueprint(health_bp)
+    app.register_blueprint(sync_bp)
+    app.register_blueprint(stream_bp)
+    app.register_blueprint(items_bp)
+
+
+def register_commands(app):
+    @app.cli.command('check-indexes')
+    def check_indexes():
+        """Report declared indexes that are missing and existing ones that are unused."""
+        for collection, result in index_report().items():
+            unused = 'unknown' if result['unused'] is None else ', '.join(result['unused']) or '-'
+            print(f"{collection}: missing: {', '.join(result['missing']) or '-'}; unused: {unused}")
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--user', 'user_id', default=None, help='Only rebuild this user id.')
+    @click.option('--check', is_flag=True, help='Report drift without repairing it.')
+    def rebuild_rollups_command(user_id, check):
+        """Recompute the monthly rollups from incomes and expenses and repair drift."""
+        import rollups
+        drift = rollups.rebuild_rollups(user_id, repair=not check)
+        for entry in drift:
+            print(f"{entry['kind']} {entry['user_id']} {entry['month']} {entry['category']}: "
+                  f"stored {entry['stored']} expected {entry['expected']}")
+        print(f"{len(drift)} drifted rollups {'found' if check else 'repaired'}")
+
+    @app.cli.command('migrate-transactions')
+    @click.option('--user', 'user_id', default=None, help='Only migrate this user id.')
+    @click.option('--verify-only', is_flag=True, help='Compare buckets with the documents without copying.')
+    @click.option('--drop-source', is_flag=True, help='Delete the documents once the buckets verify.')
+    def migrate_transactions_command(user_id, verify_only, drop_source):
+        """Copy incomes and expenses into monthly buckets and verify them."""
+        import transactions
+        if not verify_only:
+            for collection, copied in transactions.migrate(user_id).items():
+                print(f"{collection}: {copied} copied into buckets")
+        problems = transactions.verify(user_id)
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} problems found")
+        if drop_source:
+            if problems:
+                raise click.ClickException('Not dropping the documents: the buckets do not match them')
+            for collection, deleted in transactions.drop_source(user_id).items():
+                print(f"{collection}: {deleted} documents deleted")
+
+
+def create_app():
+    """Build the Flask app without connecting to MongoDB.
+
+    Safe to call in a gunicorn master running with --preload: the MongoClient
+    is created lazily in each worker on first use, and gunicorn.conf.py warms
+    every worker up after the fork (connection pool, indexes, templates).
+    """
+    app = Flask(__name__)
+    app.json = BSONJSONProvider(app)
+    app.secret_key = os.environ.get('SECRET_KEY') or 'dev-secret-key'
+
+    login_manager.init_app(app)
+    register_blueprints(app)
+
+    # Count MongoDB commands per request against the endpoints' declared budgets
+    from query_budget import check_budget
+    app.after_request(check_budget)
+
+    @app.context_processor
+    def inject_now():
+        return {'now': datetime.now()}
+
+    # Context processor to make current_user available in all templates
+    @app.context_processor
+    def inject_user():
+        return dict(current_user=current_user)
+
+    # Error handlers
+    @app.errorhandler(404)
+    def not_found(e):
+        return render_template('404.html'), 404
+
+    @app.errorhandler(500)
+    def internal_error(e):
+        return render_template('500.html'), 500
+
+    # Home route
+    @app.route('/')
+    def index():
+        if current_user.is_authenticated:
+            return render_template('dashboard.html')
+        return render_template('login.html')
+
+    register_commands(app)
+    return app
+
+
+# Module-level app for `gunicorn app:app` and `flask run`
+app = create_app()
 
 if __name__ == '__main__':
+    import warmup
+    warmup.warm_up(app)
     app.run(debug=True)
     
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""Cold-data archive for old transactions, past events and completed tasks.
+
+Runs as its own process next to the web workers (see procfile):
+
+    python archive.py              # archive once every ARCHIVE_INTERVAL_HOURS
+    python archive.py --once       # a single pass, e.g. from cron
+    python archive.py --dry-run    # count what a pass would archive
+
+What is archived, with the horizons (in days) taken from the environment:
+  incomes, expenses - months that ended more than ARCHIVE_TRANSACTION_DAYS ago;
+                      whole months, so bucketed storage moves whole buckets
+  events            - non-recurring events that ended ARCHIVE_EVENT_DAYS ago
+  tasks             - tasks completed more than ARCHIVE_TASK_DAYS ago
+A horizon of 0 turns archiving off for those collections.
+
+Records move to archived_<collection> (see database.ARCHIVE_PREFIX), created
+with the ARCHIVE_COMPRESSOR block compressor. They are copied first and removed
+from the live collection after, in batches, so an interrupted pass is simply
+picked up by the next one.
+
+The monthly rollups are left as they are, so summaries keep counting archived
+transactions; reports over raw transactions and rollup rebuilds read the
+archive too (including()). List endpoints leave archived records out unless
+asked with include_archived=true, and exports always include them. Archived
+records can still be edited and deleted through items.py, and are logged as
+deletes in the change log so offline clients drop them too.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+import argparse
+import logging
+import os
+import time
+from pymongo.errors import BulkWriteError
+import database
+from database import db, ARCHIVE_PREFIX
+import changelog
+import transactions
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_TRANSACTION_DAYS = int(os.environ.get('ARCHIVE_TRANSACTION_DAYS', 730))
+ARCHIVE_EVENT_DAYS = int(os.environ.get('ARCHIVE_EVENT_DAYS', 365))
+ARCHIVE_TASK_DAYS = int(os.environ.get('ARCHIVE_TASK_DAYS', 180))
+ARCHIVE_INTERVAL = timedelta(hours=float(os.environ.get('ARCHIVE_INTERVAL_HOURS', 24)))
+ARCHIVE_BATCH_SIZE = 1000
+
+# Collections whose old records are archived and can be read back with include_archived
+ARCHIVABLE = ['incomes', 'expenses', 'events', 'tasks']
+# Bucket kind -> the collection its transactions belong to
+BUCKET_KINDS = {kind: name for name, (kind, _) in transactions.BUCKETED_COLLECTIONS.items()}
+
+DUPLICATE_KEY = 11000
+
+
+# Reading
+
+def include_archived(args):
+    """Whether a request asked for archived records (?include_archived=true)."""
+    return args.get('include_archived', 'false').lower() == 'true'
+
+
+def collection(name):
+    """The archive of `name`, stored the same way as the live collection."""
+    if transactions.is_bucketed(name):
+        return transactions.BucketedCollection(name, ARCHIVE_PREFIX + transactions.BUCKET_COLLECTION)
+    return db[ARCHIVE_PREFIX + name]
+
+
+class WithArchive:
+    """A collection and its archive aggregated as one, through $unionWith."""
+
+    def __init__(self, name):
+        self.live = transactions.collection(name)
+        self.archived = collection(name)
+
+    def aggregate(self, pipeline, **kwargs):
+        # The leading $match runs on both sides, so each uses its own indexes
+        pipeline = list(pipeline)
+        match = pipeline.pop(0) if pipeline and '$match' in pipeline[0] else {'$match': {}}
+        if isinstance(self.archived, transactions.BucketedCollection):
+            union = {'coll': self.archived.bucket_collection, 'pipeline': self.archived.stages(match['$match'])}
+        else:
+            union = {'coll': self.archived.name, 'pipeline': [match]}
+        return self.live.aggregate([match, {'$unionWith': union}] + pipeline, **kwargs)
+
+
+def including(name, archived=True):
+    """Read `name` with its archive (or without it when archived is False)."""
+    if archived and name in ARCHIVABLE:
+        return WithArchive(name)
+    return transactions.collection(name)
+
+
+# Archiving
+
+def rules(now=None):
+    """(collection, query) pairs selecting what is due for the archive."""
+    now = now or datetime.now()
+    selected = []
+    if ARCHIVE_TRANSACTION_DAYS > 0:
+        horizon = now - timedelta(days=ARCHIVE_TRANSACTION_DAYS)
+        # Only months that ended before the horizon
+        cutoff = datetime(horizon.year, horizon.month, 1)
+        selected += [('incomes', {'date': {'$lt': cutoff}}), ('expenses', {'date': {'$lt': cutoff}}),
+                     (transactions.BUCKET_COLLECTION, {'month': {'$lt': cutoff.strftime('%Y-%m')}})]
+    if ARCHIVE_EVENT_DAYS > 0:
+        cutoff = now - timedelta(days=ARCHIVE_EVENT_DAYS)
+        selected.append(('events', {
+            'recurring': {'$in': [False, None]},
+            'start': {'$lt': cutoff},
+            '$or': [{'end': None}, {'end': {'$lt': cutoff}}]
+        }))
+    if ARCHIVE_TASK_DAYS > 0:
+        cutoff = now - timedelta(days=ARCHIVE_TASK_DAYS)
+        selected.append(('tasks', {'completed': True, 'completed_date': {'$lt': cutoff}}))
+    return selected
+
+
+def _copy(target, documents):
+    try:
+        target.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Copied by an earlier, interrupted pass
+        if any(error.get('code') != DUPLICATE_KEY for error in e.details.get('writeErrors', [])):
+            raise
+
+
+def _changes(name, batch):
+    """{user_id: change-log deletes} for a batch of archived documents."""
+    changes = defaultdict(list)
+    for doc in batch:
+        if name == transactions.BUCKET_COLLECTION:
+            collection = BUCKET_KINDS[doc['kind']]
+            changes[doc['user_id']].extend((collection, item['_id'], changelog.DELETE) for item in doc['items'])
+        else:
+            changes[doc['user_id']].append((name, doc['_id'], changelog.DELETE))
+    return changes
+
+
+def move(name, query):
+    """Move the documents matching query into the archive; returns how many were moved.
+
+    Synced clients see archived records as deleted, as the list endpoints
+    leave them out by default.
+    """
+    source, target = db[name], db[ARCHIVE_PREFIX + name]
+    moved = 0
+    while True:
+        batch = list(source.find(query).limit(ARCHIVE_BATCH_SIZE))
+        if not batch:
+            return moved
+        archived_at = datetime.now()
+        for doc in batch:
+            doc['archived_at'] = archived_at
+        _copy(target, batch)
+        source.delete_many({'_id': {'$in': [doc['_id'] for doc in batch]}})
+        for user_id, changes in _changes(name, batch).items():
+            changelog.record_changes(user_id, changes)
+        moved += len(batch)
+
+
+def run(now=None, dry_run=False):
+    """One archive pass; returns {collection: documents archived (or due, with dry_run)}."""
+    counts = {}
+    if not dry_run:
+        # Creates the compressed archive collections before anything is written to them
+        database.ensure_indexes()
+    for name, query in rules(now):
+        if dry_run:
+            counts[name] = db[name].count_documents(query)
+            continue
+        counts[name] = move(name, query)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move old transactions, events and completed tasks to the archive.')
+    parser.add_argument('--once', action='store_true', help='run a single pass and exit')
+    parser.add_argument('--dry-run', action='store_true', help='count what would be archived and exit')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    while True:
+        counts = run(dry_run=args.dry_run)
+        logger.info('%s: %s', 'Due for the archive' if args.dry_run else 'Archived',
+                    ', '.join(f'{name} {count}' for name, count in counts.items()) or 'nothing')
+        if args.once or args.dry_run:
+            return
+        time.sleep(ARCHIVE_INTERVAL.total_seconds())
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,14 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from models import User
 from database import db
-import bcrypt
+from pymongo.errors import DuplicateKeyError
+from passwords import PasswordHasherBusy
+from query_budget import query_budget
 
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@query_budget(commands=2)
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -15,7 +18,12 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        user = User.verify_password(db, username, password)
+        try:
+            user = User.verify_password(db, username, password)
+        except PasswordHasherBusy:
+            flash('Server is busy, please try again shortly', 'danger')
+            return render_template('login.html'), 503
+        
         if user:
             login_user(user)
             flash('Logged in successfully!', 'success')
@@ -26,6 +34,7 @@ def login():
     return render_template('login.html')
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
+@query_budget(commands=1)
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -41,17 +50,19 @@ def register():
             flash('Passwords do not match', 'danger')
             return render_template('register.html')
         
-        # Check if user already exists
-        if db.users.find_one({'username': username}):
-            flash('Username already exists', 'danger')
-            return render_template('register.html')
-        
-        if db.users.find_one({'email': email}):
-            flash('Email already exists', 'danger')
+        # Create user; the unique indexes reject existing usernames and emails
+        try:
+            User.create_user(db, username, email, password)
+        except PasswordHasherBusy:
+            flash('Server is busy, please try again shortly', 'danger')
+            return render_template('register.html'), 503
+        except DuplicateKeyError as e:
+            key_pattern = (e.details or {}).get('keyPattern', {})
+            if 'email' in key_pattern or 'email_unique' in str(e):
+                flash('Email already exists', 'danger')
+            else:
+                flash('Username already exists', 'danger')
             return render_template('register.html')
-        
-        # Create user
-        User.create_user(db, username, email, password)
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('auth.login'))
     
@@ -0,0 +1,125 @@
+"""Login throughput vs API latency under concurrent load.
+
+Runs login workers and API workers side by side against a running server and
+reports throughput and latency percentiles for each, so the effect of password
+hashing on the rest of the app is visible.
+
+    python benchmarks/login_load.py --url http://localhost:8000 \
+        --username bench --password bench --login-threads 8 --api-threads 8
+"""
+import argparse
+import http.cookiejar
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _opener():
+    jar = http.cookiejar.CookieJar()
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), _NoRedirect)
+
+
+def _login(opener, url, username, password):
+    data = urllib.parse.urlencode({'username': username, 'password': password}).encode('utf-8')
+    try:
+        response = opener.open(f'{url}/login', data=data)
+        return response.status
+    except urllib.error.HTTPError as e:
+        # A successful login answers with a redirect, which we do not follow
+        return e.code
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def add(self, seconds, status):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def stats(self, duration):
+        ordered = sorted(self.latencies)
+
+        def pct(p):
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+        return {
+            'requests': len(ordered),
+            'throughput': round(len(ordered) / duration, 2) if duration else 0.0,
+            'p50_ms': round(pct(0.50), 2),
+            'p95_ms': round(pct(0.95), 2),
+            'p99_ms': round(pct(0.99), 2),
+            'mean_ms': round(statistics.mean(ordered) * 1000, 2),
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())}
+        } if ordered else {'requests': 0, 'statuses': {}}
+
+    def report(self, name, duration):
+        if not self.latencies:
+            return f'{name}: no requests completed'
+        stats = self.stats(duration)
+        return (f"{name}: {stats['requests']} requests, {stats['throughput']:.1f} req/s, "
+                f"p50 {stats['p50_ms']:.1f}ms p95 {stats['p95_ms']:.1f}ms p99 {stats['p99_ms']:.1f}ms "
+                f"mean {stats['mean_ms']:.1f}ms, statuses {self.statuses}")
+
+
+def login_worker(args, recorder, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        status = _login(_opener(), args.url, args.username, args.password)
+        recorder.add(time.perf_counter() - start, status)
+
+
+def api_worker(args, recorder, stop):
+    opener = _opener()
+    _login(opener, args.url, args.username, args.password)
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            status = opener.open(f'{args.url}{args.endpoint}').status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        recorder.add(time.perf_counter() - start, status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--endpoint', default='/api/get_financial_summary')
+    parser.add_argument('--login-threads', type=int, default=4)
+    parser.add_argument('--api-threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+
+    logins, api = Recorder(), Recorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=login_worker, args=(args, logins, stop)) for _ in range(args.login_threads)]
+    threads += [threading.Thread(target=api_worker, args=(args, api, stop)) for _ in range(args.api_threads)]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(logins.report('login', elapsed))
+    print(api.report(f'api {args.endpoint}', elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""Benchmark the main endpoints at fixed concurrency and keep the results.
+
+Drives either a running server over HTTP or the app in-process through Flask's
+test client. In-process runs can use mongomock as an in-memory stand-in for
+MongoDB, so no server or database is needed:
+
+    python benchmarks/run.py --in-process --mongomock --seed-users 4 --years 1
+    python benchmarks/seed.py --users 10 --years 3
+    python benchmarks/run.py --url http://localhost:8000 --users 10 --server-pid 1234
+
+Every scenario runs for --duration seconds on --concurrency threads, each
+logged in as one of the seeded users. Latency percentiles, throughput and
+memory are printed and written to benchmarks/results/<time>-<commit>.json;
+pass --compare with an earlier file to see the change.
+"""
+from datetime import datetime
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from login_load import Recorder, _NoRedirect
+import seed
+
+RESULTS_DIR = os.path.join(HERE, 'results')
+SCENARIO_ORDER = ['login', 'summary', 'expenses', 'events', 'export', 'import']
+
+
+# Sessions
+
+class HttpSession:
+    def __init__(self, url):
+        self.url = url
+        jar = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), _NoRedirect)
+
+    def request(self, method, path, form=None, upload=None, body=False):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif upload is not None:
+            data, headers['Content-Type'] = _multipart(*upload)
+        request = urllib.request.Request(self.url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                content = response.read()
+                return response.status, content if body else len(content)
+        except urllib.error.HTTPError as e:
+            content = e.read()
+            return e.code, content if body else len(content)
+
+
+class FlaskSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, upload=None, body=False):
+        if upload is not None:
+            filename, content = upload
+            form = {'file': (io.BytesIO(content), filename)}
+        response = self.client.open(path, method=method, data=form)
+        content = response.get_data()
+        response.close()
+        return response.status_code, content if body else len(content)
+
+
+def _multipart(filename, body):
+    boundary = uuid.uuid4().hex
+    data = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8') + body + \
+        f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return data, f'multipart/form-data; boundary={boundary}'
+
+
+# Scenarios
+
+def _import_file(rows=200):
+    lines = [json.dumps({'_collection': 'expenses', 'amount': 12.5, 'category': 'Food',
+                         'date': f'2020-01-{day % 28 + 1:02d}', 'description': 'benchmark import'})
+             for day in range(rows)]
+    return ('benchmark.ndjson', ('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+def login(session, username, password):
+    return session.request('POST', '/login', form={'username': username, 'password': password})
+
+
+def import_and_wait(session, upload):
+    """Upload a file and poll until the background job finishes; timed end to end."""
+    status, body = session.request('POST', '/api/import_data', upload=upload, body=True)
+    if status != 202:
+        return status, body
+    job_id = json.loads(body)['job_id']
+    while True:
+        time.sleep(0.05)
+        status, body = session.request('GET', f'/api/import_status/{job_id}', body=True)
+        if status != 200:
+            return status, body
+        state = json.loads(body)['job']['state']
+        if state in ('completed', 'failed'):
+            return (200 if state == 'completed' else 500), body
+
+
+def scenarios(password, import_rows):
+    upload = _import_file(import_rows)
+    return {
+        # Logs in on a fresh session every time; the others reuse the thread's session
+        'login': lambda make_session, session, username: login(make_session(), username, password),
+        'summary': lambda make_session, session, username: session.request('GET', '/api/get_financial_summary'),
+        'expenses': lambda make_session, session, username: session.request('GET', '/api/get_expenses'),
+        'events': lambda make_session, session, username: session.request('GET', '/api/get_events'),
+        'export': lambda make_session, session, username: session.request('GET', '/api/export_data'),
+        'import': lambda make_session, session, username: import_and_wait(session, upload)
+    }
+
+
+# Memory
+
+def _rss_mb(pid=None):
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if pid is None:
+        # ru_maxrss is in KB on Linux (peak rather than current)
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return None
+
+
+# Driver
+
+def run_scenario(name, action, make_session, usernames, password, args):
+    sessions = []
+    for i in range(args.concurrency):
+        session = make_session()
+        username = usernames[i % len(usernames)]
+        login(session, username, password)
+        sessions.append((session, username))
+
+    recorder = Recorder()
+    stop = threading.Event()
+    record = threading.Event()
+
+    def worker(session, username):
+        while not stop.is_set():
+            start = time.perf_counter()
+            status, _ = action(make_session, session, username)
+            if record.is_set():
+                recorder.add(time.perf_counter() - start, status)
+
+    threads = [threading.Thread(target=worker, args=pair) for pair in sessions]
+    rss_before = _rss_mb(args.server_pid)
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    record.set()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    stop.set()
+    elapsed = time.perf_counter() - started
+    for thread in threads:
+        thread.join()
+
+    result = recorder.stats(elapsed)
+    result['rss_mb'] = _rss_mb(args.server_pid)
+    result['rss_delta_mb'] = (round(result['rss_mb'] - rss_before, 1)
+                              if result['rss_mb'] is not None and rss_before is not None else None)
+    if args.tracemalloc:
+        result['peak_alloc_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    print(recorder.report(f'{name:>9}', elapsed) + f", rss {result['rss_mb']}MB")
+    return result
+
+
+def _commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=HERE,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(previous, current):
+    print(f"\nCompared with {previous['commit']} ({previous['timestamp']}):")
+    for name, result in current['results'].items():
+        before = previous['results'].get(name)
+        if not before or not before.get('requests') or not result.get('requests'):
+            continue
+        changes = []
+        for field in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput'):
+            old, new = before[field], result[field]
+            delta = (new - old) / old * 100 if old else 0.0
+            changes.append(f'{field} {old} -> {new} ({delta:+.1f}%)')
+        print(f'{name:>9}: ' + ', '.join(changes))
+
+
+def _load_app(use_mongomock):
+    os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017')
+    import database
+    if use_mongomock:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit('--mongomock needs the mongomock package (pip install mongomock)')
+        database.client = mongomock.MongoClient()
+        database.db = database.client.money_event_manager
+    from app import app
+    return app, database.db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='benchmark a running server instead of the app in-process')
+    parser.add_argument('--in-process', action='store_true', help="drive the app with Flask's test client")
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory MongoDB stand-in (in-process only)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIO_ORDER))
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--users', type=int, default=4, help='number of seeded users to log in as')
+    parser.add_argument('--prefix', default='bench')
+    parser.add_argument('--password', default='benchmark')
+    parser.add_argument('--seed-users', type=int, default=0, help='seed this many users before running')
+    parser.add_argument('--years', type=int, default=1, help='years of history for --seed-users')
+    parser.add_argument('--import-rows', type=int, default=200)
+    parser.add_argument('--server-pid', type=int, help='report the RSS of this server process')
+    parser.add_argument('--tracemalloc', action='store_true', help='report peak Python allocations (in-process)')
+    parser.add_argument('--output', help='results file (default benchmarks/results/<time>-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    args = parser.parse_args()
+
+    if not args.url and not args.in_process:
+        parser.error('pass --url or --in-process')
+
+    if args.in_process:
+        app, db = _load_app(args.mongomock)
+        make_session = lambda: FlaskSession(app)
+    else:
+        make_session = lambda: HttpSession(args.url.rstrip('/'))
+        db = None
+
+    if args.seed_users:
+        if db is None:
+            from database import db
+        seed.seed(db, args.seed_users, args.years, args.password, args.prefix)
+    usernames = [f'{args.prefix}{i}' for i in range(max(args.users, 1))]
+    if args.seed_users:
+        usernames = usernames[:args.seed_users]
+
+    actions = scenarios(args.password, args.import_rows)
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in actions]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    current = {
+        'commit': _commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'target': args.url or ('in-process+mongomock' if args.mongomock else 'in-process'),
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'users': len(usernames),
+            'seed_users': args.seed_users,
+            'years': args.years,
+            'python': sys.version.split()[0]
+        },
+        'results': {}
+    }
+    for name in names:
+        current['results'][name] = run_scenario(name, actions[name], make_session, usernames, args.password, args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{current['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as out:
+        json.dump(current, out, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), current)
+
+
+if __name__ == '__main__':
+    main()
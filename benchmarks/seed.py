@@ -0,0 +1,143 @@
+"""Seed MongoDB with synthetic users for benchmarking.
+
+Data is generated from a fixed random seed, so the same arguments always
+produce the same dataset. Users are named <prefix>0, <prefix>1, ... and all
+share one password.
+
+    python benchmarks/seed.py --users 20 --years 3
+    python benchmarks/seed.py --users 5 --years 10 --reset
+"""
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+INCOME_SOURCES = ['Salary', 'Freelance', 'Investments', 'Rental', 'Gifts']
+EXPENSE_CATEGORIES = ['Food', 'Transport', 'Housing', 'Utilities', 'Entertainment', 'Health', 'Shopping', 'Education']
+BILL_NAMES = ['Rent', 'Electricity', 'Water', 'Internet', 'Phone', 'Insurance']
+EVENT_TITLES = ['Standup', 'Gym', 'Dentist', 'Team lunch', 'Review', 'Call with family', 'Study']
+RECURRENCE_PATTERNS = ['daily', 'weekly', 'monthly', 'yearly']
+PRIORITIES = ['low', 'medium', 'high']
+SEED_COLLECTIONS = ['incomes', 'expenses', 'bills', 'budgets', 'goals', 'events', 'tasks']
+INSERT_BATCH = 5000
+
+
+def _day(rng, start, days):
+    return start + timedelta(days=rng.randrange(days))
+
+
+def generate_user_data(user_id, years, rng, now):
+    """Yield (collection, document) for one user's history ending at `now`."""
+    start = datetime(now.year, now.month, now.day) - timedelta(days=365 * years)
+    days = 365 * years
+
+    for month in range(12 * years + 1):
+        paid_on = start + timedelta(days=30 * month)
+        yield 'incomes', {'user_id': user_id, 'amount': float(rng.randrange(1500, 4000)), 'source': 'Salary',
+                          'date': paid_on, 'description': 'Monthly salary', 'created_at': paid_on}
+        month_key = paid_on.strftime('%Y-%m')
+        for category in rng.sample(EXPENSE_CATEGORIES, 4):
+            yield 'budgets', {'user_id': user_id, 'category': category, 'amount': float(rng.randrange(100, 800)),
+                              'month': month_key, 'created_at': paid_on}
+
+    for _ in range(10 * years):
+        date = _day(rng, start, days)
+        yield 'incomes', {'user_id': user_id, 'amount': round(rng.uniform(20, 900), 2),
+                          'source': rng.choice(INCOME_SOURCES[1:]), 'date': date, 'description': '', 'created_at': date}
+
+    # Roughly two expenses a day
+    for _ in range(2 * days):
+        date = _day(rng, start, days) + timedelta(minutes=rng.randrange(24 * 60))
+        yield 'expenses', {'user_id': user_id, 'amount': round(rng.uniform(1, 250), 2),
+                           'category': rng.choice(EXPENSE_CATEGORIES), 'date': date,
+                           'description': '', 'created_at': date}
+
+    for name in BILL_NAMES:
+        due = datetime(now.year, now.month, rng.randrange(1, 29))
+        yield 'bills', {'user_id': user_id, 'name': name, 'amount': float(rng.randrange(20, 1200)),
+                        'due_date': due, 'recurring': True, 'paid': False, 'created_at': start}
+
+    for i in range(3):
+        yield 'goals', {'user_id': user_id, 'name': f'Goal {i + 1}', 'target_amount': float(rng.randrange(1000, 20000)),
+                        'current_amount': float(rng.randrange(0, 1000)),
+                        'target_date': now + timedelta(days=rng.randrange(30, 900)), 'created_at': start}
+
+    for _ in range(100 * years):
+        begins = _day(rng, start, days + 60) + timedelta(hours=rng.randrange(7, 20))
+        recurring = rng.random() < 0.1
+        yield 'events', {'user_id': user_id, 'title': rng.choice(EVENT_TITLES), 'start': begins,
+                         'end': begins + timedelta(minutes=rng.choice([30, 60, 90])), 'description': '',
+                         'recurring': recurring,
+                         'recurrence_pattern': rng.choice(RECURRENCE_PATTERNS) if recurring else None,
+                         'created_at': begins}
+
+    for i in range(50 * years):
+        due = _day(rng, start, days + 60)
+        done = due < now and rng.random() < 0.8
+        yield 'tasks', {'user_id': user_id, 'name': f'Task {i + 1}', 'due_date': due,
+                        'priority': rng.choice(PRIORITIES), 'description': '', 'completed': done,
+                        'completed_date': due if done else None, 'created_at': due - timedelta(days=7)}
+
+
+def seed(db, users=10, years=2, password='benchmark', prefix='bench', seed_value=42, reset=False, now=None):
+    """Create the synthetic users and their data; returns the list of usernames."""
+    from passwords import hash_password
+    import rollups
+
+    rng = random.Random(seed_value)
+    now = now or datetime.now()
+    hashed = hash_password(password)
+    usernames = [f'{prefix}{i}' for i in range(users)]
+
+    if reset:
+        existing = [str(user['_id']) for user in db.users.find({'username': {'$in': usernames}}, {'_id': 1})]
+        for collection in SEED_COLLECTIONS + [rollups.ROLLUP_COLLECTION]:
+            db[collection].delete_many({'user_id': {'$in': existing}})
+        db.users.delete_many({'username': {'$in': usernames}})
+
+    for username in usernames:
+        if db.users.find_one({'username': username}, {'_id': 1}):
+            continue
+        user_id = str(db.users.insert_one({
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': hashed,
+            'currency': 'Tsh',
+            'notification_settings': {'email': True, 'bills': True, 'events': True, 'time': '09:00'}
+        }).inserted_id)
+
+        batches = {}
+        for collection, document in generate_user_data(user_id, years, rng, now):
+            batch = batches.setdefault(collection, [])
+            batch.append(document)
+            if len(batch) >= INSERT_BATCH:
+                db[collection].insert_many(batch, ordered=False)
+                batches[collection] = []
+        for collection, batch in batches.items():
+            if batch:
+                db[collection].insert_many(batch, ordered=False)
+        rollups.rebuild_rollups(user_id)
+
+    return usernames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--password', default='benchmark')
+    parser.add_argument('--prefix', default='bench')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='delete the users and their data first')
+    args = parser.parse_args()
+
+    from database import db
+    usernames = seed(db, args.users, args.years, args.password, args.prefix, args.seed, args.reset)
+    print(f'Seeded {len(usernames)} users ({usernames[0]}..{usernames[-1]}) with {args.years} years of data')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+import hashlib
+import os
+import threading
+import time
+from flask import request, make_response, Response
+from flask_login import current_user
+from database import db
+import changelog
+
+# Per-user response cache
+# Read endpoints are cached per (user, version, endpoint, query string). The
+# version is the user's change-log version (see changelog.py), which every
+# write to the user's data already moves forward, so stale entries are never
+# served and simply age out. Versions live in MongoDB so all gunicorn workers
+# agree on them; the cached bodies live in the configured backend.
+#
+# RESPONSE_CACHE_BACKEND: 'memory' (per worker, default), 'mongo' (shared by all
+# workers) or 'none'.
+
+CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 2048))
+
+ENTRY_COLLECTION = 'response_cache'
+
+
+class MemoryBackend:
+    """Thread-safe LRU with per-entry TTL, local to one worker process."""
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class MongoBackend:
+    """Entries shared by every worker; expiry is handled by a TTL index."""
+
+    def __init__(self, collection=ENTRY_COLLECTION):
+        self.collection = collection
+
+    def get(self, key):
+        entry = db[self.collection].find_one({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}})
+        if entry is None:
+            return None
+        return {'body': bytes(entry['body']), 'mimetype': entry['mimetype'], 'etag': entry['etag']}
+
+    def set(self, key, value, ttl):
+        db[self.collection].replace_one(
+            {'_id': key},
+            dict(value, expires_at=datetime.utcnow() + timedelta(seconds=ttl)),
+            upsert=True
+        )
+
+    def clear(self):
+        db[self.collection].delete_many({})
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'mongo': MongoBackend
+}
+
+_backend_name = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory').lower()
+backend = BACKENDS[_backend_name]() if _backend_name in BACKENDS else None
+
+
+def get_version(user_id):
+    return changelog.current_version(user_id)
+
+
+def _cache_key(user_id, version, name):
+    params = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    return f'{user_id}:{version}:{name}:{params}'
+
+
+def cached_response(name):
+    """Cache a user's GET response and answer If-None-Match with 304 Not Modified."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if backend is None:
+                return view(*args, **kwargs)
+
+            user_id = current_user.id
+            key = _cache_key(user_id, get_version(user_id), name)
+            entry = backend.get(key)
+
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = {
+                    'body': body,
+                    'mimetype': response.mimetype,
+                    'etag': hashlib.sha256(body).hexdigest()
+                }
+                backend.set(key, entry, CACHE_TTL)
+
+            if request.if_none_match.contains(entry['etag']):
+                response = Response(status=304)
+            else:
+                response = Response(entry['body'], mimetype=entry['mimetype'])
+            response.set_etag(entry['etag'])
+            # Clients must revalidate, which is a cheap 304 while nothing changed
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
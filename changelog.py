@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from database import db
+import pubsub
+import transactions
+
+# Per-user change log
+# Every write to a user's documents appends one entry per document:
+#
+#     {user_id, version, collection, item_id, op, at}
+#
+# op is 'insert', 'update' or 'delete'. Versions come from a per-user counter
+# and increase by one per entry, so a client that has applied everything up to
+# version N asks for entries after N (see changes_since). Bulk rewrites such as
+# an import or a data reset append a single 'reset' entry instead, which tells
+# clients to reload everything. Entries expire after CHANGE_LOG_DAYS; a client
+# that has been away longer gets a full reload too. Each write is also published
+# to the user's open /api/stream connections (see pubsub.py).
+
+CHANGE_COLLECTION = 'change_log'
+VERSION_COLLECTION = 'change_versions'
+# The collections a full export holds (exporter.EXPORT_COLLECTIONS, which imports
+# this module through archive.py)
+SYNC_COLLECTIONS = ['incomes', 'expenses', 'events', 'budgets', 'goals', 'tasks', 'bills']
+
+INSERT, UPDATE, DELETE, RESET, SNAPSHOT = 'insert', 'update', 'delete', 'reset', 'snapshot'
+
+
+def _reserve(user_id, count):
+    """Reserve `count` consecutive versions; returns the first."""
+    counter = db[VERSION_COLLECTION].find_one_and_update(
+        {'_id': user_id}, {'$inc': {'version': count}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return counter['version'] - count + 1
+
+
+def current_version(user_id):
+    """The user's latest reserved version (0 before the first write)."""
+    counter = db[VERSION_COLLECTION].find_one({'_id': user_id}, {'version': 1})
+    return counter['version'] if counter else 0
+
+
+def record(user_id, collection, item_ids, op):
+    """Append one entry per item id; returns the last version written."""
+    if isinstance(item_ids, (str, bytes)) or not hasattr(item_ids, '__iter__'):
+        item_ids = [item_ids]
+    return record_changes(user_id, [(collection, item_id, op) for item_id in item_ids])
+
+
+def record_changes(user_id, changes):
+    """Append (collection, item_id, op) entries in one go; returns the last version written."""
+    if not changes:
+        return None
+    first = _reserve(user_id, len(changes))
+    now = datetime.utcnow()
+    db[CHANGE_COLLECTION].insert_many([
+        {'user_id': user_id, 'version': first + offset, 'collection': collection,
+         'item_id': str(item_id), 'op': op, 'at': now}
+        for offset, (collection, item_id, op) in enumerate(changes)
+    ], ordered=False)
+    version = first + len(changes) - 1
+    pubsub.broker.publish(user_id, version, sorted({collection for collection, _, _ in changes}))
+    return version
+
+
+def record_reset(user_id, op=RESET):
+    """Mark that the user's documents were rewritten in bulk."""
+    version = _reserve(user_id, 1)
+    db[CHANGE_COLLECTION].insert_one({'user_id': user_id, 'version': version, 'collection': None,
+                                      'item_id': None, 'op': op, 'at': datetime.utcnow()})
+    if op == RESET:
+        pubsub.broker.publish(user_id, version, SYNC_COLLECTIONS)
+    return version
+
+
+def _object_ids(item_ids):
+    ids = []
+    for item_id in item_ids:
+        try:
+            ids.append(ObjectId(item_id))
+        except InvalidId:
+            ids.append(item_id)
+    return ids
+
+
+def _documents(collection, user_id, item_ids=None):
+    query = {'user_id': user_id}
+    if item_ids is not None:
+        query['_id'] = {'$in': item_ids}
+    return list(transactions.collection(collection).find(query))
+
+
+def snapshot(user_id):
+    """Every synced document of the user, with the version it is current as of."""
+    latest = db[CHANGE_COLLECTION].find_one({'user_id': user_id}, {'version': 1}, sort=[('version', -1)])
+    # Users with no history yet get a marker, so their next request can be a delta
+    version = latest['version'] if latest else record_reset(user_id, SNAPSHOT)
+    changes = {
+        collection: {'inserted': _documents(collection, user_id), 'updated': [], 'deleted': []}
+        for collection in SYNC_COLLECTIONS
+    }
+    return {'version': version, 'full': True, 'more': False, 'changes': changes}
+
+
+def changes_since(user_id, since, limit=500):
+    """Documents inserted, updated and deleted after version `since`.
+
+    Entries are collapsed per document, so an item inserted and then updated is
+    reported once as inserted, and one inserted and then deleted not at all.
+    Returns a full snapshot when `since` is 0, has expired from the log, or is
+    followed by a reset.
+    """
+    if since <= 0:
+        return snapshot(user_id)
+
+    entries = list(db[CHANGE_COLLECTION].find(
+        {'user_id': user_id, 'version': {'$gte': since}},
+        {'_id': 0, 'version': 1, 'collection': 1, 'item_id': 1, 'op': 1}
+    ).sort('version', 1).limit(limit + 2))
+    # The entry the client last applied must still be there, otherwise the log
+    # has been trimmed past it
+    if not entries or entries[0]['version'] != since:
+        return snapshot(user_id)
+
+    latest = {}
+    version, more = since, False
+    for entry in entries[1:]:
+        if entry['version'] != version + 1:
+            # A concurrent write has reserved this version but not stored it yet
+            break
+        if len(latest) >= limit:
+            more = True
+            break
+        if entry['op'] == RESET:
+            return snapshot(user_id)
+        version = entry['version']
+        if entry['op'] == SNAPSHOT:
+            continue
+        key = (entry['collection'], entry['item_id'])
+        first_op = latest.pop(key, (entry['op'],))[0]
+        latest[key] = (first_op, entry['op'])
+    else:
+        # Every fetched entry was applied; there may be more past them
+        more = len(entries) == limit + 2
+
+    by_collection = OrderedDict()
+    for (collection, item_id), (first_op, last_op) in latest.items():
+        if last_op == DELETE:
+            if first_op != INSERT:
+                by_collection.setdefault(collection, {})[item_id] = DELETE
+            continue
+        by_collection.setdefault(collection, {})[item_id] = INSERT if first_op == INSERT else UPDATE
+
+    changes = {}
+    for collection, items in by_collection.items():
+        result = changes[collection] = {'inserted': [], 'updated': [], 'deleted': []}
+        live = [item_id for item_id, op in items.items() if op != DELETE]
+        found = {str(doc['_id']): doc for doc in _documents(collection, user_id, _object_ids(live))} if live else {}
+        for item_id, op in items.items():
+            if op == DELETE or item_id not in found:
+                result['deleted'].append(item_id)
+            else:
+                result['inserted' if op == INSERT else 'updated'].append(found[item_id])
+
+    return {'version': version, 'full': False, 'more': more, 'changes': changes}
+
+
+def changed_collections(user_id, since, limit=1000):
+    """(latest version, collections changed after `since`), for push notifications.
+
+    All collections are reported when the entries after `since` include a
+    reset or cannot all be accounted for.
+    """
+    entries = list(db[CHANGE_COLLECTION].find(
+        {'user_id': user_id, 'version': {'$gt': since}},
+        {'_id': 0, 'version': 1, 'collection': 1, 'op': 1}
+    ).sort('version', 1).limit(limit))
+    if not entries:
+        return since, []
+    latest = entries[-1]['version']
+    if (entries[0]['version'] != since + 1 or len(entries) == limit
+            or any(entry['op'] == RESET for entry in entries)):
+        return latest, list(SYNC_COLLECTIONS)
+    return latest, sorted({entry['collection'] for entry in entries if entry['collection']})
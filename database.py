@@ -1,6 +1,12 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import CollectionInvalid, OperationFailure
+import logging
 import os
+import threading
 from dotenv import load_dotenv
+import mongo_metrics
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -10,7 +16,245 @@ mongo_uri = os.environ.get('MONGODB_URI')
 if not mongo_uri:
     raise ValueError("No MONGODB_URI environment variable set")
 
-client = MongoClient(mongo_uri)
+# Client options from the environment. Only variables that are set are passed,
+# so options given in the URI keep working.
+CLIENT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': ('maxPoolSize', int),
+    'MONGO_MIN_POOL_SIZE': ('minPoolSize', int),
+    'MONGO_MAX_IDLE_TIME_MS': ('maxIdleTimeMS', int),
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': ('waitQueueTimeoutMS', int),
+    'MONGO_CONNECT_TIMEOUT_MS': ('connectTimeoutMS', int),
+    'MONGO_SOCKET_TIMEOUT_MS': ('socketTimeoutMS', int),
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': ('serverSelectionTimeoutMS', int),
+    'MONGO_COMPRESSORS': ('compressors', str),
+    'MONGO_READ_CONCERN': ('readConcernLevel', str),
+    'MONGO_READ_PREFERENCE': ('readPreference', str),
+    'MONGO_APP_NAME': ('appname', str)
+}
+
+
+def client_options(environ=os.environ):
+    options = {}
+    for variable, (option, convert) in CLIENT_OPTIONS.items():
+        if environ.get(variable):
+            options[option] = convert(environ[variable])
+    if environ.get('MONGO_MONITORING', 'true').lower() == 'true':
+        options['event_listeners'] = mongo_metrics.LISTENERS
+    return options
+
+
+# Lazy, fork-aware client
+# MongoClient is not fork-safe, so nothing connects at import time: the client
+# is created on first use in each process. A gunicorn master started with
+# --preload imports the app without touching MongoDB, and every forked worker
+# opens its own pool. `db` is a stand-in for the database that resolves to the
+# current process's client on each attribute access, so modules can keep doing
+# `from database import db` at import time.
+
+DATABASE_NAME = 'money_event_manager'
+
+client = None
+_client_pid = None
+_database = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """This process's MongoClient, created on first use and again after a fork."""
+    global client, _client_pid
+    # A client assigned from outside (tests, benchmarks) has no pid and is kept
+    if client is not None and _client_pid in (None, os.getpid()):
+        return client
+    with _client_lock:
+        if client is None or _client_pid not in (None, os.getpid()):
+            client = MongoClient(mongo_uri, **client_options())
+            _client_pid = os.getpid()
+            if int(os.environ.get('MONGO_STATS_LOG_SECONDS', 0)) > 0:
+                mongo_metrics.start_reporter(int(os.environ['MONGO_STATS_LOG_SECONDS']))
+    return client
+
+
+def get_database():
+    global _database
+    current = get_client()
+    if _database is None or _database.client is not current:
+        _database = current[DATABASE_NAME]
+    return _database
+
+
+class LazyDatabase:
+    """Proxy for the application database; connects on first use in each process."""
+
+    def __getattr__(self, name):
+        return getattr(get_database(), name)
+
+    def __getitem__(self, name):
+        return get_database()[name]
+
+    def __repr__(self):
+        return f'LazyDatabase({DATABASE_NAME!r})'
+
+
+db = LazyDatabase()
+
+# How long the sync change log keeps entries (see changelog.py)
+CHANGE_LOG_DAYS = int(os.environ.get('CHANGE_LOG_DAYS', 30))
+
+# Archive collections (see archive.py) are named after the collection they
+# archive and created with a stronger block compressor than the default
+ARCHIVE_PREFIX = 'archived_'
+ARCHIVE_COMPRESSOR = os.environ.get('ARCHIVE_COMPRESSOR', 'zstd')
+ARCHIVED_COLLECTIONS = ['incomes', 'expenses', 'events', 'tasks', 'transaction_buckets']
+
+# Imports (see importer.py) stage documents in import_staging_<collection>
+# until the whole file has been read
+IMPORT_STAGING_PREFIX = 'import_staging_'
+IMPORTED_COLLECTIONS = ['incomes', 'expenses', 'budgets', 'bills', 'goals', 'events', 'tasks']
+
+# Options for collections that have to be created explicitly
+COLLECTION_OPTIONS = {
+    ARCHIVE_PREFIX + name: {'storageEngine': {'wiredTiger': {'configString': f'block_compressor={ARCHIVE_COMPRESSOR}'}}}
+    for name in ARCHIVED_COLLECTIONS
+}
+
+# Index registry
+# Every per-user query filters on user_id and sorts on a date field, so each
+# collection gets a compound index matching that access pattern. The list
+# endpoints page on (date, _id), hence the trailing _id key.
+INDEXES = {
+    'users': [
+        ([('username', ASCENDING)], {'name': 'username_unique', 'unique': True}),
+        ([('email', ASCENDING)], {'name': 'email_unique', 'unique': True})
+    ],
+    'incomes': [
+        ([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], {'name': 'user_date'}),
+        # Cross-user scan by the archive job
+        ([('date', ASCENDING)], {'name': 'date'})
+    ],
+    'expenses': [
+        ([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], {'name': 'user_date'}),
+        ([('date', ASCENDING)], {'name': 'date'})
+    ],
+    'bills': [
+        ([('user_id', ASCENDING), ('due_date', ASCENDING), ('_id', ASCENDING)], {'name': 'user_due_date'}),
+        # Cross-user scans by the reminder scheduler
+        ([('paid', ASCENDING), ('due_date', ASCENDING)], {'name': 'paid_due_date'}),
+        ([('recurring', ASCENDING), ('due_date', ASCENDING)], {'name': 'recurring_due_date'})
+    ],
+    'budgets': [
+        ([('user_id', ASCENDING), ('month', ASCENDING)], {'name': 'user_month'})
+    ],
+    'goals': [
+        ([('user_id', ASCENDING)], {'name': 'user'})
+    ],
+    'events': [
+        ([('user_id', ASCENDING), ('start', ASCENDING)], {'name': 'user_start'}),
+        ([('user_id', ASCENDING), ('end', ASCENDING)], {'name': 'user_end'}),
+        ([('user_id', ASCENDING), ('recurring', ASCENDING), ('start', ASCENDING)], {'name': 'user_recurring_start'}),
+        ([('start', ASCENDING)], {'name': 'start'}),
+        ([('recurring', ASCENDING), ('next_occurrence', ASCENDING)], {'name': 'recurring_next_occurrence'})
+    ],
+    'tasks': [
+        ([('user_id', ASCENDING), ('due_date', ASCENDING)], {'name': 'user_due_date'}),
+        ([('completed', ASCENDING), ('due_date', ASCENDING)], {'name': 'completed_due_date'}),
+        # Cross-user scan by the archive job
+        ([('completed', ASCENDING), ('completed_date', ASCENDING)], {'name': 'completed_completed_date'})
+    ],
+    'monthly_rollups': [
+        ([('user_id', ASCENDING), ('kind', ASCENDING), ('month', ASCENDING), ('category', ASCENDING)],
+         {'name': 'user_kind_month_category', 'unique': True})
+    ],
+    'response_cache': [
+        ([('expires_at', ASCENDING)], {'name': 'expires_at_ttl', 'expireAfterSeconds': 0})
+    ],
+    'reminder_log': [
+        ([('sent_at', ASCENDING)], {'name': 'sent_at_ttl', 'expireAfterSeconds': 90 * 24 * 3600})
+    ],
+    'change_log': [
+        ([('user_id', ASCENDING), ('version', ASCENDING)], {'name': 'user_version', 'unique': True}),
+        ([('at', ASCENDING)], {'name': 'at_ttl', 'expireAfterSeconds': CHANGE_LOG_DAYS * 24 * 3600})
+    ],
+    'sync_replays': [
+        ([('created_at', ASCENDING)], {'name': 'created_at_ttl', 'expireAfterSeconds': 7 * 24 * 3600})
+    ],
+    # Monthly buckets used with TRANSACTION_STORAGE=buckets (see transactions.py)
+    'transaction_buckets': [
+        ([('user_id', ASCENDING), ('kind', ASCENDING), ('month', DESCENDING)], {'name': 'user_kind_month'}),
+        ([('items._id', ASCENDING)], {'name': 'item_id'}),
+        ([('month', ASCENDING)], {'name': 'month'})
+    ],
+    # Archives are only read per user
+    'archived_incomes': [
+        ([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], {'name': 'user_date'})
+    ],
+    'archived_expenses': [
+        ([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], {'name': 'user_date'})
+    ],
+    'archived_events': [
+        ([('user_id', ASCENDING), ('start', ASCENDING)], {'name': 'user_start'})
+    ],
+    'archived_tasks': [
+        ([('user_id', ASCENDING), ('due_date', ASCENDING)], {'name': 'user_due_date'})
+    ],
+    'archived_transaction_buckets': [
+        ([('user_id', ASCENDING), ('kind', ASCENDING), ('month', DESCENDING)], {'name': 'user_kind_month'})
+    ],
+    'import_jobs': [
+        # Sweep for jobs whose worker went away
+        ([('status', ASCENDING), ('updated_at', ASCENDING)], {'name': 'status_updated_at'})
+    ]
+}
+INDEXES.update({
+    IMPORT_STAGING_PREFIX + name: [([('job_id', ASCENDING), ('_id', ASCENDING)], {'name': 'job_id'})]
+    for name in IMPORTED_COLLECTIONS
+})
+
+
+def ensure_indexes(database=None):
+    """Create the collections in COLLECTION_OPTIONS and every index in INDEXES. Safe to call on every worker boot."""
+    database = database if database is not None else db
+    existing = set(database.list_collection_names())
+    for collection, options in COLLECTION_OPTIONS.items():
+        if collection not in existing:
+            try:
+                database.create_collection(collection, **options)
+            except (CollectionInvalid, OperationFailure) as e:
+                # Created meanwhile by another worker, or the option is not supported
+                logger.warning('Could not create collection %s: %s', collection, e)
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                database[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                # e.g. existing duplicate emails block the unique index; keep booting
+                logger.warning('Could not create index %s.%s: %s', collection, options['name'], e)
+
+
+def index_report(database=None):
+    """Compare the registry with the server.
+
+    Returns a dict per collection with the declared indexes that are missing,
+    and the existing indexes that have not served a query since the server
+    last restarted (from $indexStats).
+    """
+    database = database if database is not None else db
+    report = {}
+    for collection, indexes in INDEXES.items():
+        existing = database[collection].index_information()
+        existing_keys = {tuple(info['key']) for info in existing.values()}
+        missing = [
+            options['name'] for keys, options in indexes
+            if tuple(keys) not in existing_keys
+        ]
+
+        unused = []
+        try:
+            for stats in database[collection].aggregate([{'$indexStats': {}}]):
+                if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                    unused.append(stats['name'])
+        except OperationFailure:
+            # $indexStats needs clusterMonitor on some hosted tiers
+            unused = None
 
-# This will now match the DB in the URI
-db = client.money_event_manager
+        report[collection] = {'missing': missing, 'unused': unused}
+    return report
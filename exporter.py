@@ -0,0 +1,138 @@
+from datetime import datetime
+import json
+import zlib
+import itertools
+import archive
+import transactions
+from serialization import dumps
+
+# Streaming data export
+# Documents are read from each collection in cursor batches and written out as
+# they arrive, so memory stays flat no matter how much history a user has.
+#
+# Formats:
+#   legacy - byte-for-byte the original export: one pretty-printed JSON object
+#            keyed by collection (indent=2)
+#   json   - the same structure without indentation
+#   ndjson - one document per line, tagged with a "_collection" field
+#
+# json and ndjson hand the raw documents to the shared BSON-aware encoder.
+
+EXPORT_COLLECTIONS = ['incomes', 'expenses', 'events', 'budgets', 'goals', 'tasks', 'bills']
+EXPORT_FORMATS = ('legacy', 'json', 'ndjson')
+
+# Field each collection is filtered on for from/to exports
+EXPORT_DATE_FIELDS = {
+    'incomes': 'date',
+    'expenses': 'date',
+    'events': 'start',
+    'budgets': 'month',
+    'goals': 'created_at',
+    'tasks': 'due_date',
+    'bills': 'due_date'
+}
+
+BATCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+
+
+def _export_item(item):
+    item['_id'] = str(item['_id'])
+    # Convert dates to strings
+    for key, value in item.items():
+        if isinstance(value, datetime):
+            item[key] = value.isoformat()
+    return item
+
+
+def _query(collection, user_id, date_from=None, date_to=None):
+    query = {'user_id': user_id}
+    field = EXPORT_DATE_FIELDS[collection]
+    if date_from or date_to:
+        date_filter = {}
+        # Budgets store their month as a 'YYYY-MM' string
+        if date_from:
+            date_filter['$gte'] = date_from.strftime('%Y-%m') if field == 'month' else date_from
+        if date_to:
+            date_filter['$lt'] = date_to.strftime('%Y-%m') if field == 'month' else date_to
+        query[field] = date_filter
+    return query
+
+
+def _documents(collection, user_id, date_from, date_to):
+    query = _query(collection, user_id, date_from, date_to)
+    documents = transactions.collection(collection).find(query, batch_size=BATCH_SIZE)
+    if collection in archive.ARCHIVABLE:
+        # Exports are the complete history, archive included
+        documents = itertools.chain(documents, archive.collection(collection).find(query, batch_size=BATCH_SIZE))
+    return documents
+
+
+def _items(collection, user_id, date_from, date_to):
+    for item in _documents(collection, user_id, date_from, date_to):
+        yield _export_item(item)
+
+
+def _legacy_pieces(collections, user_id, date_from, date_to):
+    yield '{'
+    for index, collection in enumerate(collections):
+        yield ('\n' if index == 0 else ',\n') + f'  {json.dumps(collection)}: '
+        first = True
+        for item in _items(collection, user_id, date_from, date_to):
+            # Indent each document two levels to match json.dumps(..., indent=2) of the whole dump
+            body = json.dumps(item, indent=2).replace('\n', '\n    ')
+            yield ('[\n    ' if first else ',\n    ') + body
+            first = False
+        yield '[]' if first else '\n  ]'
+    yield '\n}' if collections else '}'
+
+
+def _json_pieces(collections, user_id, date_from, date_to):
+    yield '{'
+    for index, collection in enumerate(collections):
+        yield ('' if index == 0 else ',') + f'{dumps(collection)}:['
+        first = True
+        for item in _documents(collection, user_id, date_from, date_to):
+            yield ('' if first else ',') + dumps(item)
+            first = False
+        yield ']'
+    yield '}'
+
+
+def _ndjson_pieces(collections, user_id, date_from, date_to):
+    for collection in collections:
+        for item in _documents(collection, user_id, date_from, date_to):
+            item['_collection'] = collection
+            yield dumps(item) + '\n'
+
+
+_PIECES = {
+    'legacy': _legacy_pieces,
+    'json': _json_pieces,
+    'ndjson': _ndjson_pieces
+}
+
+
+def stream_export(user_id, fmt='legacy', collections=None, date_from=None, date_to=None, compress=False):
+    """Yield the export as byte chunks of roughly CHUNK_SIZE, optionally gzip compressed."""
+    pieces = _PIECES[fmt](collections or EXPORT_COLLECTIONS, user_id, date_from, date_to)
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            chunk = ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = ''.join(buffer).encode('utf-8')
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,87 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+# Free/busy index
+# Busy time for a window is the union of every event occurrence that overlaps
+# it, kept as sorted, disjoint intervals so overlap checks are a binary search.
+# Events without an end time mark a moment rather than block time and are not
+# counted as busy.
+#
+# conflicts() needs the individual occurrences instead. They are sorted by start
+# and covered by a segment tree holding the latest end under each node, so a
+# lookup only descends into nodes with an occurrence still running: O(log n)
+# per occurrence found, however long any single event is.
+
+
+class BusyIndex:
+    def __init__(self, occurrences):
+        """occurrences: iterable of (start, end, event_id); end may be None."""
+        self.occurrences = sorted(
+            (start, end, event_id) for start, end, event_id in occurrences
+            if end is not None and end > start
+        )
+        self.occurrence_starts = [start for start, _, _ in self.occurrences]
+        # Leaves are the occurrence ends (datetime.min past the last one), parents the max of their children
+        self.size = 1
+        while self.size < len(self.occurrences):
+            self.size *= 2
+        self.max_ends = [datetime.min] * (2 * self.size)
+        for i, (_, end, _) in enumerate(self.occurrences):
+            self.max_ends[self.size + i] = end
+        for node in range(self.size - 1, 0, -1):
+            self.max_ends[node] = max(self.max_ends[2 * node], self.max_ends[2 * node + 1])
+
+        self.starts = []
+        self.ends = []
+        for start, end, _ in self.occurrences:
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def busy(self):
+        return list(zip(self.starts, self.ends))
+
+    def overlaps(self, start, end):
+        """True if [start, end) intersects any busy interval."""
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def conflicts(self, start, end):
+        """The occurrences that intersect [start, end), as (start, end, event_id)."""
+        if not self.overlaps(start, end):
+            return []
+        # Occurrences starting at or after `end` cannot overlap; of those before,
+        # the ones still running at `start` do
+        limit = bisect_left(self.occurrence_starts, end)
+        found = []
+        stack = [(1, 0, self.size)]
+        while stack:
+            node, low, high = stack.pop()
+            if low >= limit or self.max_ends[node] <= start:
+                continue
+            if node >= self.size:
+                found.append(self.occurrences[low])
+                continue
+            middle = (low + high) // 2
+            # Left child last, so it is taken first and the result stays in start order
+            stack.append((2 * node + 1, middle, high))
+            stack.append((2 * node, low, middle))
+        return found
+
+    def free_slots(self, window_start, window_end, minutes, limit=None):
+        """Yield the free gaps of at least `minutes` inside [window_start, window_end)."""
+        needed = timedelta(minutes=minutes)
+        cursor = window_start
+        found = 0
+        i = bisect_right(self.ends, window_start)
+        while cursor < window_end and (limit is None or found < limit):
+            gap_end = min(self.starts[i], window_end) if i < len(self.starts) else window_end
+            if gap_end - cursor >= needed:
+                yield cursor, gap_end
+                found += 1
+            if i >= len(self.starts):
+                return
+            cursor = max(cursor, self.ends[i])
+            i += 1
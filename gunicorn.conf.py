@@ -0,0 +1,23 @@
+# gunicorn settings and hooks, picked up automatically from the working directory.
+# With --preload (see procfile) the app is imported once in the master and
+# shared copy-on-write by the workers. app.py does not connect to MongoDB at
+# import, so each worker opens its own connection pool after the fork; the hook
+# below then warms it up while /ready reports 503.
+#
+# Workers are threaded (gthread): /api/stream holds a thread per open
+# connection and password hashing runs off the request thread (passwords.py),
+# neither of which helps a single-threaded sync worker. GUNICORN_THREADS sets
+# the threads per worker, two of which are kept for ordinary requests; the
+# number of workers comes from WEB_CONCURRENCY as usual.
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 10))
+
+
+def post_worker_init(worker):
+    import warmup
+    from routes import stream
+    # Leave two threads for ordinary requests; sync workers (one thread) do not stream
+    stream.configure(worker.cfg.threads - 2 if worker.cfg.threads > 1 else 0)
+    warmup.start_warm_up(worker.wsgi)
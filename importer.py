@@ -0,0 +1,448 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import gzip
+import io
+import json
+import logging
+import os
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from database import db, IMPORT_STAGING_PREFIX
+from exporter import EXPORT_COLLECTIONS
+import rollups
+import changelog
+import items
+import transactions
+import archive
+
+logger = logging.getLogger(__name__)
+
+# Background data import
+# Uploads are saved to a temporary file and processed by a job on a small
+# per-worker pool. Items are parsed one at a time, converted according to the
+# collection schema and written with unordered bulk_write batches into
+# import_staging_<collection>, tagged with the job id. Nothing but the importer
+# reads those collections, so staged documents are never seen by endpoints or
+# by the cross-user background jobs (reminders, archive). Once the whole file
+# has been read they are copied onto the user, still tagged with the job
+# (import_job). Only when every collection is in does overwrite mode remove the
+# user's other documents, and then the tag is dropped. A job that fails before
+# that takes back just what it had copied, so the account keeps its old data
+# and is never left half replaced. Job progress is kept in MongoDB so any
+# worker can answer /api/import_status.
+#
+# A job whose worker is recycled stops updating updated_at. After
+# IMPORT_STALE_MINUTES it is marked failed and its staged (and, unless it had
+# finished copying, published) documents removed, by the status endpoint or
+# by the sweep every worker runs at boot.
+
+JOB_COLLECTION = 'import_jobs'
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 1))
+IMPORT_STALE_MINUTES = int(os.environ.get('IMPORT_STALE_MINUTES', 30))
+MAX_REPORTED_ERRORS = 20
+ACTIVE_STATES = ['queued', 'running']
+# Field marking the documents an unfinished job has published
+IMPORT_TAG = 'import_job'
+
+_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='import')
+
+
+class ImportFormatError(ValueError):
+    """Raised when an import file cannot be parsed."""
+
+
+TRUE_STRINGS = {'true', '1', 'yes', 'y', 'on'}
+FALSE_STRINGS = {'false', '0', 'no', 'n', 'off', ''}
+
+
+def parse_bool(value):
+    # bool('false') is True, so the string forms are read explicitly
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in TRUE_STRINGS | FALSE_STRINGS:
+        return value.strip().lower() in TRUE_STRINGS
+    raise ValueError(f'Invalid boolean: {value!r}')
+
+
+def parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str):
+        raise TypeError(f'Invalid date: {value!r}')
+    value = value.replace('Z', '+00:00')
+    if 'T' in value or ' ' in value:
+        return datetime.fromisoformat(value)
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+# Fields accepted per collection and how to convert them; anything else
+# (including _id and user_id) is dropped. None keeps the value as is.
+IMPORT_SCHEMAS = {
+    'incomes': {'amount': float, 'source': str, 'date': parse_datetime,
+                'description': str, 'created_at': parse_datetime},
+    'expenses': {'amount': float, 'category': str, 'date': parse_datetime,
+                 'description': str, 'created_at': parse_datetime},
+    'budgets': {'category': str, 'amount': float, 'month': str, 'created_at': parse_datetime},
+    'bills': {'name': str, 'amount': float, 'due_date': parse_datetime, 'recurring': parse_bool,
+              'paid': parse_bool, 'created_at': parse_datetime},
+    'goals': {'name': str, 'target_amount': float, 'current_amount': float,
+              'target_date': parse_datetime, 'created_at': parse_datetime},
+    'events': {'title': str, 'start': parse_datetime, 'end': parse_datetime, 'description': str,
+               'recurring': parse_bool, 'recurrence_pattern': None, 'created_at': parse_datetime},
+    'tasks': {'name': str, 'due_date': parse_datetime, 'priority': str, 'description': str,
+              'completed': parse_bool, 'completed_date': parse_datetime, 'created_at': parse_datetime}
+}
+
+
+# Fields an item must have, the same ones the app requires when creating it
+IMPORT_REQUIRED = {
+    collection: [field for field, _, default in fields if default is items.REQUIRED]
+    for collection, fields in items.ITEM_FIELDS.items()
+}
+
+
+def convert_item(collection, item, user_id):
+    schema = IMPORT_SCHEMAS[collection]
+    for field in IMPORT_REQUIRED[collection]:
+        if item.get(field) is None:
+            raise ValueError(f'Missing field: {field}')
+    document = {'user_id': user_id}
+    for field, convert in schema.items():
+        if field not in item:
+            continue
+        value = item[field]
+        document[field] = value if value is None or convert is None else convert(value)
+    return document
+
+
+# Streaming parsers
+
+def iter_ndjson(stream):
+    """Yield (collection, item) per line.
+
+    A line holding anything but an object is yielded as (None, ImportFormatError)
+    for the job to report and skip.
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ImportFormatError(f'Invalid JSON on line {line_number}: {e.msg}')
+        if not isinstance(item, dict):
+            yield None, ImportFormatError(f'Line {line_number} is not a JSON object')
+            continue
+        yield item.pop('_collection', None), item
+
+
+_decoder = json.JSONDecoder()
+
+
+class _JsonReader:
+    """Reads the export layout {"collection": [item, ...], ...} one item at a time.
+
+    Yields (collection, None) when a collection's list starts, so empty lists
+    still count as present for overwrite imports.
+    """
+
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.stream.read(self.READ_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ImportFormatError(f"Invalid JSON file: expected '{char}'")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ImportFormatError(f'Invalid JSON file: {e.msg}')
+            self._fill()
+
+    def items(self):
+        self.expect('{')
+        while self.peek() != '}':
+            collection = self.value()
+            self.expect(':')
+            if self.peek() != '[':
+                # Not a list of documents; skip it
+                self.value()
+            else:
+                self.pos += 1
+                yield collection, None
+                while self.peek() != ']':
+                    yield collection, self.value()
+                    if self.peek() == ',':
+                        self.pos += 1
+                self.pos += 1
+            if self.peek() == ',':
+                self.pos += 1
+            elif self.peek() != '}':
+                raise ImportFormatError("Invalid JSON file: expected ',' or '}'")
+        self.pos += 1
+
+
+def iter_json(stream):
+    return _JsonReader(stream).items()
+
+
+def open_import_file(path, filename):
+    """Open a saved upload as text and return (stream, item iterator)."""
+    name = filename.lower()
+    raw = gzip.open(path, 'rb') if name.endswith('.gz') else open(path, 'rb')
+    stream = io.TextIOWrapper(raw, encoding='utf-8')
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return stream, (iter_ndjson(stream) if name.endswith('.ndjson') else iter_json(stream))
+
+
+# Jobs
+
+def _staging(collection):
+    return db[IMPORT_STAGING_PREFIX + collection]
+
+
+def create_job(user_id, path, filename, overwrite):
+    now = datetime.now()
+    job = {
+        'user_id': user_id,
+        'filename': filename,
+        'overwrite': overwrite,
+        'status': 'queued',
+        'processed': 0,
+        'inserted': 0,
+        'skipped': 0,
+        'collections': {},
+        'errors': [],
+        'created_at': now,
+        'updated_at': now,
+        'finished_at': None
+    }
+    job_id = db[JOB_COLLECTION].insert_one(job).inserted_id
+    _executor.submit(run_job, job_id, user_id, path, filename, overwrite)
+    return str(job_id)
+
+
+def get_job(job_id, user_id):
+    job = db[JOB_COLLECTION].find_one({'_id': ObjectId(job_id), 'user_id': user_id})
+    if job and job['status'] in ACTIVE_STATES and job['updated_at'] < _stale_before():
+        job = _fail_stale(job) or db[JOB_COLLECTION].find_one({'_id': job['_id']})
+    if job:
+        job['_id'] = str(job['_id'])
+    return job
+
+
+def _update_job(job_id, fields):
+    db[JOB_COLLECTION].update_one({'_id': job_id}, {'$set': dict(fields, updated_at=datetime.now())})
+
+
+def _discard(job_id):
+    """Remove everything a job staged."""
+    for collection in IMPORT_SCHEMAS:
+        _staging(collection).delete_many({'job_id': job_id})
+
+
+def _withdraw(job_id, user_id, collections):
+    """Remove what a job that did not finish publishing had already copied onto the user."""
+    for collection in collections:
+        transactions.collection(collection).delete_many({'user_id': user_id, IMPORT_TAG: str(job_id)})
+
+
+def _stale_before():
+    return datetime.now() - timedelta(minutes=IMPORT_STALE_MINUTES)
+
+
+def _fail_stale(job):
+    """Mark an active job that stopped updating as failed; returns it, or None if it moved on meanwhile."""
+    now = datetime.now()
+    failed = db[JOB_COLLECTION].find_one_and_update(
+        {'_id': job['_id'], 'status': {'$in': ACTIVE_STATES}, 'updated_at': job['updated_at']},
+        {'$set': {'status': 'failed', 'finished_at': now, 'updated_at': now},
+         '$push': {'errors': 'The import was interrupted, please run it again'}},
+        return_document=ReturnDocument.AFTER
+    )
+    if failed is not None:
+        logger.warning('Import job %s stopped making progress; discarding it', job['_id'])
+        if not failed.get('published'):
+            _withdraw(job['_id'], failed['user_id'], IMPORT_SCHEMAS)
+        _discard(job['_id'])
+    return failed
+
+
+def clean_up_stale_jobs():
+    """Fail every job that stopped making progress and drop what it staged; returns how many."""
+    stale = db[JOB_COLLECTION].find(
+        {'status': {'$in': ACTIVE_STATES}, 'updated_at': {'$lt': _stale_before()}},
+        {'status': 1, 'updated_at': 1}
+    )
+    return sum(_fail_stale(job) is not None for job in stale)
+
+
+def _flush(batches, collection, progress):
+    documents = batches.pop(collection, None)
+    if not documents:
+        return
+    try:
+        result = _staging(collection).insert_many(documents, ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        inserted = e.details.get('nInserted', 0)
+        for error in e.details.get('writeErrors', [])[:MAX_REPORTED_ERRORS]:
+            progress['errors'].append(f"{collection}: {error.get('errmsg')}")
+    progress['inserted'] += inserted
+    progress['collections'][collection] = progress['collections'].get(collection, 0) + inserted
+
+
+def _publish(job_id, collection):
+    """Copy the job's staged documents of one collection into the live collection, tagged with the job."""
+    staging, target = _staging(collection), transactions.collection(collection)
+    query = {'job_id': job_id}
+    while True:
+        batch = list(staging.find(query, {'job_id': 0}).sort('_id', 1).limit(IMPORT_BATCH_SIZE))
+        if not batch:
+            return
+        for document in batch:
+            document[IMPORT_TAG] = str(job_id)
+        target.insert_many(batch, ordered=False)
+        query['_id'] = {'$gt': batch[-1]['_id']}
+        _update_job(job_id, {})
+
+
+def _settle(job_id, user_id, collection, overwrite):
+    """Make a published collection final: drop the user's other documents if overwriting, then the tag."""
+    target = transactions.collection(collection)
+    if overwrite:
+        target.delete_many({'user_id': user_id, IMPORT_TAG: {'$ne': str(job_id)}})
+        if collection in archive.ARCHIVABLE:
+            archive.collection(collection).delete_many({'user_id': user_id})
+    target.update_many({'user_id': user_id, IMPORT_TAG: str(job_id)}, {'$unset': {IMPORT_TAG: ''}})
+
+
+def _refresh(user_id):
+    """Bring the rollups and the user's synced clients in line with imported data."""
+    rollups.rebuild_rollups(user_id)
+    changelog.record_reset(user_id)
+
+
+def run_job(job_id, user_id, path, filename, overwrite):
+    progress = {'processed': 0, 'inserted': 0, 'skipped': 0, 'collections': {}, 'errors': []}
+    touched = set()
+    published = False
+
+    try:
+        # A job already failed as stale (queued too long) is not run any more
+        claimed = db[JOB_COLLECTION].update_one(
+            {'_id': job_id, 'status': 'queued'},
+            {'$set': {'status': 'running', 'started_at': datetime.now(), 'updated_at': datetime.now()}}
+        )
+        if claimed.matched_count == 0:
+            return
+
+        stream, entries = open_import_file(path, filename)
+        with stream:
+            batches = {}
+            for collection, item in entries:
+                if item is None:
+                    if collection in IMPORT_SCHEMAS:
+                        touched.add(collection)
+                    continue
+                progress['processed'] += 1
+                if isinstance(item, ImportFormatError):
+                    progress['skipped'] += 1
+                    if len(progress['errors']) < MAX_REPORTED_ERRORS:
+                        progress['errors'].append(str(item))
+                    continue
+                if collection not in IMPORT_SCHEMAS or not isinstance(item, dict):
+                    progress['skipped'] += 1
+                    continue
+                try:
+                    document = convert_item(collection, item, user_id)
+                except (TypeError, ValueError) as e:
+                    progress['skipped'] += 1
+                    if len(progress['errors']) < MAX_REPORTED_ERRORS:
+                        progress['errors'].append(f'{collection}: {e}')
+                    continue
+
+                touched.add(collection)
+                document['job_id'] = job_id
+                batch = batches.setdefault(collection, [])
+                batch.append(document)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    _flush(batches, collection, progress)
+                    _update_job(job_id, progress)
+
+            for collection in list(batches):
+                _flush(batches, collection, progress)
+            _update_job(job_id, progress)
+
+        # Copy everything in before touching the old data; overwrite only
+        # replaces the collections present in the file
+        collections = [collection for collection in EXPORT_COLLECTIONS if collection in touched]
+        for collection in collections:
+            _publish(job_id, collection)
+        _update_job(job_id, {'published': True})
+        published = True
+        for collection in collections:
+            _settle(job_id, user_id, collection, overwrite)
+
+        _discard(job_id)
+        _refresh(user_id)
+        _update_job(job_id, dict(progress, status='completed', finished_at=datetime.now()))
+
+    except Exception as e:
+        logger.exception('Import job %s failed', job_id)
+        try:
+            if published:
+                # The new data is in and stays; keep the rollups and clients in step with it
+                _refresh(user_id)
+            else:
+                _withdraw(job_id, user_id, touched)
+            _discard(job_id)
+        except Exception:
+            logger.exception('Could not clean up after import job %s', job_id)
+        progress['errors'].append(str(e))
+        _update_job(job_id, dict(progress, status='failed', finished_at=datetime.now()))
+
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
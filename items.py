@@ -0,0 +1,313 @@
+from collections import defaultdict
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+import archive
+import changelog
+import rollups
+import transactions
+
+# Item service
+# Creating, updating and deleting the user's items (incomes, expenses, budgets,
+# bills, goals, events and tasks) goes through here, so every write keeps the
+# rollups and the change log current in the same way. ITEM_FIELDS lists the
+# fields a client may set for each collection: (name, converter, default), where
+# REQUIRED marks fields that must be given when creating. Incomes and expenses
+# go through transactions.collection(), so either storage mode works. Items
+# that have been archived (see archive.py) are updated and deleted in place in
+# the archive.
+#
+# apply_batch() runs many creates, updates and deletes with one unordered
+# bulk_write per collection and reports a result for each operation.
+
+REQUIRED = object()
+MAX_BATCH_OPERATIONS = 500
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def _event_datetime(value):
+    # Accepts 'YYYY-MM-DD' or the 'YYYY-MM-DDTHH:MM' of a datetime-local input
+    if not isinstance(value, str):
+        raise TypeError(f'Invalid date: {value!r}')
+    date_str, _, time_str = value.partition('T')
+    return datetime.strptime(f"{date_str} {time_str or '00:00'}", '%Y-%m-%d %H:%M')
+
+
+def _optional(convert):
+    return lambda value: convert(value) if value else None
+
+
+ITEM_FIELDS = {
+    'incomes': [
+        ('amount', float, REQUIRED), ('source', None, REQUIRED), ('date', _date, REQUIRED),
+        ('description', None, '')
+    ],
+    'expenses': [
+        ('amount', float, REQUIRED), ('category', None, REQUIRED), ('date', _date, REQUIRED),
+        ('description', None, '')
+    ],
+    'budgets': [
+        ('category', None, REQUIRED), ('amount', float, REQUIRED), ('month', None, REQUIRED)
+    ],
+    'bills': [
+        ('name', None, REQUIRED), ('amount', float, REQUIRED), ('due_date', _date, REQUIRED),
+        ('recurring', None, REQUIRED), ('paid', None, False)
+    ],
+    'goals': [
+        ('name', None, REQUIRED), ('target_amount', float, REQUIRED), ('current_amount', float, 0),
+        ('target_date', _optional(_date), None)
+    ],
+    'events': [
+        ('title', None, REQUIRED), ('start', _event_datetime, REQUIRED), ('end', _optional(_event_datetime), None),
+        ('description', None, ''), ('recurring', None, False), ('recurrence_pattern', None, None)
+    ],
+    'tasks': [
+        ('name', None, REQUIRED), ('due_date', _date, REQUIRED), ('priority', None, 'medium'),
+        ('description', None, ''), ('completed', None, False)
+    ]
+}
+
+ITEM_COLLECTIONS = list(ITEM_FIELDS)
+
+
+class ItemError(ValueError):
+    """An item operation that cannot be carried out as requested."""
+
+
+def _derive(collection, fields):
+    if collection == 'tasks' and 'completed' in fields:
+        fields['completed_date'] = datetime.now() if fields['completed'] else None
+    if (collection == 'events' and {'start', 'recurring', 'recurrence_pattern'} & set(fields)
+            and fields.get('recurring', True)):
+        # The reminder scheduler works out the next occurrence again (see reminders.py)
+        fields['next_occurrence'] = None
+
+
+def _check_collection(collection):
+    if collection not in ITEM_FIELDS:
+        raise ItemError('Invalid item type')
+
+
+def _object_id(item_id):
+    try:
+        return ObjectId(item_id)
+    except (InvalidId, TypeError):
+        raise ItemError('Invalid item id')
+
+
+def build(collection, data, user_id):
+    """The document to insert for `data`; raises KeyError for a missing (or null) required field."""
+    _check_collection(collection)
+    doc = {'user_id': user_id}
+    for field, convert, default in ITEM_FIELDS[collection]:
+        value = data[field] if default is REQUIRED else data.get(field, default)
+        if value is None and default is REQUIRED:
+            raise KeyError(field)
+        doc[field] = convert(value) if convert else value
+    _derive(collection, doc)
+    doc['created_at'] = datetime.now()
+    return doc
+
+
+def changes(collection, data):
+    """The $set for an update with `data`; fields outside ITEM_FIELDS are ignored."""
+    _check_collection(collection)
+    fields = {}
+    for field, convert, default in ITEM_FIELDS[collection]:
+        if field in data:
+            if data[field] is None and default is REQUIRED:
+                raise ItemError(f'{field} cannot be null')
+            fields[field] = convert(data[field]) if convert else data[field]
+    if not fields:
+        raise ItemError('No fields to update')
+    _derive(collection, fields)
+    return fields
+
+
+# Single items
+
+def insert(collection, doc):
+    """Insert a built document and record it."""
+    transactions.collection(collection).insert_one(doc)
+    if collection in rollups.COLLECTION_KINDS:
+        rollups.apply_transaction(rollups.COLLECTION_KINDS[collection], doc)
+    changelog.record(doc['user_id'], collection, doc['_id'], changelog.INSERT)
+    return doc
+
+
+def create(collection, data, user_id):
+    return insert(collection, build(collection, data, user_id))
+
+
+def _tiers(collection):
+    """Where the user's items of `collection` are kept: the live collection, then its archive."""
+    tiers = [transactions.collection(collection)]
+    if collection in archive.ARCHIVABLE:
+        tiers.append(archive.collection(collection))
+    return tiers
+
+
+def update(collection, user_id, item_id, data):
+    """Apply `data` to one of the user's items; returns False if there is no such item."""
+    fields = changes(collection, data)
+    query = {'_id': _object_id(item_id), 'user_id': user_id}
+    for target in _tiers(collection):
+        if collection in rollups.COLLECTION_KINDS:
+            old = target.find_one_and_update(query, {'$set': fields})
+            if old is None:
+                continue
+            rollups.apply_changes(rollups.COLLECTION_KINDS[collection], added=[dict(old, **fields)], removed=[old])
+        elif target.update_one(query, {'$set': fields}).matched_count == 0:
+            continue
+        changelog.record(user_id, collection, item_id, changelog.UPDATE)
+        return True
+    return False
+
+
+def delete(collection, user_id, item_id):
+    """Delete one of the user's items; returns the deleted document or None."""
+    _check_collection(collection)
+    query = {'_id': _object_id(item_id), 'user_id': user_id}
+    for target in _tiers(collection):
+        deleted = target.find_one_and_delete(query)
+        if deleted is None:
+            continue
+        if collection in rollups.COLLECTION_KINDS:
+            rollups.apply_transaction(rollups.COLLECTION_KINDS[collection], deleted, sign=-1)
+        changelog.record(user_id, collection, deleted['_id'], changelog.DELETE)
+        return deleted
+    return None
+
+
+# Batches
+
+def _prepare(operation, user_id):
+    """(collection, op, item id, payload) for one batch operation; raises ItemError or KeyError."""
+    if not isinstance(operation, dict):
+        raise ItemError('Each operation must be an object')
+    op, collection = operation.get('op'), operation.get('type')
+    _check_collection(collection)
+    data = operation.get('data') or {}
+    if not isinstance(data, dict):
+        raise ItemError('data must be an object')
+    if op == 'create':
+        doc = build(collection, data, user_id)
+        doc['_id'] = ObjectId()
+        return collection, op, doc['_id'], doc
+    if op == 'update':
+        return collection, op, _object_id(operation.get('id')), changes(collection, data)
+    if op == 'delete':
+        return collection, op, _object_id(operation.get('id')), None
+    raise ItemError("op must be 'create', 'update' or 'delete'")
+
+
+def _bulk_write(target, user_id, writes, existing):
+    """Apply (op, item_id, payload) writes unordered; returns {position: error message}."""
+    if isinstance(target, transactions.BucketedCollection):
+        return target.write(user_id, writes, existing)
+
+    requests = []
+    for op, item_id, payload in writes:
+        if op == 'create':
+            requests.append(InsertOne(payload))
+        elif op == 'update':
+            requests.append(UpdateOne({'_id': item_id, 'user_id': user_id}, {'$set': payload}))
+        else:
+            requests.append(DeleteOne({'_id': item_id, 'user_id': user_id}))
+    try:
+        target.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        return {error['index']: error.get('errmsg', 'Write failed') for error in e.details.get('writeErrors', [])}
+    return {}
+
+
+def _run_collection(collection, user_id, prepared, results):
+    """One lookup and one bulk_write per tier for every operation on `collection`."""
+    kind = rollups.COLLECTION_KINDS.get(collection)
+    tiers = _tiers(collection)
+    # Updated and deleted items are looked up in the archive only if they are not live
+    existing, tier_of = {}, {}
+    missing = [item_id for _, op, item_id, _ in prepared if op != 'create']
+    for tier, target in enumerate(tiers):
+        if not missing:
+            break
+        projection = None if kind else {'_id': 1}
+        for doc in target.find({'_id': {'$in': missing}, 'user_id': user_id}, projection):
+            existing[doc['_id']] = doc
+            tier_of[doc['_id']] = tier
+        missing = [item_id for item_id in missing if item_id not in existing]
+
+    writes, pending, targeted = defaultdict(list), [], set()
+    for index, op, item_id, payload in prepared:
+        if op != 'create':
+            error = ('Item not found' if item_id not in existing else
+                     # Unordered writes to one document could land in any order
+                     'Item appears more than once in the batch' if item_id in targeted else None)
+            if error:
+                results[index] = {'status': 'error', 'id': str(item_id), 'message': error}
+                continue
+            targeted.add(item_id)
+        writes[tier_of.get(item_id, 0)].append((len(pending), (op, item_id, payload)))
+        pending.append((index, op, item_id, payload))
+    if not pending:
+        return []
+
+    failed = {}
+    for tier, entries in writes.items():
+        errors = _bulk_write(tiers[tier], user_id, [write for _, write in entries], existing)
+        failed.update({entries[position][0]: message for position, message in errors.items()})
+
+    done, added, removed = [], [], []
+    for position, (index, op, item_id, payload) in enumerate(pending):
+        if position in failed:
+            results[index] = {'status': 'error', 'id': str(item_id), 'message': failed[position]}
+            continue
+        results[index] = {'status': op + 'd', 'id': str(item_id)}
+        done.append((collection, item_id, {'create': changelog.INSERT, 'update': changelog.UPDATE,
+                                            'delete': changelog.DELETE}[op]))
+        if kind and op == 'create':
+            added.append(payload)
+        elif kind and op == 'update':
+            added.append(dict(existing[item_id], **payload))
+            removed.append(existing[item_id])
+        elif kind:
+            removed.append(existing[item_id])
+
+    if kind:
+        rollups.apply_changes(kind, added=added, removed=removed)
+    return done
+
+
+def apply_batch(user_id, operations):
+    """Run a list of {op, type, id, data} operations; returns one result per operation.
+
+    Operations are grouped by collection and each group is sent as a single
+    unordered bulk_write, so one bad operation does not stop the others and
+    their order within a batch is not guaranteed.
+    """
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ItemError(f'At most {MAX_BATCH_OPERATIONS} operations per batch')
+
+    results = [None] * len(operations)
+    by_collection = defaultdict(list)
+    for index, operation in enumerate(operations):
+        try:
+            collection, op, item_id, payload = _prepare(operation, user_id)
+        except KeyError as e:
+            results[index] = {'status': 'error', 'message': f'Missing field: {e.args[0]}'}
+            continue
+        except (ValueError, TypeError) as e:
+            results[index] = {'status': 'error', 'message': str(e)}
+            continue
+        by_collection[collection].append((index, op, item_id, payload))
+
+    done = []
+    for collection, prepared in by_collection.items():
+        done.extend(_run_collection(collection, user_id, prepared, results))
+    changelog.record_changes(user_id, done)
+    return results
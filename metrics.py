@@ -0,0 +1,198 @@
+from bisect import bisect_left
+import os
+import threading
+import mongo_metrics
+
+# Request metrics
+# Every request is recorded into a shard owned by the thread that served it, so
+# the hot path never takes a lock: each series is a handful of preallocated
+# counters updated in place. /metrics sums the shards when it is scraped.
+#
+# Each gunicorn worker keeps its own numbers and a scrape is answered by
+# whichever worker receives it; the `pid` label tells them apart.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, float('inf'))
+MONGO_COMMAND_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, float('inf'))
+
+class Histogram:
+    __slots__ = ('bounds', 'buckets', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, value in enumerate(other.buckets):
+            self.buckets[i] += value
+        self.count += other.count
+        self.sum += other.sum
+
+
+class RequestSeries:
+    """Everything recorded for one (blueprint, endpoint, method) in one thread."""
+
+    __slots__ = ('latency', 'request_size', 'response_size', 'mongo_commands', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.request_size = Histogram(SIZE_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.mongo_commands = Histogram(MONGO_COMMAND_BUCKETS)
+        # Responses by status class: 1xx..5xx
+        self.statuses = [0] * 5
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.request_size.merge(other.request_size)
+        self.response_size.merge(other.response_size)
+        self.mongo_commands.merge(other.mongo_commands)
+        for i, value in enumerate(other.statuses):
+            self.statuses[i] += value
+
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        # Only taken once per thread; shards of finished threads are kept so counters never go back
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def record(blueprint, endpoint, method, status, seconds, request_bytes, response_bytes, mongo_commands):
+    shard = _shard()
+    key = (blueprint, endpoint, method)
+    series = shard.get(key)
+    if series is None:
+        series = shard[key] = RequestSeries()
+    series.latency.observe(seconds)
+    if request_bytes is not None:
+        series.request_size.observe(request_bytes)
+    if response_bytes is not None:
+        series.response_size.observe(response_bytes)
+    series.mongo_commands.observe(mongo_commands)
+    series.statuses[min(max(status // 100, 1), 5) - 1] += 1
+
+
+def collect():
+    """Merge every thread's shard into {(blueprint, endpoint, method): RequestSeries}."""
+    with _shards_lock:
+        shards = list(_shards)
+    merged = {}
+    for shard in shards:
+        for key, series in list(shard.items()):
+            total = merged.get(key)
+            if total is None:
+                total = merged[key] = RequestSeries()
+            total.merge(series)
+    return merged
+
+
+# Prometheus text format
+
+def _labels(**labels):
+    body = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + body + '}'
+
+
+def _bound(value):
+    return '+Inf' if value == float('inf') else repr(round(value, 6))
+
+
+def _histogram_lines(name, histogram, labels, scale=1):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.buckets):
+        cumulative += count
+        yield f'{name}_bucket{_labels(**labels, le=_bound(bound * scale))} {cumulative}'
+    yield f'{name}_sum{_labels(**labels)} {histogram.sum}'
+    yield f'{name}_count{_labels(**labels)} {histogram.count}'
+
+
+REQUEST_HISTOGRAMS = (
+    ('http_request_duration_seconds', 'latency', 'Time from request start until the response body is sent.'),
+    ('http_request_size_bytes', 'request_size', 'Request body size.'),
+    ('http_response_size_bytes', 'response_size', 'Response body size.'),
+    ('http_request_mongo_commands', 'mongo_commands', 'MongoDB commands issued while serving a request.')
+)
+
+
+def _request_lines():
+    pid = str(os.getpid())
+    series_by_key = sorted(collect().items())
+    for name, attribute, description in REQUEST_HISTOGRAMS:
+        yield f'# HELP {name} {description}'
+        yield f'# TYPE {name} histogram'
+        for (blueprint, endpoint, method), series in series_by_key:
+            labels = {'pid': pid, 'blueprint': blueprint, 'endpoint': endpoint, 'method': method}
+            yield from _histogram_lines(name, getattr(series, attribute), labels)
+
+    yield '# HELP http_requests_total Responses by status class.'
+    yield '# TYPE http_requests_total counter'
+    for (blueprint, endpoint, method), series in series_by_key:
+        for i, count in enumerate(series.statuses):
+            if count:
+                labels = {'pid': pid, 'blueprint': blueprint, 'endpoint': endpoint,
+                          'method': method, 'status': f'{i + 1}xx'}
+                yield f'http_requests_total{_labels(**labels)} {count}'
+
+
+def _mongo_lines():
+    pid = str(os.getpid())
+    # mongo_metrics keeps milliseconds; Prometheus convention is seconds
+    with mongo_metrics.pool_stats.lock:
+        pools = [(f'{host}:{port}', pool) for (host, port), pool in mongo_metrics.pool_stats.pools.items()]
+        gauges = [(address, pool.summary()) for address, pool in pools]
+        waits = [(address, _copy(pool.checkout_wait)) for address, pool in pools]
+    with mongo_metrics.command_stats.lock:
+        commands = [(key, _copy(stats)) for key, stats in sorted(mongo_metrics.command_stats.commands.items())]
+
+    for name, field, description in (
+            ('mongodb_pool_max_size', 'max_size', 'Configured maxPoolSize.'),
+            ('mongodb_pool_open_connections', 'open', 'Open connections.'),
+            ('mongodb_pool_in_use_connections', 'in_use', 'Connections checked out.'),
+            ('mongodb_pool_waiting', 'waiting', 'Threads waiting to check out a connection.'),
+            ('mongodb_pool_saturation', 'saturation', 'Connections in use divided by maxPoolSize.')):
+        yield f'# HELP {name} {description}'
+        yield f'# TYPE {name} gauge'
+        for address, summary in gauges:
+            yield f'{name}{_labels(pid=pid, address=address)} {summary[field]}'
+
+    yield '# HELP mongodb_checkout_wait_seconds Time spent waiting for a pooled connection.'
+    yield '# TYPE mongodb_checkout_wait_seconds histogram'
+    for address, histogram in waits:
+        yield from _histogram_lines('mongodb_checkout_wait_seconds', histogram, {'pid': pid, 'address': address}, 0.001)
+
+    yield '# HELP mongodb_command_duration_seconds MongoDB command latency by collection and route.'
+    yield '# TYPE mongodb_command_duration_seconds histogram'
+    for (command, collection, route), histogram in commands:
+        labels = {'pid': pid, 'command': command, 'collection': collection, 'route': route}
+        yield from _histogram_lines('mongodb_command_duration_seconds', histogram, labels, 0.001)
+
+
+def _copy(stats):
+    histogram = Histogram(mongo_metrics.LATENCY_BUCKETS)
+    histogram.buckets = list(stats.buckets)
+    histogram.count = stats.count
+    histogram.sum = stats.total / 1000
+    return histogram
+
+
+def render():
+    return '\n'.join(list(_request_lines()) + list(_mongo_lines())) + '\n'
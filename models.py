@@ -1,6 +1,17 @@
 from flask_login import UserMixin
 from bson import ObjectId
-import bcrypt
+import os
+from cache import MemoryBackend
+from passwords import hash_password, check_password, needs_rehash
+
+# Fields User.__init__ reads; the password hash is never loaded for sessions
+USER_FIELDS = {'username': 1, 'email': 1, 'currency': 1, 'notification_settings': 1}
+
+# Logged-in users are looked up on every request, so keep them briefly per worker.
+# Profile and settings changes invalidate the entry in the worker that made them;
+# other workers pick the change up within USER_CACHE_TTL seconds.
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+_user_cache = MemoryBackend(max_entries=int(os.environ.get('USER_CACHE_SIZE', 1024)))
 
 class User(UserMixin):
     def __init__(self, user_data):
@@ -15,9 +26,24 @@ class User(UserMixin):
             'time': '09:00'
         })
     
+    @staticmethod
+    def get(db, user_id):
+        user = _user_cache.get(user_id)
+        if user is None:
+            user_data = db.users.find_one({'_id': ObjectId(user_id)}, USER_FIELDS)
+            if not user_data:
+                return None
+            user = User(user_data)
+            _user_cache.set(user_id, user, USER_CACHE_TTL)
+        return user
+    
+    @staticmethod
+    def invalidate(user_id):
+        _user_cache.delete(user_id)
+    
     @staticmethod
     def create_user(db, username, email, password):
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        hashed_password = hash_password(password)
         user_data = {
             'username': username,
             'email': email,
@@ -36,6 +62,12 @@ class User(UserMixin):
     @staticmethod
     def verify_password(db, username, password):
         user_data = db.users.find_one({'username': username})
-        if user_data and bcrypt.checkpw(password.encode('utf-8'), user_data['password']):
+        if user_data and check_password(password, user_data['password']):
+            # Move the stored hash to the current work factor while we have the password
+            if needs_rehash(user_data['password']):
+                db.users.update_one(
+                    {'_id': user_data['_id']},
+                    {'$set': {'password': hash_password(password)}}
+                )
             return User(user_data)
         return None
\ No newline at end of file
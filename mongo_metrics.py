@@ -0,0 +1,260 @@
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# MongoDB pool and command instrumentation
+# The listeners are registered on the client in database.py. pymongo publishes
+# command and checkout events on the thread that runs the operation, so the
+# Flask endpoint that issued a command can be read from the request context.
+# Dashboard panels run in a copy of their request's context and count as that
+# endpoint; other work on executor threads (imports) is attributed to the
+# thread name prefix instead, e.g. 'thread:import'.
+
+# Histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+SLOW_CHECKOUT_MS = float(os.environ.get('MONGO_SLOW_CHECKOUT_MS', 100))
+MAX_TRACED_COMMANDS = 500
+# Cursor continuations; their number depends on result size rather than on the code path
+CURSOR_COMMANDS = {'getMore', 'killCursors'}
+
+
+class LatencyStats:
+    """Count, sum, max and bucket counts of a latency in milliseconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, ms, error=False):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        if error:
+            self.errors += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max, 3)
+        }
+
+
+def current_route():
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'thread:' + threading.current_thread().name.split('_')[0]
+
+
+def _collection(command_name, command):
+    if command_name == 'getMore':
+        return command.get('collection', '')
+    value = command.get(command_name)
+    return value if isinstance(value, str) else ''
+
+
+def _returned_documents(reply):
+    cursor = reply.get('cursor')
+    if cursor:
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or ())
+    # findAndModify
+    if 'value' in reply:
+        return 1 if reply['value'] else 0
+    return 0
+
+
+class CommandStats(monitoring.CommandListener):
+    """Per-command latency by (command, collection, route)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+        self._pending = {}
+
+    def started(self, event):
+        if has_request_context():
+            # Round trips per request, read by the request metrics and query budgets
+            g.mongo_commands = g.get('mongo_commands', 0) + 1
+            if event.command_name in CURSOR_COMMANDS:
+                g.mongo_cursor_commands = g.get('mongo_cursor_commands', 0) + 1
+        key = (event.command_name, _collection(event.command_name, event.command), current_route())
+        with self.lock:
+            self._pending[(event.request_id, event.connection_id)] = key
+
+    def _finish(self, event, error):
+        with self.lock:
+            key = self._pending.pop((event.request_id, event.connection_id), None)
+            if key is None:
+                return
+            stats = self.commands.get(key)
+            if stats is None:
+                stats = self.commands[key] = LatencyStats()
+            stats.observe(event.duration_micros / 1000, error)
+        if not has_request_context():
+            return
+        # Commands of the current request, kept for the slow-request log
+        trace = g.get('mongo_trace')
+        if trace is not None and len(trace) < MAX_TRACED_COMMANDS:
+            trace.append((key[0], key[1], event.duration_micros / 1000, error))
+        if not error:
+            g.mongo_documents = g.get('mongo_documents', 0) + _returned_documents(event.reply)
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                dict(stats.summary(), command=command, collection=collection, route=route)
+                for (command, collection, route), stats in sorted(self.commands.items())
+            ]
+
+
+class _PoolState:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.open = 0
+        self.checkout_wait = LatencyStats()
+
+    def summary(self):
+        return {
+            'max_size': self.max_size,
+            'open': self.open,
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+            'waiting': self.waiting,
+            'peak_waiting': self.peak_waiting,
+            'saturation': round(self.in_use / self.max_size, 3) if self.max_size else 0.0,
+            'checkout_wait': self.checkout_wait.summary()
+        }
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Checkout wait time and pool occupancy per server."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pools = {}
+        self._local = threading.local()
+
+    def _pool(self, address):
+        pool = self.pools.get(address)
+        if pool is None:
+            pool = self.pools[address] = _PoolState(0)
+        return pool
+
+    def pool_created(self, event):
+        with self.lock:
+            self._pool(event.address).max_size = event.options.get('maxPoolSize', 100)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self.lock:
+            self._pool(event.address).open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self.lock:
+            self._pool(event.address).open -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self.lock:
+            pool = self._pool(event.address)
+            pool.waiting += 1
+            pool.peak_waiting = max(pool.peak_waiting, pool.waiting)
+
+    def _checkout_done(self, event, error):
+        started = getattr(self._local, 'started', None)
+        wait_ms = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+        self._local.started = None
+        with self.lock:
+            pool = self._pool(event.address)
+            pool.waiting = max(pool.waiting - 1, 0)
+            pool.checkout_wait.observe(wait_ms, error)
+            if not error:
+                pool.in_use += 1
+                pool.peak_in_use = max(pool.peak_in_use, pool.in_use)
+            in_use, max_size = pool.in_use, pool.max_size
+        if wait_ms >= SLOW_CHECKOUT_MS:
+            logger.warning('Waited %.1fms for a MongoDB connection (%d/%d in use, route %s)',
+                           wait_ms, in_use, max_size, current_route())
+
+    def connection_checked_out(self, event):
+        self._checkout_done(event, False)
+
+    def connection_check_out_failed(self, event):
+        self._checkout_done(event, True)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            pool = self._pool(event.address)
+            pool.in_use = max(pool.in_use - 1, 0)
+
+    def snapshot(self):
+        with self.lock:
+            return {f'{host}:{port}': pool.summary() for (host, port), pool in self.pools.items()}
+
+
+command_stats = CommandStats()
+pool_stats = PoolStats()
+LISTENERS = [command_stats, pool_stats]
+
+
+def snapshot():
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'pools': pool_stats.snapshot(),
+        'commands': command_stats.snapshot()
+    }
+
+
+def _report_forever(interval):
+    while True:
+        time.sleep(interval)
+        stats = snapshot()
+        for address, pool in stats['pools'].items():
+            logger.info('MongoDB pool %s: %s', address, pool)
+        slowest = sorted(stats['commands'], key=lambda row: row['mean_ms'], reverse=True)[:10]
+        for row in slowest:
+            logger.info('MongoDB %s %s from %s: %d calls, mean %.1fms, max %.1fms, %d errors',
+                        row['command'], row['collection'], row['route'], row['count'],
+                        row['mean_ms'], row['max_ms'], row['errors'])
+
+
+def start_reporter(interval):
+    """Log pool state and the slowest commands every `interval` seconds."""
+    thread = threading.Thread(target=_report_forever, args=(interval,), name='mongo_metrics', daemon=True)
+    thread.start()
+    return thread
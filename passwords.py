@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import os
+import threading
+import bcrypt
+
+# Password hashing
+# bcrypt is deliberately slow, so hashes are computed on a small dedicated pool
+# rather than by however many request threads happen to be logging in. When more
+# than PASSWORD_HASH_QUEUE_LIMIT hashes are waiting, new ones are refused with
+# PasswordHasherBusy instead of queueing behind a login burst, and a hash that
+# takes longer than PASSWORD_HASH_TIMEOUT seconds is given up on the same way.
+#
+# The request thread still waits for its hash, so this only helps threaded
+# workers (gthread, see gunicorn.conf.py), where request threads outnumber
+# PASSWORD_HASH_WORKERS and keep serving other requests meanwhile. A sync
+# worker has one request in flight and never reaches the queue limit.
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', 16))
+HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt')
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_LIMIT)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password hashes are already queued, or one took too long."""
+
+
+def _run(func, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy('Too many password operations in progress')
+    try:
+        future = _executor.submit(func, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        # The hash keeps its slot until it finishes on the pool
+        raise PasswordHasherBusy('Password operation timed out')
+
+
+def hash_password(password, rounds=None):
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return _run(bcrypt.hashpw, password.encode('utf-8'), salt)
+
+
+def check_password(password, hashed):
+    return _run(bcrypt.checkpw, password.encode('utf-8'), hashed)
+
+
+def hash_rounds(hashed):
+    # bcrypt hashes look like b'$2b$12$...', the cost sits between the 2nd and 3rd '$'
+    return int(hashed.split(b'$')[2])
+
+
+def needs_rehash(hashed):
+    """True when a stored hash was made with a different work factor than BCRYPT_ROUNDS."""
+    return hash_rounds(hashed) != BCRYPT_ROUNDS
@@ -0,0 +1,190 @@
+from collections import defaultdict, deque
+import logging
+import os
+import threading
+import time
+from pymongo.errors import OperationFailure, PyMongoError
+from database import db
+import changelog
+
+logger = logging.getLogger(__name__)
+
+# Per-user change notifications
+# /api/stream connections subscribe here for their user. Writes made by this
+# worker are published straight away by changelog.record; writes made by other
+# workers (or the import and reminder processes) arrive through a listener
+# thread, started on the first subscription in each process:
+#
+#   changestream - watches inserts into change_log. Needs a replica set (a
+#                  single-node one is enough); the resume token carries the
+#                  watch across dropped connections.
+#   poll         - reads the subscribed users' change_versions counters every
+#                  PUSH_POLL_SECONDS, one query per worker however many are open.
+#   local        - no listener; only this worker's writes are pushed.
+#
+# PUSH_BACKEND=auto (default) uses a change stream and falls back to polling
+# when the server does not support them. A write can reach a worker both ways;
+# events are deduplicated by (user, version).
+
+PUSH_BACKEND = os.environ.get('PUSH_BACKEND', 'auto').lower()
+PUSH_POLL_SECONDS = float(os.environ.get('PUSH_POLL_SECONDS', 2))
+RECENT_VERSIONS = 256
+RETRY_SECONDS = 5
+
+
+class Subscription:
+    """Changes waiting for one stream, merged until the stream takes them."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._condition = threading.Condition()
+        self._version = 0
+        self._collections = set()
+        self.closed = False
+
+    def push(self, version, collections):
+        with self._condition:
+            self._version = max(self._version, version)
+            self._collections.update(collections)
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+    def wait(self, timeout):
+        """The merged pending change as {version, collections}, or None after timeout."""
+        with self._condition:
+            if not self._collections and not self.closed:
+                self._condition.wait(timeout)
+            if not self._collections:
+                return None
+            event = {'version': self._version, 'collections': sorted(self._collections)}
+            self._collections = set()
+            return event
+
+
+class Broker:
+    def __init__(self, backend=PUSH_BACKEND):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._recent = defaultdict(lambda: deque(maxlen=RECENT_VERSIONS))
+        self._since = {}
+        self._listener_pid = None
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        self._ensure_listener()
+        return subscription
+
+    def seen(self, user_id, version):
+        """Tell the poller which version a new subscriber is up to date with."""
+        with self._lock:
+            if user_id in self._subscribers:
+                self._since[user_id] = min(self._since.get(user_id, version), version)
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+                    self._recent.pop(subscription.user_id, None)
+                    self._since.pop(subscription.user_id, None)
+
+    def subscribed_users(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def connections(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, user_id, version, collections):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            if not subscribers:
+                return
+            recent = self._recent[user_id]
+            if version in recent:
+                return
+            recent.append(version)
+        for subscription in subscribers:
+            subscription.push(version, collections)
+
+    # Listeners
+
+    def _ensure_listener(self):
+        if self.backend == 'local' or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            # Threads do not survive a fork, so each worker starts its own
+            self._listener_pid = os.getpid()
+        target = self._poll if self.backend == 'poll' else self._watch
+        threading.Thread(target=target, name='pubsub', daemon=True).start()
+
+    def _watch(self):
+        resume_token = None
+        while True:
+            try:
+                pipeline = [{'$match': {'operationType': 'insert'}}]
+                with db[changelog.CHANGE_COLLECTION].watch(pipeline, resume_after=resume_token) as stream:
+                    for change in stream:
+                        entry = change['fullDocument']
+                        collections = ([entry['collection']] if entry['op'] != changelog.RESET
+                                       else changelog.SYNC_COLLECTIONS)
+                        if entry['op'] != changelog.SNAPSHOT:
+                            self.publish(entry['user_id'], entry['version'], collections)
+                        resume_token = stream.resume_token
+            except OperationFailure as e:
+                if resume_token is not None and e.code in (260, 280, 286):
+                    # The resume point has left the oplog; start a fresh watch
+                    resume_token = None
+                    continue
+                if self.backend == 'auto':
+                    logger.info('Change streams unavailable (%s); polling for changes instead', e)
+                    return self._poll()
+                logger.warning('Change stream failed: %s', e)
+            except PyMongoError as e:
+                logger.warning('Change stream interrupted: %s', e)
+            time.sleep(RETRY_SECONDS)
+
+    def _poll(self):
+        known = {}
+        while True:
+            time.sleep(PUSH_POLL_SECONDS)
+            users = self.subscribed_users()
+            for user_id in list(known):
+                if user_id not in users:
+                    del known[user_id]
+            if not users:
+                continue
+            try:
+                for counter in db[changelog.VERSION_COLLECTION].find({'_id': {'$in': users}}):
+                    user_id, version = counter['_id'], counter.get('version', 0)
+                    previous = known.get(user_id, self._since.get(user_id))
+                    if previous is None:
+                        known[user_id] = version
+                        continue
+                    if version <= previous:
+                        continue
+                    # Only advance past entries that have been stored, not just reserved
+                    latest, collections = changelog.changed_collections(user_id, previous)
+                    known[user_id] = latest
+                    if collections:
+                        self.publish(user_id, latest, collections)
+                for user_id in users:
+                    known.setdefault(user_id, self._since.get(user_id, 0))
+            except PyMongoError as e:
+                logger.warning('Polling for changes failed: %s', e)
+
+
+broker = Broker()
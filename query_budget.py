@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+import logging
+import os
+from flask import g, request, current_app
+
+logger = logging.getLogger(__name__)
+
+# Per-endpoint query budgets
+# Views declare how many MongoDB commands, and optionally how many returned
+# documents, one request may use:
+#
+#     @money_bp.route('/api/get_budgets')
+#     @login_required
+#     @query_budget(commands=2)
+#     def get_budgets(): ...
+#
+# The command listener in mongo_metrics counts both for every request. getMore
+# and killCursors are left out of the command count because they grow with the
+# size of the result, which is what the document budget is for. Commands run on
+# executor threads count only if the view adds them to g itself, as the
+# dashboard does for its panels. Budgets assume the default memory response cache and include the
+# users lookup of a cold Flask-Login cache.
+#
+# QUERY_BUDGETS: 'off' (default), 'warn' to log overruns, or 'raise' to raise
+# QueryBudgetExceeded so the request fails - meant for test runs. Outside 'off'
+# every response also carries X-Mongo-Commands and X-Mongo-Documents.
+# tests/test_query_budgets.py runs every budgeted endpoint in 'raise' mode.
+
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGETS', 'off').lower()
+
+_recorders = []
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in 'raise' mode when a request uses more than its declared budget."""
+
+
+def query_budget(commands=None, documents=None):
+    def decorator(view):
+        view.query_budget = {'commands': commands, 'documents': documents}
+        return view
+    return decorator
+
+
+def _budget_for(endpoint):
+    view = current_app.view_functions.get(endpoint)
+    # Decorators built with functools.wraps copy the attribute up or expose __wrapped__
+    while view is not None:
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None:
+            return budget
+        view = getattr(view, '__wrapped__', None)
+    return None
+
+
+def request_counts():
+    """Commands (excluding cursor continuations) and documents used by the current request."""
+    return {
+        'commands': g.get('mongo_commands', 0) - g.get('mongo_cursor_commands', 0),
+        'documents': g.get('mongo_documents', 0)
+    }
+
+
+@contextmanager
+def recording():
+    """Collect the counts of every request finished inside the block, for tests.
+
+        with recording() as requests:
+            client.get('/api/get_budgets')
+        assert requests[0]['commands'] <= 2
+    """
+    log = []
+    _recorders.append(log)
+    try:
+        yield log
+    finally:
+        _recorders.remove(log)
+
+
+def check_budget(response):
+    """after_request hook: compare the request's counts with its endpoint's budget."""
+    if QUERY_BUDGET_MODE == 'off' and not _recorders:
+        return response
+
+    counts = request_counts()
+    budget = _budget_for(request.endpoint) if request.endpoint else None
+    for log in list(_recorders):
+        log.append(dict(counts, endpoint=request.endpoint, budget=budget))
+    if QUERY_BUDGET_MODE == 'off':
+        return response
+
+    response.headers['X-Mongo-Commands'] = str(counts['commands'])
+    response.headers['X-Mongo-Documents'] = str(counts['documents'])
+    if budget is None:
+        return response
+
+    over = [
+        f"{name} {counts[name]} > {limit}"
+        for name, limit in budget.items()
+        if limit is not None and counts[name] > limit
+    ]
+    if over:
+        message = f"Query budget exceeded for {request.endpoint}: {', '.join(over)}"
+        if QUERY_BUDGET_MODE == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
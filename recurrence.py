@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from functools import lru_cache
+import calendar
+
+# Recurring event expansion
+# Events store a single start/end plus a recurrence pattern. Occurrences are
+# generated lazily and jump straight to the requested window instead of
+# walking forward from the first occurrence.
+
+PATTERN_STEPS = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1)
+}
+PATTERN_MONTHS = {
+    'monthly': 1,
+    'yearly': 12
+}
+PATTERNS = set(PATTERN_STEPS) | set(PATTERN_MONTHS)
+
+
+def add_months(value, months):
+    """Shift a datetime by whole months, clamping the day (Jan 31 -> Feb 28)."""
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def _overlaps(start, end, window_start, window_end):
+    if end is None or end <= start:
+        return window_start <= start < window_end
+    return start < window_end and end > window_start
+
+
+def iter_occurrences(start, end, pattern, window_start, window_end):
+    """Yield (start, end) for each occurrence overlapping [window_start, window_end)."""
+    duration = end - start if end and end > start else None
+
+    if pattern not in PATTERNS:
+        if _overlaps(start, end, window_start, window_end):
+            yield start, end
+        return
+
+    if pattern in PATTERN_STEPS:
+        step = PATTERN_STEPS[pattern]
+        # Skip the occurrences that end before the window opens
+        first = 0
+        earliest = window_start - (duration or timedelta(0))
+        if earliest > start:
+            first = (earliest - start) // step
+        index = first
+        while True:
+            occurrence = start + index * step
+            if occurrence >= window_end:
+                return
+            occurrence_end = occurrence + duration if duration else None
+            if _overlaps(occurrence, occurrence_end, window_start, window_end):
+                yield occurrence, occurrence_end
+            index += 1
+    else:
+        months = PATTERN_MONTHS[pattern]
+        index = 0
+        earliest = window_start - (duration or timedelta(0))
+        if earliest > start:
+            # Start one period early; month lengths vary
+            elapsed = (earliest.year - start.year) * 12 + earliest.month - start.month
+            index = max(0, elapsed // months - 1)
+        while True:
+            # Always offset from the original start so clamped days do not drift
+            occurrence = add_months(start, index * months)
+            if occurrence >= window_end:
+                return
+            occurrence_end = occurrence + duration if duration else None
+            if _overlaps(occurrence, occurrence_end, window_start, window_end):
+                yield occurrence, occurrence_end
+            index += 1
+
+
+def next_occurrence(start, pattern, after):
+    """Start of the first occurrence at or after `after`, or None when there is none."""
+    return next((occurrence for occurrence, _ in iter_occurrences(start, None, pattern, after, datetime.max)), None)
+
+
+@lru_cache(maxsize=4096)
+def expand(event_id, version, start, end, pattern, window_start, window_end):
+    """Memoized occurrences of one event version within a window, as a tuple.
+
+    event_id and version only key the cache; a changed event gets a new version
+    and therefore a fresh expansion.
+    """
+    return tuple(iter_occurrences(start, end, pattern, window_start, window_end))
@@ -0,0 +1,424 @@
+"""Reminder scheduler for bills, events and tasks.
+
+Runs as its own process next to the web workers (see procfile):
+
+    python reminders.py            # run forever
+    python reminders.py --once     # one scan and delivery pass, e.g. from cron
+
+Upcoming reminders are loaded into a heap ordered by the time they should fire.
+Every SCAN_INTERVAL the scheduler loads only the next slice of time with one
+indexed range scan per collection across all users, so the cost of a tick does
+not grow with the number of users who have nothing due. Users' notification
+settings are fetched in batches with $in, and are checked again right before
+sending so a change made after loading is still honoured. Recurring events keep
+their next occurrence in next_occurrence, so a scan only expands the ones that
+occur in its slice rather than every recurring event ever created.
+
+Each reminder is recorded in reminder_log (keyed by item and occurrence) before
+it is sent, so restarts and overlapping schedulers never send it twice.
+
+Reminder times, using the user's notification_settings['time'] of day:
+  bills  - BILL_REMINDER_DAYS days before the due date
+  tasks  - on the due date
+  events - EVENT_REMINDER_MINUTES before each occurrence starts
+
+The 'bills' setting covers bills; 'events' covers events and tasks. Nothing is
+sent to users with 'email' turned off.
+
+REMINDER_SENDER picks the delivery backend: 'smtp' (default) or 'log'. For local
+testing point SMTP_HOST/SMTP_PORT at a stand-in such as
+`python -m aiosmtpd -n -l localhost:1025`.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import argparse
+import heapq
+import itertools
+import logging
+import os
+import smtplib
+import time
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import db
+import changelog
+import recurrence
+
+logger = logging.getLogger(__name__)
+
+LOG_COLLECTION = 'reminder_log'
+
+SCAN_INTERVAL = timedelta(seconds=int(os.environ.get('REMINDER_SCAN_SECONDS', 300)))
+LOOKAHEAD = timedelta(seconds=int(os.environ.get('REMINDER_LOOKAHEAD_SECONDS', 900)))
+# How far back a fresh scheduler looks for reminders it may have missed while down
+CATCH_UP = timedelta(seconds=int(os.environ.get('REMINDER_CATCH_UP_SECONDS', 3600)))
+BILL_REMINDER_DAYS = int(os.environ.get('BILL_REMINDER_DAYS', 1))
+EVENT_REMINDER_MINUTES = int(os.environ.get('EVENT_REMINDER_MINUTES', 30))
+RETRY_DELAY = timedelta(minutes=5)
+SCAN_BATCH_SIZE = 1000
+SEND_BATCH_SIZE = 100
+# next_occurrence of a recurring event that has no occurrences left
+NO_OCCURRENCE = datetime(9999, 12, 31)
+
+DEFAULT_SETTINGS = {'email': True, 'bills': True, 'events': True, 'time': '09:00'}
+USER_PROJECTION = {'username': 1, 'email': 1, 'notification_settings': 1}
+# notification_settings flag that enables each kind of reminder
+KIND_SETTINGS = {'bill': 'bills', 'task': 'events', 'event': 'events'}
+
+
+# Senders
+
+class LogSender:
+    """Writes messages to the log instead of delivering them."""
+
+    def send(self, messages):
+        for message in messages:
+            logger.info('Reminder for %s: %s\n%s', message['To'], message['Subject'], message.get_content())
+
+
+class SMTPSender:
+    """Delivers a batch of messages over one SMTP connection."""
+
+    def __init__(self):
+        self.host = os.environ.get('SMTP_HOST', 'localhost')
+        self.port = int(os.environ.get('SMTP_PORT', 1025))
+        self.username = os.environ.get('SMTP_USERNAME')
+        self.password = os.environ.get('SMTP_PASSWORD')
+        self.use_tls = os.environ.get('SMTP_TLS', 'false').lower() == 'true'
+        self.sender = os.environ.get('REMINDER_FROM', 'reminders@localhost')
+
+    def send(self, messages):
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                message['From'] = self.sender
+                smtp.send_message(message)
+
+
+SENDERS = {
+    'smtp': SMTPSender,
+    'log': LogSender
+}
+
+
+# Loading
+
+def _user_settings(user):
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(user.get('notification_settings') or {})
+    return settings
+
+
+def load_users(user_ids):
+    """Fetch users by id in one query; returns {user_id: user}."""
+    object_ids = [ObjectId(user_id) for user_id in set(user_ids) if ObjectId.is_valid(user_id)]
+    users = db.users.find({'_id': {'$in': object_ids}}, USER_PROJECTION)
+    return {str(user['_id']): user for user in users}
+
+
+def _wants(user, kind):
+    if not user or not user.get('email'):
+        return False
+    settings = _user_settings(user)
+    return bool(settings['email'] and settings[KIND_SETTINGS[kind]])
+
+
+def _time_of_day(user):
+    try:
+        hours, minutes = _user_settings(user)['time'].split(':')
+        return timedelta(hours=int(hours), minutes=int(minutes))
+    except (AttributeError, ValueError):
+        return timedelta(hours=9)
+
+
+def _day(value):
+    return datetime(value.year, value.month, value.day)
+
+
+def _bill_candidates(window_start, window_end):
+    # Fire time is (due day - lead) + time of day, and time of day is under 24h
+    lead = timedelta(days=BILL_REMINDER_DAYS)
+    query = {
+        'paid': False,
+        'due_date': {'$gte': _day(window_start) + lead - timedelta(days=1),
+                     '$lt': _day(window_end) + lead + timedelta(days=1)}
+    }
+    projection = {'user_id': 1, 'name': 1, 'amount': 1, 'due_date': 1}
+    for bill in db.bills.find(query, projection).batch_size(SCAN_BATCH_SIZE):
+        yield {
+            'kind': 'bill',
+            'item_id': str(bill['_id']),
+            'user_id': bill['user_id'],
+            'title': bill['name'],
+            'when': bill['due_date'],
+            'amount': bill.get('amount'),
+            'day': _day(bill['due_date']) - lead
+        }
+
+
+def _task_candidates(window_start, window_end):
+    query = {
+        'completed': False,
+        'due_date': {'$gte': _day(window_start) - timedelta(days=1), '$lt': _day(window_end) + timedelta(days=1)}
+    }
+    projection = {'user_id': 1, 'name': 1, 'due_date': 1, 'priority': 1}
+    for task in db.tasks.find(query, projection).batch_size(SCAN_BATCH_SIZE):
+        yield {
+            'kind': 'task',
+            'item_id': str(task['_id']),
+            'user_id': task['user_id'],
+            'title': task['name'],
+            'when': task['due_date'],
+            'priority': task.get('priority'),
+            'day': _day(task['due_date'])
+        }
+
+
+def _event_candidates(window_start, window_end):
+    # An occurrence starting in [window_start + lead, window_end + lead) fires in the window.
+    # Recurring events are found by next_occurrence, which each scan moves forward; writes
+    # clear it (items.py) for the next scan to work out again.
+    lead = timedelta(minutes=EVENT_REMINDER_MINUTES)
+    starts_from, starts_to = window_start + lead, window_end + lead
+    query = {'$or': [
+        {'start': {'$gte': starts_from, '$lt': starts_to}},
+        {'recurring': True, 'next_occurrence': {'$lt': starts_to}},
+        {'recurring': True, 'next_occurrence': None}
+    ]}
+    projection = {'user_id': 1, 'title': 1, 'start': 1, 'end': 1, 'recurring': 1, 'recurrence_pattern': 1,
+                  'next_occurrence': 1}
+    operations = []
+    for event in db.events.find(query, projection).batch_size(SCAN_BATCH_SIZE):
+        pattern = event.get('recurrence_pattern') if event.get('recurring') else None
+        # Only occurrence starts matter here, so expand without the end
+        for start, _ in recurrence.iter_occurrences(event['start'], None, pattern, starts_from, starts_to):
+            yield {
+                'kind': 'event',
+                'item_id': str(event['_id']),
+                'user_id': event['user_id'],
+                'title': event['title'],
+                'when': start,
+                'fire_at': start - lead
+            }
+        if not event.get('recurring'):
+            continue
+        # Trails the scans by CATCH_UP, so a restarted scheduler still finds what its predecessor
+        # had loaded but not sent
+        next_start = recurrence.next_occurrence(event['start'], pattern, starts_to - CATCH_UP) or NO_OCCURRENCE
+        if next_start != event.get('next_occurrence'):
+            operations.append(UpdateOne(
+                # Left alone if the event was edited meanwhile
+                {'_id': event['_id'], 'next_occurrence': event.get('next_occurrence')},
+                {'$set': {'next_occurrence': next_start}}
+            ))
+        if len(operations) >= SCAN_BATCH_SIZE:
+            db.events.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.events.bulk_write(operations, ordered=False)
+
+
+CANDIDATES = (_bill_candidates, _task_candidates, _event_candidates)
+
+
+def _log_id(reminder):
+    return f"{reminder['kind']}:{reminder['item_id']}:{reminder['when'].isoformat()}"
+
+
+# Recurring bills
+
+def roll_recurring_bills(today=None):
+    """Move recurring bills whose due date has passed to their next due date.
+
+    Bills repeat monthly. The first due date is kept as recurrence_anchor so
+    month-end due dates do not drift (Jan 31 -> Feb 28 -> Mar 31). Returns the
+    number of bills moved.
+    """
+    today = _day(today or datetime.now())
+    query = {'recurring': True, 'due_date': {'$lt': today}}
+    projection = {'user_id': 1, 'due_date': 1, 'recurrence_anchor': 1}
+    # Marks the bills this call moved, in case another scheduler moved some first
+    rolled_at = datetime.now()
+    operations, owners, moved = [], [], 0
+    users = defaultdict(list)
+
+    def flush():
+        modified = db.bills.bulk_write(operations, ordered=False).modified_count
+        rolled = owners
+        if modified < len(operations):
+            ids = {bill['_id'] for bill in db.bills.find(
+                {'_id': {'$in': [bill_id for _, bill_id in owners]}, 'rolled_at': rolled_at}, {'_id': 1})}
+            rolled = [(user_id, bill_id) for user_id, bill_id in owners if bill_id in ids]
+        for user_id, bill_id in rolled:
+            users[user_id].append(bill_id)
+        operations.clear()
+        owners.clear()
+        return modified
+
+    for bill in db.bills.find(query, projection).batch_size(SCAN_BATCH_SIZE):
+        anchor = bill.get('recurrence_anchor') or bill['due_date']
+        months = (today.year - anchor.year) * 12 + today.month - anchor.month
+        next_due = recurrence.add_months(anchor, max(months, 0))
+        if next_due < today:
+            next_due = recurrence.add_months(anchor, months + 1)
+        operations.append(UpdateOne(
+            # Matching the old due date keeps concurrent schedulers from rolling twice
+            {'_id': bill['_id'], 'due_date': bill['due_date']},
+            {'$set': {'due_date': next_due, 'paid': False, 'recurrence_anchor': anchor, 'rolled_at': rolled_at}}
+        ))
+        owners.append((bill['user_id'], bill['_id']))
+        if len(operations) >= SCAN_BATCH_SIZE:
+            moved += flush()
+
+    if operations:
+        moved += flush()
+    for user_id, bill_ids in users.items():
+        changelog.record(user_id, 'bills', bill_ids, changelog.UPDATE)
+    return moved
+
+
+# Scheduler
+
+class ReminderScheduler:
+    def __init__(self, sender, now=None):
+        self.sender = sender
+        self.heap = []
+        self._sequence = itertools.count()
+        now = now or datetime.now()
+        self.loaded_until = now - CATCH_UP
+        self.next_scan = now
+        self.last_roll = None
+
+    def push(self, fire_at, reminder):
+        heapq.heappush(self.heap, (fire_at, next(self._sequence), reminder))
+
+    def scan(self, now):
+        """Load reminders firing in [loaded_until, now + LOOKAHEAD) into the heap."""
+        window_start, window_end = self.loaded_until, now + LOOKAHEAD
+        candidates = [reminder for source in CANDIDATES for reminder in source(window_start, window_end)]
+        users = {}
+        for offset in range(0, len(candidates), SCAN_BATCH_SIZE):
+            batch = candidates[offset:offset + SCAN_BATCH_SIZE]
+            users.update(load_users(reminder['user_id'] for reminder in batch
+                                    if reminder['user_id'] not in users))
+
+        loaded = 0
+        for reminder in candidates:
+            user = users.get(reminder['user_id'])
+            if not _wants(user, reminder['kind']):
+                continue
+            fire_at = reminder.pop('fire_at', None) or reminder.pop('day') + _time_of_day(user)
+            reminder.pop('day', None)
+            if window_start <= fire_at < window_end:
+                self.push(fire_at, reminder)
+                loaded += 1
+
+        self.loaded_until = window_end
+        self.next_scan = now + SCAN_INTERVAL
+        logger.info('Loaded %d reminders firing before %s', loaded, window_end)
+
+    def _claim(self, reminders):
+        """Record reminders in reminder_log; returns those not already sent."""
+        if not reminders:
+            return []
+        now = datetime.now()
+        operations = [InsertOne({'_id': _log_id(reminder), 'user_id': reminder['user_id'], 'sent_at': now})
+                      for reminder in reminders]
+        try:
+            db[LOG_COLLECTION].bulk_write(operations, ordered=False)
+            return reminders
+        except BulkWriteError as e:
+            taken = {error['index'] for error in e.details.get('writeErrors', []) if error.get('code') == 11000}
+            return [reminder for index, reminder in enumerate(reminders) if index not in taken]
+
+    def deliver(self, reminders):
+        reminders = self._claim(reminders)
+        if not reminders:
+            return 0
+
+        # Settings may have changed since the reminder was loaded
+        users = load_users(reminder['user_id'] for reminder in reminders)
+        by_user = {}
+        for reminder in reminders:
+            user = users.get(reminder['user_id'])
+            if _wants(user, reminder['kind']):
+                by_user.setdefault(reminder['user_id'], []).append(reminder)
+
+        sent = 0
+        user_ids = list(by_user)
+        for offset in range(0, len(user_ids), SEND_BATCH_SIZE):
+            batch = user_ids[offset:offset + SEND_BATCH_SIZE]
+            try:
+                self.sender.send([build_message(users[user_id], by_user[user_id]) for user_id in batch])
+                sent += sum(len(by_user[user_id]) for user_id in batch)
+            except Exception:
+                logger.exception('Sending reminders failed; retrying in %s', RETRY_DELAY)
+                failed = [reminder for user_id in batch for reminder in by_user[user_id]]
+                db[LOG_COLLECTION].delete_many({'_id': {'$in': [_log_id(reminder) for reminder in failed]}})
+                for reminder in failed:
+                    self.push(datetime.now() + RETRY_DELAY, reminder)
+        return sent
+
+    def due(self, now):
+        reminders = []
+        while self.heap and self.heap[0][0] <= now:
+            reminders.append(heapq.heappop(self.heap)[2])
+        return reminders
+
+    def tick(self, now=None):
+        now = now or datetime.now()
+        if self.last_roll != now.date():
+            roll_recurring_bills(now)
+            self.last_roll = now.date()
+        if now >= self.next_scan:
+            self.scan(now)
+        return self.deliver(self.due(now))
+
+    def run(self):
+        while True:
+            self.tick()
+            now = datetime.now()
+            wake = min(self.heap[0][0], self.next_scan) if self.heap else self.next_scan
+            time.sleep(min(max((wake - now).total_seconds(), 1), SCAN_INTERVAL.total_seconds()))
+
+
+def _describe(reminder):
+    if reminder['kind'] == 'bill':
+        return f"Bill '{reminder['title']}' ({reminder['amount']:,.2f}) is due {reminder['when']:%Y-%m-%d}"
+    if reminder['kind'] == 'task':
+        return f"Task '{reminder['title']}' is due {reminder['when']:%Y-%m-%d}"
+    return f"Event '{reminder['title']}' starts {reminder['when']:%Y-%m-%d %H:%M}"
+
+
+def build_message(user, reminders):
+    """One email per user listing everything that fired together."""
+    message = EmailMessage()
+    message['To'] = user['email']
+    message['Subject'] = (_describe(reminders[0]) if len(reminders) == 1
+                          else f'{len(reminders)} upcoming reminders')
+    lines = [f"Hi {user.get('username', '')},", ''] + [f'- {_describe(reminder)}' for reminder in reminders]
+    message.set_content('\n'.join(lines) + '\n')
+    return message
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send bill, event and task reminders.')
+    parser.add_argument('--once', action='store_true', help='run a single pass and exit')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    sender = SENDERS[os.environ.get('REMINDER_SENDER', 'smtp')]()
+    scheduler = ReminderScheduler(sender)
+    if args.once:
+        scheduler.tick()
+    else:
+        scheduler.run()
+
+
+if __name__ == '__main__':
+    main()
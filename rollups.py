@@ -0,0 +1,196 @@
+from collections import defaultdict
+from datetime import datetime
+from pymongo import UpdateOne
+from database import db
+import archive
+
+# Monthly rollups
+# One document per (user_id, kind, month, category) holding the running total
+# and count of the matching transactions. Writes to incomes/expenses keep them
+# current with $inc, so summaries and reports read a handful of small documents
+# instead of grouping the user's whole history.
+#
+# Deployments that had transactions before the rollups existed start with an
+# empty collection; every worker's warmup calls backfill(), which builds them
+# once. `flask rebuild-rollups --check` reports any drift afterwards.
+
+ROLLUP_COLLECTION = 'monthly_rollups'
+
+# kind -> (source collection, field used as the rollup category)
+ROLLUP_SOURCES = {
+    'income': ('incomes', 'source'),
+    'expense': ('expenses', 'category')
+}
+
+COLLECTION_KINDS = {collection: kind for kind, (collection, _) in ROLLUP_SOURCES.items()}
+
+# Floating point totals built up by $inc can differ from a fresh $sum in the
+# last few bits; anything below this is not treated as drift.
+DRIFT_TOLERANCE = 0.005
+
+
+def month_key(value):
+    return value.strftime('%Y-%m')
+
+
+def _rollup_key(kind, item):
+    _, category_field = ROLLUP_SOURCES[kind]
+    return (item['user_id'], month_key(item['date']), item.get(category_field))
+
+
+def _rollup_update(kind, key, total, count):
+    user_id, month, category = key
+    return UpdateOne(
+        {'user_id': user_id, 'kind': kind, 'month': month, 'category': category},
+        {'$inc': {'total': total, 'count': count}},
+        upsert=True
+    )
+
+
+def apply_transaction(kind, item, sign=1):
+    """Add (sign=1) or remove (sign=-1) one income/expense document from the rollups."""
+    user_id, month, category = _rollup_key(kind, item)
+    db[ROLLUP_COLLECTION].update_one(
+        {'user_id': user_id, 'kind': kind, 'month': month, 'category': category},
+        {'$inc': {'total': sign * item['amount'], 'count': sign}},
+        upsert=True
+    )
+
+
+def apply_changes(kind, added=(), removed=()):
+    """Add and remove documents in one bulk write; an update is its old version removed and new added."""
+    totals = defaultdict(lambda: [0, 0])
+    for sign, items in ((1, added), (-1, removed)):
+        for item in items:
+            entry = totals[_rollup_key(kind, item)]
+            entry[0] += sign * item['amount']
+            entry[1] += sign
+
+    # Updates that leave a month and category unchanged cancel out here
+    requests = [_rollup_update(kind, key, total, count) for key, (total, count) in totals.items() if total or count]
+    if requests:
+        db[ROLLUP_COLLECTION].bulk_write(requests, ordered=False)
+
+
+def summary_totals(user_id, month_from=None, month_to=None):
+    """Return {'income': total, 'expense': total} for months in [month_from, month_to)."""
+    match = {'user_id': user_id}
+    if month_from or month_to:
+        match['month'] = {}
+        if month_from:
+            match['month']['$gte'] = month_from
+        if month_to:
+            match['month']['$lt'] = month_to
+
+    pipeline = [
+        {'$match': match},
+        {'$group': {'_id': '$kind', 'total': {'$sum': '$total'}}}
+    ]
+    totals = {'income': 0, 'expense': 0}
+    for row in db[ROLLUP_COLLECTION].aggregate(pipeline):
+        totals[row['_id']] = row['total']
+    return totals
+
+
+def category_totals(user_id, kind, limit=None):
+    """Return [(category, total)] for one kind over all months, largest first."""
+    pipeline = [
+        {'$match': {'user_id': user_id, 'kind': kind}},
+        {'$group': {'_id': '$category', 'total': {'$sum': '$total'}, 'count': {'$sum': '$count'}}},
+        {'$match': {'count': {'$gt': 0}}},
+        {'$sort': {'total': -1}}
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    return [(row['_id'], row['total']) for row in db[ROLLUP_COLLECTION].aggregate(pipeline)]
+
+
+def _source_rollups(kind, user_id=None):
+    collection, category_field = ROLLUP_SOURCES[kind]
+    match = {'user_id': user_id} if user_id else {}
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'user_id': '$user_id',
+                'month': {'$dateToString': {'format': '%Y-%m', 'date': '$date'}},
+                'category': f'${category_field}'
+            },
+            'total': {'$sum': '$amount'},
+            'count': {'$sum': 1}
+        }}
+    ]
+    return {
+        (row['_id']['user_id'], row['_id']['month'], row['_id'].get('category')): (row['total'], row['count'])
+        for row in archive.including(collection).aggregate(pipeline, allowDiskUse=True)
+    }
+
+
+def rebuild_rollups(user_id=None, repair=True):
+    """Recompute rollups from the source collections and their archives and compare with the stored ones.
+
+    Returns a list of drifted keys as dicts. With repair=True the stored rollups
+    are overwritten with the recomputed values and stale rollups are removed.
+    """
+    drift = []
+    for kind in ROLLUP_SOURCES:
+        expected = _source_rollups(kind, user_id)
+
+        query = {'kind': kind}
+        if user_id:
+            query['user_id'] = user_id
+        stored = {
+            (doc['user_id'], doc['month'], doc.get('category')): (doc['total'], doc['count'])
+            for doc in db[ROLLUP_COLLECTION].find(query)
+        }
+
+        operations = []
+        for key in set(expected) | set(stored):
+            want_total, want_count = expected.get(key, (0, 0))
+            have_total, have_count = stored.get(key, (0, 0))
+            if want_count == have_count and abs(want_total - have_total) <= DRIFT_TOLERANCE:
+                continue
+
+            user, month, category = key
+            drift.append({
+                'kind': kind, 'user_id': user, 'month': month, 'category': category,
+                'expected': want_total, 'stored': have_total
+            })
+            rollup_filter = {'user_id': user, 'kind': kind, 'month': month, 'category': category}
+            if want_count:
+                operations.append(UpdateOne(
+                    rollup_filter,
+                    {'$set': {'total': want_total, 'count': want_count, 'rebuilt_at': datetime.now()}},
+                    upsert=True
+                ))
+            else:
+                operations.append(UpdateOne(rollup_filter, {'$set': {'total': 0, 'count': 0}}))
+
+        if repair and operations:
+            db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+
+    if repair:
+        # Drop the zeroed rollups left behind by deletes and repairs
+        query = {'count': {'$lte': 0}}
+        if user_id:
+            query['user_id'] = user_id
+        db[ROLLUP_COLLECTION].delete_many(query)
+
+    return drift
+
+
+def backfill():
+    """Build every user's rollups if there are none yet; returns whether it did.
+
+    Summaries read only the rollups, so without this they would show zero
+    for existing data until rebuild-rollups was run by hand. Rebuilding is
+    idempotent, so workers warming up at the same time do no harm.
+    """
+    if db[ROLLUP_COLLECTION].find_one({}, {'_id': 1}) is not None:
+        return False
+    rebuild_rollups()
+    return True
+
+
+def clear_rollups(user_id):
+    db[ROLLUP_COLLECTION].delete_many({'user_id': user_id})
@@ -0,0 +1,175 @@
+from flask import Blueprint, request, jsonify, g, copy_current_request_context
+from flask_login import login_required, current_user
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from database import db
+import rollups
+import transactions
+from routes import events
+from query_budget import query_budget
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+# Shared by all requests in this worker; each dashboard load submits one job per
+# panel so the queries overlap on the Mongo connection pool.
+_panel_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='dashboard')
+
+# Per-request counters of the command listener (mongo_metrics), summed over the panels
+PANEL_COUNTERS = ('mongo_commands', 'mongo_cursor_commands', 'mongo_documents')
+
+
+def _submit(panel, *args):
+    """Run a panel on the executor in a copy of the request context.
+
+    The copy has its own g, so the panel's commands are returned with its
+    result and added to the request's counts by the view.
+    """
+    @copy_current_request_context
+    def run():
+        return panel(*args), {name: g.get(name, 0) for name in PANEL_COUNTERS}
+    return _panel_executor.submit(run)
+
+
+def _summary(user_id, now):
+    this_month = datetime(now.year, now.month, 1)
+    last_month = (this_month - timedelta(days=1)).replace(day=1)
+    next_month = (this_month + timedelta(days=32)).replace(day=1)
+
+    all_time = rollups.summary_totals(user_id)
+    current = rollups.summary_totals(user_id, rollups.month_key(this_month), rollups.month_key(next_month))
+    previous = rollups.summary_totals(user_id, rollups.month_key(last_month), rollups.month_key(this_month))
+    return {
+        'total_income': all_time['income'],
+        'total_expense': all_time['expense'],
+        'balance': all_time['income'] - all_time['expense'],
+        'current_month': current,
+        'previous_month': previous
+    }
+
+
+def _top_categories(user_id, kind, limit):
+    return [
+        {'name': name, 'total': total}
+        for name, total in rollups.category_totals(user_id, kind, limit)
+    ]
+
+
+def _recent_transactions(user_id, limit):
+    projection = {'amount': 1, 'date': 1, 'source': 1, 'category': 1, 'description': 1}
+    sort = [('date', -1), ('_id', -1)]
+    incomes = transactions.collection('incomes').find({'user_id': user_id}, projection, sort=sort, limit=limit)
+    expenses = transactions.collection('expenses').find({'user_id': user_id}, projection, sort=sort, limit=limit)
+
+    recent = [
+        {'id': str(item['_id']), 'type': 'income', 'date': item['date'],
+         'description': item.get('source', ''), 'category': 'Income', 'amount': item['amount']}
+        for item in incomes
+    ] + [
+        {'id': str(item['_id']), 'type': 'expense', 'date': item['date'],
+         'description': item.get('description') or item.get('category', ''),
+         'category': item.get('category', ''), 'amount': item['amount']}
+        for item in expenses
+    ]
+    recent.sort(key=lambda t: t['date'], reverse=True)
+
+    for transaction in recent[:limit]:
+        transaction['date'] = transaction['date'].strftime('%Y-%m-%d')
+    return recent[:limit]
+
+
+def _upcoming_bills(user_id, today, limit):
+    query = {'user_id': user_id, 'paid': False, 'due_date': {'$gte': today}}
+    pipeline = [
+        {'$match': query},
+        {'$group': {'_id': None, 'count': {'$sum': 1}, 'total': {'$sum': '$amount'}}}
+    ]
+    totals = next(iter(db.bills.aggregate(pipeline)), {'count': 0, 'total': 0})
+    items = db.bills.find(query, {'name': 1, 'amount': 1, 'due_date': 1}).sort('due_date', 1).limit(limit)
+    return {
+        'count': totals['count'],
+        'total': totals['total'],
+        'items': [
+            {'id': str(bill['_id']), 'name': bill['name'], 'amount': bill['amount'],
+             'due_date': bill['due_date'].strftime('%Y-%m-%d')}
+            for bill in items
+        ]
+    }
+
+
+def _upcoming_events(user_id, now, days, limit):
+    # Expanded like the calendar, so repeats of a series that began earlier show up too
+    occurrences = events.occurrences_in_window(user_id, now, now + timedelta(days=days))
+    upcoming = sorted(((start, end, event) for event, start, end in occurrences if start >= now),
+                      key=lambda occurrence: occurrence[0])
+    return [
+        {'id': str(event['_id']), 'title': event['title'],
+         'start': start.isoformat(),
+         'end': end.isoformat() if end else None,
+         'description': event.get('description', '')}
+        for start, end, event in upcoming[:limit]
+    ]
+
+
+def _open_tasks(user_id, limit):
+    query = {'user_id': user_id, 'completed': False}
+    projection = {'name': 1, 'due_date': 1, 'priority': 1, 'description': 1}
+    return [
+        {'id': str(task['_id']), 'name': task['name'],
+         'due_date': task['due_date'].strftime('%Y-%m-%d'),
+         'priority': task.get('priority', 'medium'),
+         'description': task.get('description', '')}
+        for task in db.tasks.find(query, projection).sort('due_date', 1).limit(limit)
+    ]
+
+
+def _goal_progress(user_id):
+    projection = {'name': 1, 'target_amount': 1, 'current_amount': 1, 'target_date': 1}
+    goals = []
+    for goal in db.goals.find({'user_id': user_id}, projection):
+        target = goal.get('target_amount') or 0
+        current = goal.get('current_amount') or 0
+        goals.append({
+            'id': str(goal['_id']),
+            'name': goal['name'],
+            'target_amount': target,
+            'current_amount': current,
+            'progress': round(current / target * 100, 1) if target else 0,
+            'target_date': goal['target_date'].strftime('%Y-%m-%d') if goal.get('target_date') else None
+        })
+    return goals
+
+
+@dashboard_bp.route('/api/dashboard')
+@login_required
+@query_budget(commands=13)
+def get_dashboard():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 5)), 50))
+        days = max(1, min(int(request.args.get('days', 7)), 31))
+        # current_user is request-local, so resolve it before handing work to other threads
+        user_id = current_user.id
+        now = datetime.now()
+        today = datetime(now.year, now.month, now.day)
+
+        panels = {
+            'summary': _submit(_summary, user_id, now),
+            'top_income_sources': _submit(_top_categories, user_id, 'income', 5),
+            'top_expense_categories': _submit(_top_categories, user_id, 'expense', 5),
+            'recent_transactions': _submit(_recent_transactions, user_id, limit),
+            'bills': _submit(_upcoming_bills, user_id, today, limit),
+            'events': _submit(_upcoming_events, user_id, now, days, limit),
+            'tasks': _submit(_open_tasks, user_id, limit),
+            'goals': _submit(_goal_progress, user_id)
+        }
+
+        bundle = {}
+        for name, future in panels.items():
+            bundle[name], counts = future.result()
+            for counter, value in counts.items():
+                setattr(g, counter, g.get(counter, 0) + value)
+        return jsonify(bundle)
+
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid limit or days'}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error loading dashboard: {str(e)}'}), 500
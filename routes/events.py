@@ -1,11 +1,29 @@
 from flask import Blueprint, request, jsonify, render_template
 from flask_login import login_required, current_user
-from bson import ObjectId
-from datetime import datetime
-from database import db
+from datetime import datetime, timedelta
+import recurrence
+import cache
+import items
+import archive
+from cache import cached_response
+from freebusy import BusyIndex
+from query_budget import query_budget
+from serialization import Schema, Default, ID, DATE, ISO
 
 events_bp = Blueprint('events', __name__)
 
+# How far ahead a new recurring event is checked for conflicts
+CONFLICT_HORIZON_DAYS = 90
+
+# Busy indexes keyed by (user, data version, window), shared by requests in this worker
+_busy_indexes = cache.MemoryBackend(max_entries=512)
+
+# Output schemas; the endpoints return them keyed by id
+EVENT_SCHEMA = Schema(_id=ID, title=None, start=ISO, end=Default(None, ISO), description=Default(''),
+                      recurring=Default(False), recurrence_pattern=Default(None))
+TASK_SCHEMA = Schema(_id=ID, name=None, due_date=DATE, priority=Default('medium'), description=Default(''),
+                     completed=Default(False), completed_date=Default(None, DATE))
+
 @events_bp.route('/events')
 @login_required
 def events_page():
@@ -14,153 +32,267 @@ def events_page():
 # API Routes for Events Management
 @events_bp.route('/api/add_event', methods=['POST'])
 @login_required
+@query_budget(commands=6)
 def add_event():
     try:
         data = request.get_json()
         
-        # Parse dates properly
-        start_date_str = data['start'].split('T')[0] if 'T' in data['start'] else data['start']
-        start_time_str = data['start'].split('T')[1] if 'T' in data['start'] else '00:00'
-        
-        start_datetime = datetime.strptime(f"{start_date_str} {start_time_str}", '%Y-%m-%d %H:%M')
-        
-        end_datetime = None
-        if data.get('end'):
-            end_date_str = data['end'].split('T')[0] if 'T' in data['end'] else data['end']
-            end_time_str = data['end'].split('T')[1] if 'T' in data['end'] else '00:00'
-            end_datetime = datetime.strptime(f"{end_date_str} {end_time_str}", '%Y-%m-%d %H:%M')
+        event_data = items.build('events', data, current_user.id)
         
-        event_data = {
-            'user_id': current_user.id,
-            'title': data['title'],
-            'start': start_datetime,
-            'end': end_datetime,
-            'description': data.get('description', ''),
-            'recurring': data.get('recurring', False),
-            'recurrence_pattern': data.get('recurrence_pattern'),
-            'created_at': datetime.now()
-        }
+        # Time blocking: flag (default) or reject events that overlap existing ones
+        on_conflict = data.get('on_conflict', 'allow')
+        conflicts = find_conflicts(current_user.id, event_data)
+        if conflicts and on_conflict == 'reject':
+            return jsonify({
+                'status': 'error',
+                'message': 'Event overlaps existing events',
+                'conflicts': conflicts
+            }), 409
         
-        result = db.events.insert_one(event_data)
-        return jsonify({'status': 'success', 'message': 'Event added successfully', 'id': str(result.inserted_id)})
+        items.insert('events', event_data)
+        return jsonify({
+            'status': 'success',
+            'message': 'Event added successfully',
+            'id': str(event_data['_id']),
+            'conflicts': conflicts
+        })
     
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error adding event: {str(e)}'}), 500
 
 @events_bp.route('/api/add_task', methods=['POST'])
 @login_required
+@query_budget(commands=4)
 def add_task():
     try:
         data = request.get_json()
         
-        task_data = {
-            'user_id': current_user.id,
-            'name': data['name'],
-            'due_date': datetime.strptime(data['due_date'], '%Y-%m-%d'),
-            'priority': data.get('priority', 'medium'),
-            'description': data.get('description', ''),
-            'completed': False,
-            'completed_date': None,
-            'created_at': datetime.now()
-        }
-        
-        result = db.tasks.insert_one(task_data)
-        return jsonify({'status': 'success', 'message': 'Task added successfully', 'id': str(result.inserted_id)})
+        task = items.create('tasks', data, current_user.id)
+        return jsonify({'status': 'success', 'message': 'Task added successfully', 'id': str(task['_id'])})
     
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error adding task: {str(e)}'}), 500
 
 @events_bp.route('/api/get_events')
 @login_required
+@cached_response('events')
+@query_budget(commands=3)
 def get_events():
     try:
-        events = list(db.events.find({'user_id': current_user.id}).sort('start', 1))
+        source = archive.including('events', archive.include_archived(request.args))
+        events = EVENT_SCHEMA.find(source, {'user_id': current_user.id}, [('start', 1)])
+        return jsonify({event.pop('_id'): event for event in events})
+    
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error fetching events: {str(e)}'}), 500
+
+# Longest window a single calendar request may ask for
+MAX_CALENDAR_DAYS = 400
+
+
+def _parse_calendar_bound(value):
+    # Accept plain dates or ISO datetimes
+    return datetime.fromisoformat(value) if 'T' in value else datetime.strptime(value, '%Y-%m-%d')
+
+
+def _events_in_window(user_id, window_start, window_end, include_archived=False):
+    """Fetch only the events that can overlap the window.
+
+    Each $or branch is a range scan on its own index: events starting inside the
+    window, events that started earlier but end inside it, and recurring events
+    whose series began before the window closes. Archived events are added when
+    asked for; only past, non-recurring events are ever archived.
+    """
+    query = {'$or': [
+        {'user_id': user_id, 'start': {'$gte': window_start, '$lt': window_end}},
+        {'user_id': user_id, 'end': {'$gt': window_start}, 'start': {'$lt': window_start}},
+        {'user_id': user_id, 'recurring': True, 'start': {'$lt': window_end}}
+    ]}
+    projection = {'title': 1, 'start': 1, 'end': 1, 'description': 1, 'recurring': 1,
+                  'recurrence_pattern': 1, 'created_at': 1, 'updated_at': 1}
+    # With the archive this is still one command, through $unionWith
+    return archive.including('events', include_archived).aggregate([{'$match': query}, {'$project': projection}])
+
+
+def occurrences_in_window(user_id, window_start, window_end, include_archived=False):
+    """Yield (event, start, end) for every occurrence overlapping the window."""
+    for event in _events_in_window(user_id, window_start, window_end, include_archived):
+        pattern = event.get('recurrence_pattern') if event.get('recurring') else None
+        version = event.get('updated_at') or event.get('created_at')
+        for start, end in recurrence.expand(str(event['_id']), version, event['start'], event.get('end'),
+                                            pattern, window_start, window_end):
+            yield event, start, end
+
+
+def _busy_index(user_id, window_start, window_end):
+    key = f'{user_id}:{cache.get_version(user_id)}:{window_start.isoformat()}:{window_end.isoformat()}'
+    index = _busy_indexes.get(key)
+    if index is None:
+        index = BusyIndex(
+            (start, end, str(event['_id']))
+            for event, start, end in occurrences_in_window(user_id, window_start, window_end)
+        )
+        _busy_indexes.set(key, index, cache.CACHE_TTL)
+    return index
+
+
+def find_conflicts(user_id, event_data):
+    """Existing occurrences that overlap a new event (and its repeats within the horizon)."""
+    start, end = event_data['start'], event_data['end']
+    if not end or end <= start:
+        return []
+    
+    pattern = event_data['recurrence_pattern'] if event_data['recurring'] else None
+    horizon = start + timedelta(days=CONFLICT_HORIZON_DAYS) if pattern else end
+    index = _busy_index(user_id, start, max(horizon, end))
+    
+    conflicts = []
+    for block_start, block_end in recurrence.iter_occurrences(start, end, pattern, start, max(horizon, end)):
+        for busy_start, busy_end, event_id in index.conflicts(block_start, block_end):
+            conflicts.append({'id': event_id, 'start': busy_start.isoformat(), 'end': busy_end.isoformat()})
+    return conflicts
+
+
+def _parse_window():
+    window_start = _parse_calendar_bound(request.args['from'])
+    window_end = _parse_calendar_bound(request.args['to'])
+    if 'T' not in request.args['to']:
+        # A plain `to` date includes that whole day
+        window_end += timedelta(days=1)
+    if window_end <= window_start or window_end - window_start > timedelta(days=MAX_CALENDAR_DAYS):
+        raise ValueError(f'Window must be between 1 and {MAX_CALENDAR_DAYS} days')
+    return window_start, window_end
+
+
+@events_bp.route('/api/calendar')
+@login_required
+@cached_response('calendar')
+@query_budget(commands=3)
+def get_calendar():
+    try:
+        if not request.args.get('from') or not request.args.get('to'):
+            return jsonify({'status': 'error', 'message': 'from and to are required'}), 400
+        
+        window_start, window_end = _parse_window()
         
-        events_list = {}
-        for event in events:
-            event_id = str(event['_id'])
-            events_list[event_id] = {
+        occurrences = [
+            {
+                'id': str(event['_id']),
                 'title': event['title'],
-                'start': event['start'].isoformat(),
-                'end': event['end'].isoformat() if event.get('end') else None,
+                'start': start.isoformat(),
+                'end': end.isoformat() if end else None,
                 'description': event.get('description', ''),
                 'recurring': event.get('recurring', False),
                 'recurrence_pattern': event.get('recurrence_pattern')
             }
+            for event, start, end in occurrences_in_window(current_user.id, window_start, window_end,
+                                                           archive.include_archived(request.args))
+        ]
         
-        return jsonify(events_list)
+        occurrences.sort(key=lambda occurrence: occurrence['start'])
+        return jsonify(occurrences)
     
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e) if 'Window' in str(e) else 'Invalid date range'}), 400
     except Exception as e:
-        return jsonify({'status': 'error', 'message': f'Error fetching events: {str(e)}'}), 500
+        return jsonify({'status': 'error', 'message': f'Error fetching calendar: {str(e)}'}), 500
 
-@events_bp.route('/api/get_tasks')
+@events_bp.route('/api/freebusy')
 @login_required
-def get_tasks():
+@query_budget(commands=3)
+def get_freebusy():
     try:
-        tasks = list(db.tasks.find({'user_id': current_user.id}).sort('due_date', 1))
-        
-        tasks_list = {}
-        for task in tasks:
-            task_id = str(task['_id'])
-            tasks_list[task_id] = {
-                'name': task['name'],
-                'due_date': task['due_date'].strftime('%Y-%m-%d'),
-                'priority': task.get('priority', 'medium'),
-                'description': task.get('description', ''),
-                'completed': task.get('completed', False),
-                'completed_date': task['completed_date'].strftime('%Y-%m-%d') if task.get('completed_date') else None
-            }
+        if not request.args.get('from') or not request.args.get('to'):
+            return jsonify({'status': 'error', 'message': 'from and to are required'}), 400
         
-        return jsonify(tasks_list)
+        window_start, window_end = _parse_window()
+        index = _busy_index(current_user.id, window_start, window_end)
+        return jsonify({
+            'busy': [
+                {'start': max(start, window_start).isoformat(), 'end': min(end, window_end).isoformat()}
+                for start, end in index.busy()
+            ]
+        })
     
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e) if 'Window' in str(e) else 'Invalid date range'}), 400
     except Exception as e:
-        return jsonify({'status': 'error', 'message': f'Error fetching tasks: {str(e)}'}), 500
+        return jsonify({'status': 'error', 'message': f'Error fetching free/busy: {str(e)}'}), 500
 
-@events_bp.route('/api/update_task/<task_id>', methods=['PUT'])
+@events_bp.route('/api/freebusy/check')
 @login_required
-def update_task(task_id):
+@query_budget(commands=3)
+def check_freebusy():
     try:
-        data = request.get_json()
-        
-        update_data = {}
-        if 'completed' in data:
-            update_data['completed'] = data['completed']
-            update_data['completed_date'] = datetime.now() if data['completed'] else None
+        block_start = _parse_calendar_bound(request.args['start'])
+        block_end = _parse_calendar_bound(request.args['end'])
+        if block_end <= block_start or block_end - block_start > timedelta(days=MAX_CALENDAR_DAYS):
+            return jsonify({'status': 'error', 'message': 'Invalid time block'}), 400
         
-        result = db.tasks.update_one(
-            {'_id': ObjectId(task_id), 'user_id': current_user.id},
-            {'$set': update_data}
-        )
-        
-        if result.modified_count > 0:
-            return jsonify({'status': 'success', 'message': 'Task updated successfully'})
-        else:
-            return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+        index = _busy_index(current_user.id, block_start, block_end)
+        conflicts = [
+            {'id': event_id, 'start': start.isoformat(), 'end': end.isoformat()}
+            for start, end, event_id in index.conflicts(block_start, block_end)
+        ]
+        return jsonify({'conflict': bool(conflicts), 'conflicts': conflicts})
     
+    except (KeyError, ValueError):
+        return jsonify({'status': 'error', 'message': 'start and end must be ISO datetimes'}), 400
     except Exception as e:
-        return jsonify({'status': 'error', 'message': f'Error updating task: {str(e)}'}), 500
+        return jsonify({'status': 'error', 'message': f'Error checking free/busy: {str(e)}'}), 500
 
-@events_bp.route('/api/delete_item/<item_type>/<item_id>', methods=['DELETE'])
+@events_bp.route('/api/freebusy/slots')
 @login_required
-def delete_event_item(item_type, item_id):
+@query_budget(commands=3)
+def get_free_slots():
     try:
-        collection_map = {
-            'events': db.events,
-            'tasks': db.tasks
-        }
+        if not request.args.get('from') or not request.args.get('to'):
+            return jsonify({'status': 'error', 'message': 'from and to are required'}), 400
         
-        if item_type not in collection_map:
-            return jsonify({'status': 'error', 'message': 'Invalid item type'}), 400
+        window_start, window_end = _parse_window()
+        minutes = int(request.args.get('minutes', 30))
+        limit = max(1, min(int(request.args.get('limit', 20)), 200))
+        if minutes <= 0:
+            return jsonify({'status': 'error', 'message': 'minutes must be positive'}), 400
         
-        result = collection_map[item_type].delete_one({
-            '_id': ObjectId(item_id),
-            'user_id': current_user.id
+        index = _busy_index(current_user.id, window_start, window_end)
+        return jsonify({
+            'slots': [
+                {'start': start.isoformat(), 'end': end.isoformat()}
+                for start, end in index.free_slots(window_start, window_end, minutes, limit)
+            ]
         })
+    
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e) if 'Window' in str(e) else 'Invalid parameters'}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error finding free slots: {str(e)}'}), 500
+
+@events_bp.route('/api/get_tasks')
+@login_required
+@cached_response('tasks')
+@query_budget(commands=3)
+def get_tasks():
+    try:
+        source = archive.including('tasks', archive.include_archived(request.args))
+        tasks = TASK_SCHEMA.find(source, {'user_id': current_user.id}, [('due_date', 1)])
+        return jsonify({task.pop('_id'): task for task in tasks})
+    
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error fetching tasks: {str(e)}'}), 500
+
+@events_bp.route('/api/update_task/<task_id>', methods=['PUT'])
+@login_required
+def update_task(task_id):
+    try:
+        data = request.get_json()
         
-        if result.deleted_count > 0:
-            return jsonify({'status': 'success', 'message': 'Item deleted successfully'})
+        if items.update('tasks', current_user.id, task_id, data):
+            return jsonify({'status': 'success', 'message': 'Task updated successfully'})
         else:
-            return jsonify({'status': 'error', 'message': 'Item not found'}), 404
+            return jsonify({'status': 'error', 'message': 'Task not found'}), 404
     
+    except items.ItemError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
-        return jsonify({'status': 'error', 'message': f'Error deleting item: {str(e)}'}), 500
\ No newline at end of file
+        return jsonify({'status': 'error', 'message': f'Error updating task: {str(e)}'}), 500
@@ -0,0 +1,30 @@
+from flask import Blueprint, current_app, jsonify
+import warmup
+
+health_bp = Blueprint('health', __name__)
+
+# Liveness and readiness
+# /healthz only says the process is serving requests. /ready answers 200 once
+# this worker has finished its warmup and 503 before that (or if it failed), so
+# a load balancer keeps cold workers out of rotation. A worker that has not
+# started warming up (a dev server, or a failed warmup) starts it here.
+
+
+@health_bp.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+
+@health_bp.route('/ready')
+def ready():
+    status = warmup.status()
+    if status['state'] in ('pending', 'failed'):
+        warmup.start_warm_up(current_app._get_current_object())
+    if status['state'] != 'ready':
+        return jsonify({'status': status['state'], 'error': status['error'], 'steps': status['steps']}), 503
+    return jsonify({
+        'status': 'ready',
+        'pid': status['pid'],
+        'warmed_up_at': status['finished'].isoformat(),
+        'steps': status['steps']
+    })
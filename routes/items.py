@@ -0,0 +1,53 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+import items
+from query_budget import query_budget
+
+items_bp = Blueprint('items', __name__)
+
+# Item endpoints shared by every collection (see items.py)
+# /api/items/batch takes {"operations": [{"op": "create|update|delete",
+# "type": <collection>, "id": <item id>, "data": {...}}, ...]} and answers with
+# one result per operation, in the same order, so a page can enter or delete
+# many items in one request. Operations that fail are reported and the rest
+# are still applied.
+
+@items_bp.route('/api/items/batch', methods=['POST'])
+@login_required
+@query_budget(commands=30)
+def batch():
+    try:
+        operations = (request.get_json(silent=True) or {}).get('operations')
+        if not isinstance(operations, list):
+            return jsonify({'status': 'error', 'message': 'operations must be a list'}), 400
+
+        results = items.apply_batch(current_user.id, operations)
+        for index, result in enumerate(results):
+            result['index'] = index
+        return jsonify({
+            'status': 'success',
+            'results': results,
+            'errors': sum(1 for result in results if result['status'] == 'error')
+        })
+
+    except items.ItemError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error applying batch: {str(e)}'}), 500
+
+@items_bp.route('/api/delete_item/<item_type>/<item_id>', methods=['DELETE'])
+@login_required
+def delete_item(item_type, item_id):
+    try:
+        if item_type not in items.ITEM_FIELDS:
+            return jsonify({'status': 'error', 'message': 'Invalid item type'}), 400
+
+        if items.delete(item_type, current_user.id, item_id):
+            return jsonify({'status': 'success', 'message': 'Item deleted successfully'})
+        else:
+            return jsonify({'status': 'error', 'message': 'Item not found'}), 404
+
+    except items.ItemError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error deleting item: {str(e)}'}), 500
@@ -0,0 +1,57 @@
+from flask import Blueprint, Response, g, request
+import hmac
+import os
+import time
+import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Optional bearer token for /metrics; when unset the endpoint is open
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+@metrics_bp.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@metrics_bp.after_app_request
+def record_request(response):
+    started = g.get('request_started')
+    if started is None or request.endpoint == 'metrics.get_metrics':
+        return response
+
+    blueprint = request.blueprint or 'app'
+    endpoint = request.endpoint or 'unmatched'
+    method = request.method
+    status = response.status_code
+    request_bytes = request.content_length
+    context = g._get_current_object()
+    sent = {'bytes': None if response.is_streamed else response.content_length}
+
+    if response.is_streamed:
+        # Count streamed bodies as they go out; the request is recorded once the body is closed
+        body = response.response
+        sent['bytes'] = 0
+
+        def counted():
+            for chunk in body:
+                sent['bytes'] += len(chunk)
+                yield chunk
+        response.response = counted()
+
+    def finished():
+        metrics.record(blueprint, endpoint, method, status, time.perf_counter() - started,
+                       request_bytes, sent['bytes'], getattr(context, 'mongo_commands', 0))
+
+    response.call_on_close(finished)
+    return response
+
+
+@metrics_bp.route('/metrics')
+def get_metrics():
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(supplied, METRICS_TOKEN):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
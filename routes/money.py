@@ -1,11 +1,32 @@
 from flask import Blueprint, request, jsonify, render_template
 from flask_login import login_required, current_user
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
+import base64
+import os
 from database import db
+from cache import cached_response
+import rollups
+import items
+import archive
+from query_budget import query_budget
+from serialization import Schema, ID, DATE, DATETIME, HTTP_DATE
 
 money_bp = Blueprint('money', __name__)
 
+# List endpoints return the full history as a plain list unless the client asks
+# for a page. Set LEGACY_LIST_RESPONSES=false to always paginate.
+LEGACY_LIST_RESPONSES = os.environ.get('LEGACY_LIST_RESPONSES', 'true').lower() == 'true'
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Fields a client may request through `fields=` for each list endpoint
+LIST_FIELDS = {
+    'incomes': {'amount', 'source', 'date', 'description', 'created_at'},
+    'expenses': {'amount', 'category', 'date', 'description', 'created_at'},
+    'bills': {'name', 'amount', 'due_date', 'recurring', 'paid', 'created_at'}
+}
+
 @money_bp.route('/money')
 @login_required
 def money_page():
@@ -14,123 +35,162 @@ def money_page():
 # API Routes for Money Management
 @money_bp.route('/api/add_income', methods=['POST'])
 @login_required
+@query_budget(commands=5)
 def add_income():
-    data = request.get_json()
-    income_data = {
-        'user_id': current_user.id,
-        'amount': float(data['amount']),
-        'source': data['source'],
-        'date': datetime.strptime(data['date'], '%Y-%m-%d'),
-        'description': data.get('description', ''),
-        'created_at': datetime.now()
-    }
-    db.incomes.insert_one(income_data)
+    items.create('incomes', request.get_json(), current_user.id)
     return jsonify({'status': 'success', 'message': 'Income added successfully'})
 
 # ... rest of the money routes ...
 
 @money_bp.route('/api/add_expense', methods=['POST'])
 @login_required
+@query_budget(commands=5)
 def add_expense():
-    data = request.get_json()
-    expense_data = {
-        'user_id': current_user.id,
-        'amount': float(data['amount']),
-        'category': data['category'],
-        'date': datetime.strptime(data['date'], '%Y-%m-%d'),
-        'description': data.get('description', ''),
-        'created_at': datetime.now()
-    }
-    db.expenses.insert_one(expense_data)
+    items.create('expenses', request.get_json(), current_user.id)
     return jsonify({'status': 'success', 'message': 'Expense added successfully'})
 
 @money_bp.route('/api/add_budget', methods=['POST'])
 @login_required
 def add_budget():
-    data = request.get_json()
-    budget_data = {
-        'user_id': current_user.id,
-        'category': data['category'],
-        'amount': float(data['amount']),
-        'month': data['month'],
-        'created_at': datetime.now()
-    }
-    db.budgets.insert_one(budget_data)
+    items.create('budgets', request.get_json(), current_user.id)
     return jsonify({'status': 'success', 'message': 'Budget set successfully'})
 
 @money_bp.route('/api/add_bill', methods=['POST'])
 @login_required
 def add_bill():
-    data = request.get_json()
-    bill_data = {
-        'user_id': current_user.id,
-        'name': data['name'],
-        'amount': float(data['amount']),
-        'due_date': datetime.strptime(data['due_date'], '%Y-%m-%d'),
-        'recurring': data['recurring'],
-        'paid': False,
-        'created_at': datetime.now()
-    }
-    db.bills.insert_one(bill_data)
+    items.create('bills', request.get_json(), current_user.id)
     return jsonify({'status': 'success', 'message': 'Bill added successfully'})
 
+def _encode_cursor(sort_value, item_id):
+    raw = f"{sort_value.isoformat()}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        sort_value, item_id = raw.split('|')
+        return datetime.fromisoformat(sort_value), ObjectId(item_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def _list_query(collection, sort_field, direction):
+    """Build the filter, projection and page size for a list endpoint from the query string.
+
+    Supports `from`/`to` (inclusive dates on the sort field), `fields` (comma separated
+    projection), `limit` and `cursor`. Pages are keyed on (sort_field, _id) so each
+    page is a single indexed range scan regardless of how deep the client goes.
+    """
+    query = {'user_id': current_user.id}
+
+    date_filter = {}
+    if request.args.get('from'):
+        date_filter['$gte'] = datetime.strptime(request.args['from'], '%Y-%m-%d')
+    if request.args.get('to'):
+        date_filter['$lt'] = datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1)
+    if date_filter:
+        query[sort_field] = date_filter
+
+    only = None
+    if request.args.get('fields'):
+        fields = {f.strip() for f in request.args['fields'].split(',') if f.strip()}
+        unknown = fields - LIST_FIELDS[collection]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        # The sort field is always needed to build the next cursor
+        only = fields | {sort_field}
+
+    paginate = 'limit' in request.args or 'cursor' in request.args or not LEGACY_LIST_RESPONSES
+    limit = None
+    if paginate:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+        if request.args.get('cursor'):
+            last_value, last_id = _decode_cursor(request.args['cursor'])
+            op = '$lt' if direction < 0 else '$gt'
+            query['$or'] = [
+                {sort_field: {op: last_value}},
+                {sort_field: last_value, '_id': {op: last_id}}
+            ]
+
+    return query, only, limit
+
+
+def _list_response(collection, sort_field, direction, schema):
+    query, only, limit = _list_query(collection, sort_field, direction)
+    sort = [(sort_field, direction), ('_id', direction)]
+    # Archived records are left out unless the client asks for them
+    source = archive.including(collection, archive.include_archived(request.args))
+
+    if limit is None:
+        return jsonify(schema.find(source, query, sort, only))
+
+    # One extra document is fetched to know whether another page exists
+    items, last = schema.page(source, query, sort, limit, only)
+    next_cursor = _encode_cursor(last[sort_field], last['_id']) if last else None
+
+    return jsonify({
+        'items': items,
+        'next_cursor': next_cursor
+    })
+
+
+# Output schemas for the list endpoints
+INCOME_SCHEMA = Schema(_id=ID, user_id=None, amount=None, source=None, date=DATE,
+                       description=None, created_at=DATETIME)
+EXPENSE_SCHEMA = Schema(_id=ID, user_id=None, amount=None, category=None, date=DATE,
+                        description=None, created_at=DATETIME)
+BILL_SCHEMA = Schema(_id=ID, user_id=None, name=None, amount=None, due_date=DATE, recurring=None,
+                     paid=None, created_at=DATETIME)
+BUDGET_SCHEMA = Schema(_id=ID, user_id=None, category=None, amount=None, month=None,
+                       created_at=HTTP_DATE)
+
+
 @money_bp.route('/api/get_incomes')
 @login_required
+@cached_response('incomes')
+@query_budget(commands=3)
 def get_incomes():
-    incomes = list(db.incomes.find({'user_id': current_user.id}).sort('date', -1))
-    # Convert ObjectId to string for JSON serialization
-    for income in incomes:
-        income['_id'] = str(income['_id'])
-        income['date'] = income['date'].strftime('%Y-%m-%d')
-        income['created_at'] = income['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-    return jsonify(incomes)
+    try:
+        return _list_response('incomes', 'date', -1, INCOME_SCHEMA)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @money_bp.route('/api/get_expenses')
 @login_required
+@cached_response('expenses')
+@query_budget(commands=3)
 def get_expenses():
-    expenses = list(db.expenses.find({'user_id': current_user.id}).sort('date', -1))
-    for expense in expenses:
-        expense['_id'] = str(expense['_id'])
-        expense['date'] = expense['date'].strftime('%Y-%m-%d')
-        expense['created_at'] = expense['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-    return jsonify(expenses)
+    try:
+        return _list_response('expenses', 'date', -1, EXPENSE_SCHEMA)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @money_bp.route('/api/get_budgets')
 @login_required
+@cached_response('budgets')
+@query_budget(commands=3)
 def get_budgets():
-    budgets = list(db.budgets.find({'user_id': current_user.id}))
-    for budget in budgets:
-        budget['_id'] = str(budget['_id'])
-    return jsonify(budgets)
+    return jsonify(BUDGET_SCHEMA.find(db.budgets, {'user_id': current_user.id}))
 
 @money_bp.route('/api/get_bills')
 @login_required
+@cached_response('bills')
+@query_budget(commands=3)
 def get_bills():
-    bills = list(db.bills.find({'user_id': current_user.id}).sort('due_date', 1))
-    for bill in bills:
-        bill['_id'] = str(bill['_id'])
-        bill['due_date'] = bill['due_date'].strftime('%Y-%m-%d')
-        bill['created_at'] = bill['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-    return jsonify(bills)
+    try:
+        return _list_response('bills', 'due_date', 1, BILL_SCHEMA)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @money_bp.route('/api/get_financial_summary')
 @login_required
+@query_budget(commands=2)
 def get_financial_summary():
-    # Calculate total income
-    pipeline_income = [
-        {'$match': {'user_id': current_user.id}},
-        {'$group': {'_id': None, 'total': {'$sum': '$amount'}}}
-    ]
-    income_result = list(db.incomes.aggregate(pipeline_income))
-    total_income = income_result[0]['total'] if income_result else 0
-    
-    # Calculate total expenses
-    pipeline_expense = [
-        {'$match': {'user_id': current_user.id}},
-        {'$group': {'_id': None, 'total': {'$sum': '$amount'}}}
-    ]
-    expense_result = list(db.expenses.aggregate(pipeline_expense))
-    total_expense = expense_result[0]['total'] if expense_result else 0
+    # Totals come from the monthly rollups kept current by every write
+    totals = rollups.summary_totals(current_user.id)
+    total_income = totals['income']
+    total_expense = totals['expense']
     
     # Calculate balance
     balance = total_income - total_expense
@@ -140,26 +200,3 @@ def get_financial_summary():
         'total_expense': total_expense,
         'balance': balance
     })
-
-@money_bp.route('/api/delete_item/<item_type>/<item_id>', methods=['DELETE'])
-@login_required
-def delete_item(item_type, item_id):
-    collection_map = {
-        'incomes': db.incomes,
-        'expenses': db.expenses,
-        'bills': db.bills,
-        'budgets': db.budgets
-    }
-    
-    if item_type not in collection_map:
-        return jsonify({'status': 'error', 'message': 'Invalid item type'}), 400
-    
-    result = collection_map[item_type].delete_one({
-        '_id': ObjectId(item_id),
-        'user_id': current_user.id
-    })
-    
-    if result.deleted_count > 0:
-        return jsonify({'status': 'success', 'message': 'Item deleted successfully'})
-    else:
-        return jsonify({'status': 'error', 'message': 'Item not found'}), 404
\ No newline at end of file
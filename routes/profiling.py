@@ -0,0 +1,92 @@
+from flask import Blueprint, g, request
+from flask_login import current_user
+from datetime import datetime
+import cProfile
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import time
+
+profiling_bp = Blueprint('profiling', __name__)
+
+# Request profiling and slow-request log
+# A request is profiled with cProfile when it carries the admin header
+# `X-Profile: <PROFILE_TOKEN>` or is picked by PROFILE_SAMPLE_RATE (0-1). The
+# profile is written to PROFILE_DIR as a .prof file (open with pstats or
+# snakeviz) named after the time, endpoint, user and duration.
+#
+# Requests slower than SLOW_REQUEST_MS are logged to the 'slow_requests' logger
+# as one JSON line with the MongoDB commands they ran and how long each took.
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+slow_log = logging.getLogger('slow_requests')
+
+
+def _wants_profile():
+    token = request.headers.get('X-Profile')
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _user_tag():
+    return current_user.id if current_user.is_authenticated else 'anonymous'
+
+
+def _write_profile(profiler, endpoint, user, elapsed_ms):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d-%H%M%S}-{endpoint}-{user}-{elapsed_ms:.0f}ms.prof"
+    path = os.path.join(PROFILE_DIR, re.sub(r'[^\w.-]', '_', name))
+    profiler.dump_stats(path)
+    return path
+
+
+@profiling_bp.before_app_request
+def start_profiling():
+    g.profile_started = time.perf_counter()
+    if SLOW_REQUEST_MS > 0:
+        g.mongo_trace = []
+    if _wants_profile():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@profiling_bp.after_app_request
+def finish_profiling(response):
+    started = g.get('profile_started')
+    if started is None:
+        return response
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    endpoint = request.endpoint or 'unmatched'
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        path = _write_profile(profiler, endpoint, _user_tag(), elapsed_ms)
+        if request.headers.get('X-Profile'):
+            response.headers['X-Profile-File'] = os.path.basename(path)
+
+    trace = g.get('mongo_trace')
+    if trace is not None and elapsed_ms >= SLOW_REQUEST_MS:
+        slow_log.warning(json.dumps({
+            'time': datetime.now().isoformat(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': endpoint,
+            'user': _user_tag(),
+            'status': response.status_code,
+            'duration_ms': round(elapsed_ms, 1),
+            'mongo_ms': round(sum(ms for _, _, ms, _ in trace), 1),
+            'mongo_commands': [
+                {'command': command, 'collection': collection, 'ms': round(ms, 2), 'error': error}
+                for command, collection, ms, error in trace
+            ]
+        }))
+    return response
@@ -1,8 +1,14 @@
 from flask import Blueprint, request, jsonify, render_template
 from flask_login import login_required, current_user
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 from database import db
+from cache import cached_response
+import rollups
+import items
+import archive
+from query_budget import query_budget
+from serialization import Schema, ID, DATE, HTTP_DATE
 
 reports_bp = Blueprint('reports', __name__)
 
@@ -11,27 +17,229 @@ reports_bp = Blueprint('reports', __name__)
 def reports_page():
     return render_template('reports.html')
 
+GOAL_SCHEMA = Schema(_id=ID, user_id=None, name=None, target_amount=None, current_amount=None,
+                     target_date=DATE, created_at=HTTP_DATE)
+
 @reports_bp.route('/api/get_goals')
 @login_required
+@cached_response('goals')
+@query_budget(commands=3)
 def get_goals():
-    goals = list(db.goals.find({'user_id': current_user.id}))
-    for goal in goals:
-        goal['_id'] = str(goal['_id'])
-        if goal.get('target_date'):
-            goal['target_date'] = goal['target_date'].strftime('%Y-%m-%d')
-    return jsonify(goals)
+    return jsonify(GOAL_SCHEMA.find(db.goals, {'user_id': current_user.id}))
 
 @reports_bp.route('/api/add_goal', methods=['POST'])
 @login_required
 def add_goal():
-    data = request.get_json()
-    goal_data = {
-        'user_id': current_user.id,
-        'name': data['name'],
-        'target_amount': float(data['target_amount']),
-        'current_amount': float(data.get('current_amount', 0)),
-        'target_date': datetime.strptime(data['target_date'], '%Y-%m-%d') if data.get('target_date') else None,
-        'created_at': datetime.now()
-    }
-    db.goals.insert_one(goal_data)
-    return jsonify({'status': 'success', 'message': 'Goal added successfully'})
\ No newline at end of file
+    items.create('goals', request.get_json(), current_user.id)
+    return jsonify({'status': 'success', 'message': 'Goal added successfully'})
+
+# Report aggregation API
+# Charts on the reports page only need grouped totals, so the grouping is
+# done in MongoDB and only the aggregated rows are sent back.
+
+def _parse_report_range():
+    """Build the date filter for a report from the `period`, `from` and `to` query params."""
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+
+    if date_from or date_to:
+        date_filter = {}
+        if date_from:
+            date_filter['$gte'] = datetime.strptime(date_from, '%Y-%m-%d')
+        if date_to:
+            # `to` is inclusive of the whole day
+            date_filter['$lt'] = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+        return date_filter
+
+    period = request.args.get('period', 'month')
+    now = datetime.now()
+    if period == 'month':
+        return {'$gte': datetime(now.year, now.month, 1)}
+    if period == 'year':
+        return {'$gte': datetime(now.year, 1, 1)}
+    if period == 'all':
+        return None
+    raise ValueError(f'Invalid period: {period}')
+
+
+def _report_match(date_filter):
+    match = {'user_id': current_user.id}
+    if date_filter:
+        match['date'] = date_filter
+    return match
+
+
+def _month_bounds(date_filter):
+    """Return the rollup match for a date filter that falls on month boundaries, else None."""
+    if not date_filter:
+        return {'user_id': current_user.id}
+
+    month = {}
+    for op, value in date_filter.items():
+        if value.day != 1 or value.time() != datetime.min.time():
+            return None
+        month[op] = rollups.month_key(value)
+    return {'user_id': current_user.id, 'month': month}
+
+
+def _category_totals(date_filter, limit=None):
+    rollup_match = _month_bounds(date_filter)
+    if rollup_match is not None:
+        # Month-aligned ranges are answered from the monthly rollups
+        rollup_match['kind'] = 'expense'
+        source, match = db[rollups.ROLLUP_COLLECTION], rollup_match
+        group = {'_id': '$category', 'total': {'$sum': '$total'}, 'count': {'$sum': '$count'}}
+    else:
+        # Archived transactions still count towards reports
+        source, match = archive.including('expenses'), _report_match(date_filter)
+        group = {'_id': '$category', 'total': {'$sum': '$amount'}, 'count': {'$sum': 1}}
+
+    pipeline = [
+        {'$match': match},
+        {'$group': group},
+        {'$match': {'count': {'$gt': 0}}},
+        {'$sort': {'total': -1}}
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    return [
+        {'category': row['_id'], 'total': row['total'], 'count': row['count']}
+        for row in source.aggregate(pipeline)
+    ]
+
+
+def _totals_by_period(collection, date_filter, granularity):
+    rollup_match = _month_bounds(date_filter)
+    if rollup_match is not None and granularity != 'day':
+        rollup_match['kind'] = rollups.COLLECTION_KINDS[collection]
+        pipeline = [
+            {'$match': rollup_match},
+            {'$group': {'_id': '$month', 'total': {'$sum': '$total'}, 'count': {'$sum': '$count'}}},
+            {'$match': {'count': {'$gt': 0}}}
+        ]
+        totals = {}
+        for row in db[rollups.ROLLUP_COLLECTION].aggregate(pipeline):
+            # Month keys are 'YYYY-MM', so a year is the first four characters
+            key = row['_id'] if granularity == 'month' else row['_id'][:4]
+            totals[key] = totals.get(key, 0) + row['total']
+        return totals
+
+    formats = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+    pipeline = [
+        {'$match': _report_match(date_filter)},
+        {'$group': {
+            '_id': {'$dateToString': {'format': formats[granularity], 'date': '$date'}},
+            'total': {'$sum': '$amount'}
+        }}
+    ]
+    return {row['_id']: row['total'] for row in archive.including(collection).aggregate(pipeline)}
+
+
+@reports_bp.route('/api/reports/category_totals')
+@login_required
+@query_budget(commands=2)
+def category_totals():
+    try:
+        date_filter = _parse_report_range()
+        return jsonify(_category_totals(date_filter))
+
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error building category report: {str(e)}'}), 500
+
+
+@reports_bp.route('/api/reports/top_categories')
+@login_required
+@query_budget(commands=2)
+def top_categories():
+    try:
+        date_filter = _parse_report_range()
+        limit = max(1, min(int(request.args.get('n', 5)), 50))
+        return jsonify(_category_totals(date_filter, limit))
+
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error building category report: {str(e)}'}), 500
+
+
+@reports_bp.route('/api/reports/income_expense')
+@login_required
+@query_budget(commands=3)
+def income_expense():
+    try:
+        date_filter = _parse_report_range()
+        granularity = request.args.get('granularity', 'month')
+        if granularity not in ('day', 'month', 'year'):
+            raise ValueError(f'Invalid granularity: {granularity}')
+
+        # Merge the two grouped results into one ordered series
+        incomes = _totals_by_period('incomes', date_filter, granularity)
+        expenses = _totals_by_period('expenses', date_filter, granularity)
+        total_income = sum(incomes.values())
+        total_expense = sum(expenses.values())
+        series = [
+            {'period': key, 'income': incomes.get(key, 0), 'expense': expenses.get(key, 0)}
+            for key in sorted(set(incomes) | set(expenses))
+        ]
+
+        return jsonify({
+            'total_income': total_income,
+            'total_expense': total_expense,
+            'balance': total_income - total_expense,
+            'series': series
+        })
+
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error building income/expense report: {str(e)}'}), 500
+
+
+@reports_bp.route('/api/reports/budget_vs_actual')
+@login_required
+@query_budget(commands=3)
+def budget_vs_actual():
+    try:
+        period = request.args.get('period', 'current')
+        now = datetime.now()
+        first_of_month = datetime(now.year, now.month, 1)
+
+        if period == 'current':
+            start, months = first_of_month, 1
+        elif period == 'last':
+            start, months = (first_of_month - timedelta(days=1)).replace(day=1), 1
+        elif period == 'quarter':
+            start, months = first_of_month, 3
+            for _ in range(2):
+                start = (start - timedelta(days=1)).replace(day=1)
+        else:
+            raise ValueError(f'Invalid period: {period}')
+
+        # Budgets store their month as 'YYYY-MM'
+        month_keys = []
+        cursor = start
+        for _ in range(months):
+            month_keys.append(cursor.strftime('%Y-%m'))
+            cursor = (cursor + timedelta(days=32)).replace(day=1)
+
+        budget_pipeline = [
+            {'$match': {'user_id': current_user.id, 'month': {'$in': month_keys}}},
+            {'$group': {'_id': '$category', 'total': {'$sum': '$amount'}}}
+        ]
+        budgets = {row['_id']: row['total'] for row in db.budgets.aggregate(budget_pipeline)}
+        actuals = {
+            row['category']: row['total']
+            for row in _category_totals({'$gte': start, '$lt': cursor})
+        }
+
+        return jsonify([
+            {'category': category, 'budget': budgets.get(category, 0), 'actual': actuals.get(category, 0)}
+            for category in sorted(set(budgets) | set(actuals))
+        ])
+
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error building budget report: {str(e)}'}), 500
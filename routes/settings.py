@@ -1,14 +1,26 @@
-from flask import Blueprint, request, jsonify, render_template, send_file
+from flask import Blueprint, request, jsonify, render_template, Response, stream_with_context
 from flask_login import login_required, current_user
 from bson import ObjectId
-from datetime import datetime
-import json
-from io import BytesIO
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+import os
+import tempfile
 from database import db
-import bcrypt
+from models import User
+import rollups
+import changelog
+import transactions
+import archive
+from exporter import stream_export, EXPORT_COLLECTIONS, EXPORT_FORMATS
+import importer
+from passwords import hash_password, check_password, PasswordHasherBusy
+from query_budget import query_budget
 
 settings_bp = Blueprint('settings', __name__)
 
+IMPORT_EXTENSIONS = ('.json', '.ndjson', '.json.gz', '.ndjson.gz')
+
 @settings_bp.route('/settings')
 @login_required
 def settings_page():
@@ -32,9 +44,13 @@ def update_profile():
             {'_id': ObjectId(current_user.id)},
             {'$set': update_data}
         )
+        User.invalidate(current_user.id)
         
         return jsonify({'status': 'success', 'message': 'Profile updated successfully'})
     
+    except DuplicateKeyError:
+        # The unique indexes on users (see database.INDEXES)
+        return jsonify({'status': 'error', 'message': 'Username or email already exists'}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error updating profile: {str(e)}'}), 500
 
@@ -54,6 +70,7 @@ def update_notifications():
             {'_id': ObjectId(current_user.id)},
             {'$set': {'notification_settings': notification_settings}}
         )
+        User.invalidate(current_user.id)
         
         return jsonify({'status': 'success', 'message': 'Notification settings updated successfully'})
     
@@ -62,6 +79,7 @@ def update_notifications():
 
 @settings_bp.route('/api/get_notification_settings')
 @login_required
+@query_budget(commands=2)
 def get_notification_settings():
     try:
         user_data = db.users.find_one({'_id': ObjectId(current_user.id)})
@@ -90,16 +108,19 @@ def change_password():
         
         user_data = db.users.find_one({'_id': ObjectId(current_user.id)})
         
-        if bcrypt.checkpw(current_password.encode('utf-8'), user_data['password']):
-            hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+        if check_password(current_password, user_data['password']):
+            hashed_password = hash_password(new_password)
             db.users.update_one(
                 {'_id': ObjectId(current_user.id)},
                 {'$set': {'password': hashed_password}}
             )
+            User.invalidate(current_user.id)
             return jsonify({'status': 'success', 'message': 'Password changed successfully'})
         else:
             return jsonify({'status': 'error', 'message': 'Current password is incorrect'}), 400
     
+    except PasswordHasherBusy:
+        return jsonify({'status': 'error', 'message': 'Server is busy, please try again shortly'}), 503
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error changing password: {str(e)}'}), 500
 
@@ -107,33 +128,37 @@ def change_password():
 @login_required
 def export_data():
     try:
-        # Get all user data
-        collections = ['incomes', 'expenses', 'events', 'budgets', 'goals', 'tasks', 'bills']
-        user_data = {}
-        
-        for collection in collections:
-            items = list(db[collection].find({'user_id': current_user.id}))
-            for item in items:
-                item['_id'] = str(item['_id'])
-                # Convert dates to strings
-                for key, value in item.items():
-                    if isinstance(value, datetime):
-                        item[key] = value.isoformat()
-            user_data[collection] = items
-        
-        # Create a JSON file in memory
-        data_str = json.dumps(user_data, indent=2)
-        data_io = BytesIO(data_str.encode('utf-8'))
-        data_io.seek(0)
-        
-        # Send the file
-        return send_file(
-            data_io,
-            as_attachment=True,
-            download_name=f'money_event_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json',
-            mimetype='application/json'
+        fmt = request.args.get('format', 'legacy')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'status': 'error', 'message': 'Invalid export format'}), 400
+        
+        collections = EXPORT_COLLECTIONS
+        if request.args.get('collections'):
+            collections = [c for c in request.args['collections'].split(',') if c]
+            if any(c not in EXPORT_COLLECTIONS for c in collections):
+                return jsonify({'status': 'error', 'message': 'Invalid collection'}), 400
+        
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from') else None
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('to') else None
+        compress = request.args.get('gzip', 'false').lower() == 'true'
+        
+        extension = 'ndjson' if fmt == 'ndjson' else 'json'
+        filename = f'money_event_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+        mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+        if compress:
+            filename += '.gz'
+            mimetype = 'application/gzip'
+        
+        # Stream the file as it is read instead of building it in memory
+        chunks = stream_export(current_user.id, fmt, collections, date_from, date_to, compress)
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
         )
     
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid date, use YYYY-MM-DD'}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error exporting data: {str(e)}'}), 500
 
@@ -148,43 +173,48 @@ def import_data():
         if file.filename == '':
             return jsonify({'status': 'error', 'message': 'No file selected'}), 400
         
-        if file and file.filename.endswith('.json'):
-            data = json.load(file)
+        if file and file.filename.lower().endswith(IMPORT_EXTENSIONS):
             overwrite = request.form.get('overwrite', 'false').lower() == 'true'
             
-            collections = ['incomes', 'expenses', 'events', 'budgets', 'goals', 'tasks', 'bills']
+            # The upload is only readable during this request, so keep a copy for the job
+            fd, path = tempfile.mkstemp(prefix='import_')
+            with os.fdopen(fd, 'wb') as out:
+                file.save(out)
             
-            for collection in collections:
-                if collection in data:
-                    if overwrite:
-                        # Delete existing data
-                        db[collection].delete_many({'user_id': current_user.id})
-                    
-                    # Prepare new data with user_id
-                    items = data[collection]
-                    for item in items:
-                        item['user_id'] = current_user.id
-                        # Convert string dates back to datetime objects
-                        for key, value in item.items():
-                            if isinstance(value, str) and 'T' in value:
-                                try:
-                                    item[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                                except:
-                                    pass
-                    
-                    # Insert new data
-                    if items:
-                        db[collection].insert_many(items)
-            
-            return jsonify({'status': 'success', 'message': 'Data imported successfully'})
+            job_id = importer.create_job(current_user.id, path, file.filename, overwrite)
+            return jsonify({'status': 'success', 'message': 'Import started', 'job_id': job_id}), 202
         
         return jsonify({'status': 'error', 'message': 'Invalid file type'}), 400
     
-    except json.JSONDecodeError:
-        return jsonify({'status': 'error', 'message': 'Invalid JSON file'}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error importing data: {str(e)}'}), 500
 
+@settings_bp.route('/api/import_status/<job_id>')
+@login_required
+def import_status(job_id):
+    try:
+        job = importer.get_job(job_id, current_user.id)
+        if not job:
+            return jsonify({'status': 'error', 'message': 'Import job not found'}), 404
+        
+        return jsonify({
+            'status': 'success',
+            'job': {
+                'id': job['_id'],
+                'state': job['status'],
+                'processed': job['processed'],
+                'inserted': job['inserted'],
+                'skipped': job['skipped'],
+                'collections': job['collections'],
+                'errors': job['errors']
+            }
+        })
+    
+    except InvalidId:
+        return jsonify({'status': 'error', 'message': 'Import job not found'}), 404
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error fetching import status: {str(e)}'}), 500
+
 @settings_bp.route('/api/reset_data', methods=['POST'])
 @login_required
 def reset_data():
@@ -192,7 +222,11 @@ def reset_data():
         collections = ['incomes', 'expenses', 'events', 'budgets', 'goals', 'tasks', 'bills']
         
         for collection in collections:
-            db[collection].delete_many({'user_id': current_user.id})
+            transactions.collection(collection).delete_many({'user_id': current_user.id})
+            if collection in archive.ARCHIVABLE:
+                archive.collection(collection).delete_many({'user_id': current_user.id})
+        rollups.clear_rollups(current_user.id)
+        changelog.record_reset(current_user.id)
         
         return jsonify({'status': 'success', 'message': 'All data has been reset'})
     
@@ -0,0 +1,117 @@
+from flask import Blueprint, Response, request, jsonify
+from flask_login import login_required, current_user
+from collections import Counter
+import json
+import os
+import threading
+import time
+import changelog
+import pubsub
+
+stream_bp = Blueprint('stream', __name__)
+
+# Server-Sent Events push channel
+# /api/stream keeps one connection per open tab and sends a `changes` event,
+# {version, collections}, whenever the user's data changes, so pages reload
+# only what changed instead of polling. The SSE id is the change log version:
+# a reconnecting browser sends it back as Last-Event-ID and is told at once
+# about anything it missed.
+#
+# Each connection holds a worker thread, so connections are capped per worker
+# (STREAM_MAX_CONNECTIONS, set from the thread count by gunicorn.conf.py) and
+# per user, and closed after STREAM_MAX_SECONDS for the browser to reconnect.
+# Workers without threads do not stream at all. Refused clients get 204 or 503
+# and fall back to polling /api/sync.
+
+STREAM_MAX_CONNECTIONS = int(os.environ.get('STREAM_MAX_CONNECTIONS', 8))
+STREAM_MAX_PER_USER = int(os.environ.get('STREAM_MAX_PER_USER', 3))
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', 300))
+STREAM_HEARTBEAT_SECONDS = int(os.environ.get('STREAM_HEARTBEAT_SECONDS', 15))
+STREAM_RETRY_MS = 5000
+
+_slots_lock = threading.Lock()
+_open = Counter()
+
+
+def configure(max_connections):
+    """Set the per-worker cap unless STREAM_MAX_CONNECTIONS was given explicitly."""
+    global STREAM_MAX_CONNECTIONS
+    if 'STREAM_MAX_CONNECTIONS' not in os.environ:
+        STREAM_MAX_CONNECTIONS = max(max_connections, 0)
+
+
+def _acquire(user_id):
+    with _slots_lock:
+        if sum(_open.values()) >= STREAM_MAX_CONNECTIONS or _open[user_id] >= STREAM_MAX_PER_USER:
+            return False
+        _open[user_id] += 1
+        return True
+
+
+def _release(user_id):
+    with _slots_lock:
+        _open[user_id] -= 1
+        if _open[user_id] <= 0:
+            del _open[user_id]
+
+
+def _event(event):
+    return f"id: {event['version']}\nevent: changes\ndata: {json.dumps(event)}\n\n"
+
+
+def _events(subscription, missed):
+    yield f'retry: {STREAM_RETRY_MS}\n\n'
+    if missed is not None:
+        yield _event(missed)
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    while time.monotonic() < deadline:
+        event = subscription.wait(min(STREAM_HEARTBEAT_SECONDS, max(deadline - time.monotonic(), 0)))
+        # The comment line keeps proxies from timing out and finds dead clients
+        yield _event(event) if event is not None else ': ping\n\n'
+
+
+@stream_bp.route('/api/stream')
+@login_required
+def stream():
+    if not request.environ.get('wsgi.multithread') or STREAM_MAX_CONNECTIONS <= 0:
+        # An open stream would block this worker entirely; 204 tells EventSource not to retry
+        return Response(status=204)
+
+    user_id = current_user.id
+    if not _acquire(user_id):
+        return jsonify({'status': 'error', 'message': 'Too many open streams'}), 503, {'Retry-After': '60'}
+
+    subscription = None
+    try:
+        last_seen = request.headers.get('Last-Event-ID', request.args.get('since'))
+        last_seen = int(last_seen) if last_seen and last_seen.isdigit() else None
+        # Subscribe before checking for missed changes so nothing falls in between
+        subscription = pubsub.broker.subscribe(user_id)
+        current = changelog.current_version(user_id)
+        pubsub.broker.seen(user_id, current if last_seen is None else last_seen)
+
+        missed = None
+        if last_seen is None:
+            # Give the browser a starting point to resume from
+            missed = None if current == 0 else {'version': current, 'collections': []}
+        elif current > last_seen:
+            version, collections = changelog.changed_collections(user_id, last_seen)
+            missed = {'version': version, 'collections': collections}
+    except Exception:
+        if subscription is not None:
+            pubsub.broker.unsubscribe(subscription)
+        _release(user_id)
+        raise
+
+    response = Response(_events(subscription, missed), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+    # Runs when the server closes the response, also if the client left before the first event
+    def finished():
+        pubsub.broker.unsubscribe(subscription)
+        _release(user_id)
+
+    response.call_on_close(finished)
+    return response
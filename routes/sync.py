@@ -0,0 +1,149 @@
+from flask import Blueprint, request, jsonify, current_app, send_from_directory
+from flask_login import login_required, current_user
+from datetime import datetime
+from urllib.parse import urlsplit
+from werkzeug.exceptions import HTTPException
+from database import db
+from routes import events
+import changelog
+import items
+from query_budget import query_budget
+
+sync_bp = Blueprint('sync', __name__)
+
+# Offline sync for the PWA
+# /api/sync?since=<version> returns the documents inserted, updated and deleted
+# since that version (see changelog.py); since=0 returns everything. The
+# service worker keeps its local store current with it and, when the browser
+# comes back online, sends the writes it queued in one /api/sync/batch request.
+# The writes are applied through the items service, and each queued write
+# carries a client id that is recorded as soon as it is applied, so a batch
+# that is retried after a dropped response is not applied twice.
+
+REPLAY_COLLECTION = 'sync_replays'
+MAX_SYNC_LIMIT = 2000
+MAX_BATCH_WRITES = 100
+
+
+@sync_bp.route('/service-worker.js')
+def service_worker():
+    # Served from the root so the worker's scope covers the pages and /api
+    response = send_from_directory(current_app.static_folder, 'service-worker.js',
+                                   mimetype='application/javascript', max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@sync_bp.route('/api/sync')
+@login_required
+@query_budget(commands=12)
+def sync():
+    try:
+        since = request.args.get('since', 0, type=int)
+        limit = min(max(request.args.get('limit', 500, type=int), 1), MAX_SYNC_LIMIT)
+        changes = changelog.changes_since(current_user.id, since, limit)
+        # Lets the client notice a different user signing in on the same device
+        changes['user_id'] = current_user.id
+        return jsonify(changes)
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error syncing: {str(e)}'}), 500
+
+
+def _create(collection):
+    def create(user_id, view_args, data):
+        doc = items.build(collection, data, user_id)
+        if collection == 'events' and data.get('on_conflict') == 'reject':
+            # As add_event does
+            conflicts = events.find_conflicts(user_id, doc)
+            if conflicts:
+                return 409, {'status': 'error', 'message': 'Event overlaps existing events', 'conflicts': conflicts}
+        items.insert(collection, doc)
+        return 200, {'status': 'success', 'id': str(doc['_id'])}
+    return create
+
+
+def _update_task(user_id, view_args, data):
+    if items.update('tasks', user_id, view_args['task_id'], data):
+        return 200, {'status': 'success', 'message': 'Task updated successfully'}
+    return 404, {'status': 'error', 'message': 'Task not found'}
+
+
+def _delete_item(user_id, view_args, data):
+    if items.delete(view_args['item_type'], user_id, view_args['item_id']):
+        return 200, {'status': 'success', 'message': 'Item deleted successfully'}
+    return 404, {'status': 'error', 'message': 'Item not found'}
+
+
+# The item writes that can be queued, by the endpoint they were sent to. They are
+# applied through the items service (items.py), as the views apply them.
+REPLAY_WRITES = {
+    'money.add_income': _create('incomes'),
+    'money.add_expense': _create('expenses'),
+    'money.add_budget': _create('budgets'),
+    'money.add_bill': _create('bills'),
+    'reports.add_goal': _create('goals'),
+    'events.add_event': _create('events'),
+    'events.add_task': _create('tasks'),
+    'events.update_task': _update_task,
+    'items.delete_item': _delete_item
+}
+
+
+def _replay_endpoint(method, path):
+    """The endpoint and view arguments a queued write maps to, if it may be replayed."""
+    adapter = current_app.create_url_adapter(request)
+    try:
+        endpoint, view_args = adapter.match(path, method)
+    except HTTPException:
+        return None, None
+    if endpoint not in REPLAY_WRITES:
+        return None, None
+    return endpoint, view_args
+
+
+def _replay(user_id, write):
+    """Apply one queued write; returns (status code, response body)."""
+    method = str(write.get('method', 'POST')).upper()
+    path = urlsplit(str(write.get('path', ''))).path
+    endpoint, view_args = _replay_endpoint(method, path)
+    if endpoint is None:
+        return 400, {'status': 'error', 'message': f'{method} {path} cannot be replayed'}
+
+    data = write.get('body')
+    if not isinstance(data, dict) and endpoint != 'items.delete_item':
+        return 400, {'status': 'error', 'message': 'body must be an object'}
+    try:
+        return REPLAY_WRITES[endpoint](user_id, view_args, data)
+    except KeyError as e:
+        return 400, {'status': 'error', 'message': f'Missing field: {e.args[0]}'}
+    except (ValueError, TypeError) as e:
+        return 400, {'status': 'error', 'message': str(e)}
+
+
+@sync_bp.route('/api/sync/batch', methods=['POST'])
+@login_required
+def replay_batch():
+    try:
+        writes = (request.get_json(silent=True) or {}).get('writes')
+        if not isinstance(writes, list) or not all(isinstance(write, dict) and write.get('id') for write in writes):
+            return jsonify({'status': 'error', 'message': 'writes must be a list of objects with an id'}), 400
+        if len(writes) > MAX_BATCH_WRITES:
+            return jsonify({'status': 'error', 'message': f'At most {MAX_BATCH_WRITES} writes per batch'}), 400
+
+        keys = [f"{current_user.id}:{write['id']}" for write in writes]
+        done = {doc['_id']: doc for doc in db[REPLAY_COLLECTION].find({'_id': {'$in': keys}})}
+
+        results = []
+        for key, write in zip(keys, writes):
+            if key not in done:
+                status, body = _replay(current_user.id, write)
+                # Recorded as soon as it is applied, so a batch cut short is not applied twice on retry
+                done[key] = {'_id': key, 'status': status, 'body': body, 'created_at': datetime.now()}
+                db[REPLAY_COLLECTION].insert_one(done[key])
+            results.append({'id': write['id'], 'status': done[key]['status'], 'body': done[key]['body']})
+
+        return jsonify({'status': 'success', 'results': results})
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Error replaying writes: {str(e)}'}), 500
@@ -0,0 +1,160 @@
+from datetime import date, datetime
+from decimal import Decimal
+import json
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used without it
+    orjson = None
+
+# JSON for BSON documents
+# BSONJSONProvider lets jsonify() take MongoDB documents as they come out of
+# the driver: ObjectId becomes its hex string, datetimes ISO 8601 and
+# Decimal128 a number. orjson is used when it is installed.
+#
+# List endpoints go further and declare an output Schema. The schema is
+# compiled into a $project (or $map) expression, so ids and dates are
+# formatted by MongoDB and the documents can be passed straight to jsonify
+# without a per-document Python loop.
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(obj, sort_keys=False, indent=None):
+    """Encode obj to a compact JSON string (indented with indent=2)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+    separators = None if indent else (',', ':')
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, indent=indent, separators=separators)
+
+
+class BSONJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that understands BSON types."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys), indent=kwargs.get('indent'))
+
+
+# Output schemas
+
+ID = 'id'
+DATE = '%Y-%m-%d'
+DATETIME = '%Y-%m-%d %H:%M:%S'
+ISO = '%Y-%m-%dT%H:%M:%S'
+# What Flask's default provider sent for datetimes, e.g. 'Sun, 04 May 2031 08:03:09 GMT'.
+# $dateToString has no day or month names, so they are looked up.
+HTTP_DATE = 'http-date'
+_DAY_NAMES = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat']
+_MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def _date_to_string(path, date_format):
+    if date_format != HTTP_DATE:
+        return {'$dateToString': {'date': path, 'format': date_format}}
+    return {'$concat': [
+        {'$arrayElemAt': [_DAY_NAMES, {'$subtract': [{'$dayOfWeek': path}, 1]}]},
+        {'$dateToString': {'date': path, 'format': ', %d '}},
+        {'$arrayElemAt': [_MONTH_NAMES, {'$subtract': [{'$month': path}, 1]}]},
+        {'$dateToString': {'date': path, 'format': ' %Y %H:%M:%S GMT'}}
+    ]}
+
+
+class Default:
+    """Schema field that falls back to a value when the document has none.
+
+    With a date format the value is formatted when present.
+    """
+
+    def __init__(self, value, date_format=None):
+        self.value = value
+        self.date_format = date_format
+
+
+class Schema:
+    """Output format of a collection's documents, evaluated in MongoDB.
+
+    fields maps each output field to None (copy as is), ID (ObjectId as a
+    string), a date format such as DATE or HTTP_DATE, or Default(value[, date_format]).
+    Missing fields stay missing and null dates stay null unless a Default says
+    otherwise.
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def _expression(self, field, spec, root):
+        path = f'{root}{field}'
+        if spec is None:
+            return path
+        if spec == ID:
+            return {'$toString': path}
+        if isinstance(spec, Default):
+            if spec.date_format:
+                return {'$cond': [{'$ifNull': [path, False]},
+                                  _date_to_string(path, spec.date_format), spec.value]}
+            return {'$ifNull': [path, spec.value]}
+        return {'$cond': [{'$ifNull': [path, False]}, _date_to_string(path, spec), path]}
+
+    def expression(self, root='$', only=None):
+        """The document expression; `only` limits it to those fields (plus _id)."""
+        return {
+            field: self._expression(field, spec, root)
+            for field, spec in self.fields.items()
+            if only is None or field in only or field == '_id'
+        }
+
+    def find(self, collection, query, sort=None, only=None):
+        """Run query and return the formatted documents as a list."""
+        pipeline = [{'$match': query}]
+        if sort:
+            pipeline.append({'$sort': dict(sort)})
+        pipeline.append({'$project': self.expression(only=only)})
+        return list(collection.aggregate(pipeline))
+
+    def page(self, collection, query, sort, limit, only=None):
+        """Return (formatted documents, raw last document or None) for one page.
+
+        Formatting happens in a single aggregation that also hands back the raw
+        last document, which is what the next page's cursor is built from.
+        """
+        pipeline = [
+            {'$match': query},
+            {'$sort': dict(sort)},
+            {'$limit': limit + 1},
+            {'$group': {'_id': None, 'items': {'$push': '$$ROOT'}}},
+            {'$project': {
+                '_id': 0,
+                'items': {'$map': {
+                    'input': {'$slice': ['$items', limit]},
+                    'as': 'doc',
+                    'in': self.expression('$$doc.', only)
+                }},
+                'last': {'$cond': [{'$gt': [{'$size': '$items'}, limit]},
+                                   {'$arrayElemAt': ['$items', limit - 1]}, None]}
+            }}
+        ]
+        result = next(collection.aggregate(pipeline), None)
+        if result is None:
+            return [], None
+        return result['items'], result['last']
@@ -1,21 +1,139 @@
+// Offline support and change sync
+// The service worker keeps a local copy of the user's data through the
+// /api/sync change feed and replays writes queued while offline. The server
+// announces changes on the /api/stream event stream; pages listen for the
+// 'data-changed' event (detail.collections) and reload only the panels whose
+// collections changed. When the stream is refused or unavailable the page
+// falls back to asking for a sync every SYNC_INTERVAL.
+const SYNC_INTERVAL = 300000;
+const STREAM_RETRY_INTERVAL = 60000;
+const HIDDEN_CLOSE_DELAY = 60000;
+const ALL_COLLECTIONS = ['incomes', 'expenses', 'events', 'budgets', 'goals', 'tasks', 'bills'];
 
-// Initialize dashboard
-loadFinancialSummary();
-loadRecentExpenses();
-loadRecentIncomes();
-loadUpcomingEvents();  // Add this
-loadUpcomingTasks();   // Add this
-loadSavingsGoals();
-
-// Refresh data every 5 minutes
-setInterval(() => {
-    loadFinancialSummary();
-    loadRecentExpenses();
-    loadRecentIncomes();
-    loadUpcomingEvents();  // Add this
-    loadUpcomingTasks();   // Add this
-    loadSavingsGoals();
-}, 300000);
+let changeStream = null;
+let pollTimer = null;
+let hiddenTimer = null;
+
+function notifyChanged(collections) {
+    if (collections && collections.length) {
+        document.dispatchEvent(new CustomEvent('data-changed', { detail: { collections: collections } }));
+    }
+}
+
+function requestSync(collections) {
+    if (navigator.serviceWorker && navigator.serviceWorker.controller) {
+        // The worker posts a 'changes' message once its local copy is updated
+        navigator.serviceWorker.controller.postMessage({ type: 'sync' });
+    } else {
+        notifyChanged(collections);
+    }
+}
+
+function startPolling() {
+    if (!pollTimer) {
+        pollTimer = setInterval(() => requestSync(ALL_COLLECTIONS), SYNC_INTERVAL);
+    }
+}
+
+function stopPolling() {
+    clearInterval(pollTimer);
+    pollTimer = null;
+}
+
+function openChangeStream() {
+    if (!window.EventSource || changeStream || document.hidden) {
+        return;
+    }
+    changeStream = new EventSource('/api/stream');
+    changeStream.addEventListener('open', stopPolling);
+    changeStream.addEventListener('changes', function(e) {
+        const data = JSON.parse(e.data);
+        if (data.collections.length) {
+            requestSync(data.collections);
+        }
+    });
+    changeStream.addEventListener('error', function() {
+        // EventSource reconnects by itself unless the server refused the stream
+        if (changeStream && changeStream.readyState === EventSource.CLOSED) {
+            changeStream = null;
+            startPolling();
+            setTimeout(openChangeStream, STREAM_RETRY_INTERVAL);
+        }
+    });
+}
+
+function closeChangeStream() {
+    if (changeStream) {
+        changeStream.close();
+        changeStream = null;
+    }
+}
+
+// Background tabs give their connection back after a while and catch up when shown again
+document.addEventListener('visibilitychange', function() {
+    clearTimeout(hiddenTimer);
+    if (document.hidden) {
+        hiddenTimer = setTimeout(closeChangeStream, HIDDEN_CLOSE_DELAY);
+    } else if (!changeStream) {
+        requestSync();
+        openChangeStream();
+    }
+});
+
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', function() {
+        navigator.serviceWorker.register('/service-worker.js', { scope: '/' })
+            .then(function() {
+                requestSync();
+            }, function(err) {
+                console.log('ServiceWorker registration failed: ', err);
+            });
+    });
+
+    navigator.serviceWorker.addEventListener('message', event => {
+        if (event.data && event.data.type === 'changes') {
+            notifyChanged(event.data.collections);
+        }
+    });
+
+    // Drop the local copy of the user's data on sign out
+    document.addEventListener('click', function(e) {
+        const link = e.target.closest && e.target.closest('a[href="/logout"]');
+        if (link && navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({ type: 'logout' });
+        }
+    });
+}
+
+window.addEventListener('online', function() {
+    requestSync();
+    closeChangeStream();
+    openChangeStream();
+});
+window.addEventListener('load', openChangeStream);
+
+// Handle install prompt
+let deferredPrompt;
+
+window.addEventListener('beforeinstallprompt', (e) => {
+    const installButton = document.getElementById('installButton');
+    if (!installButton) {
+        return;
+    }
+    e.preventDefault();
+    deferredPrompt = e;
+    installButton.style.display = 'block';
+    installButton.addEventListener('click', async () => {
+        if (deferredPrompt) {
+            deferredPrompt.prompt();
+            const { outcome } = await deferredPrompt.userChoice;
+            if (outcome === 'accepted') {
+                installButton.style.display = 'none';
+            }
+            deferredPrompt = null;
+        }
+    }, { once: true });
+});
 
 // Global utility functions
 document.addEventListener('DOMContentLoaded', function() {
@@ -1,32 +1,352 @@
-// Register service worker
-if ('serviceWorker' in navigator) {
-  window.addEventListener('load', function() {
-    navigator.serviceWorker.register('/static/service-worker.js')
-      .then(function(registration) {
-        console.log('ServiceWorker registration successful');
-      }, function(err) {
-        console.log('ServiceWorker registration failed: ', err);
-      });
+// Service worker: offline app shell, local document store and write queue.
+// Served from /service-worker.js so its scope covers the pages and /api.
+//
+// - Static files are served from the cache and refreshed in the background;
+//   pages and GET /api responses go to the network first and fall back to the
+//   last cached copy (or, for the list endpoints, to the local store).
+// - The local store (IndexedDB) mirrors the user's documents through the
+//   /api/sync change feed.
+// - Item writes (add_, update_task, delete_item) made while offline are queued
+//   and replayed in one /api/sync/batch request once the browser is back online.
+//   Settings changes are not queued.
+
+const SHELL_CACHE = 'shell-v1';
+const API_CACHE = 'api-v1';
+const SHELL_FILES = [
+  '/static/css/style.css',
+  '/static/js/app.js',
+  '/static/manifest.json'
+];
+
+const DB_NAME = 'money-event-manager';
+const DB_VERSION = 1;
+const BATCH_SIZE = 100;
+// The writes /api/sync/batch can replay (REPLAY_WRITES in routes/sync.py)
+const WRITE_PATH = /^\/api\/(add_|update_task\/|delete_item\/)/;
+
+// List endpoints that can be answered from the local store, formatted the way
+// the server's output schemas format them (DATE = 10 characters, DATETIME = 19
+// with a space, ISO = 19 with the T)
+const LOCAL_ENDPOINTS = {
+  '/api/get_incomes': { collection: 'incomes', sort: ['date', -1], dates: { date: 'date', created_at: 'datetime' } },
+  '/api/get_expenses': { collection: 'expenses', sort: ['date', -1], dates: { date: 'date', created_at: 'datetime' } },
+  '/api/get_bills': { collection: 'bills', sort: ['due_date', 1], dates: { due_date: 'date', created_at: 'datetime' } },
+  '/api/get_budgets': { collection: 'budgets', dates: {} },
+  '/api/get_goals': { collection: 'goals', dates: { target_date: 'date' } },
+  '/api/get_events': { collection: 'events', sort: ['start', 1], dates: { start: 'iso', end: 'iso' }, keyed: true },
+  '/api/get_tasks': { collection: 'tasks', sort: ['due_date', 1], dates: { due_date: 'date', completed_date: 'date' }, keyed: true }
+};
+
+
+// IndexedDB
+
+function openStore() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.open(DB_NAME, DB_VERSION);
+    request.onupgradeneeded = () => {
+      const db = request.result;
+      const documents = db.createObjectStore('documents', { keyPath: ['collection', '_id'] });
+      documents.createIndex('collection', 'collection');
+      db.createObjectStore('outbox', { keyPath: 'id' });
+      db.createObjectStore('meta');
+    };
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
   });
 }
 
-// Handle install prompt
-let deferredPrompt;
-const installButton = document.getElementById('installButton');
+async function transaction(stores, mode, work) {
+  const db = await openStore();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(stores, mode);
+    let result;
+    Promise.resolve(work(tx)).then(value => { result = value; });
+    tx.oncomplete = () => { db.close(); resolve(result); };
+    tx.onerror = () => { db.close(); reject(tx.error); };
+  });
+}
+
+function requestValue(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
 
-window.addEventListener('beforeinstallprompt', (e) => {
-  e.preventDefault();
-  deferredPrompt = e;
-  installButton.style.display = 'block';
+function getMeta(key) {
+  return transaction(['meta'], 'readonly', tx => requestValue(tx.objectStore('meta').get(key)));
+}
+
+
+// Write queue
+
+async function queueWrite(request) {
+  const body = await request.clone().text();
+  const url = new URL(request.url);
+  const write = {
+    id: (self.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`,
+    method: request.method,
+    path: url.pathname + url.search,
+    body: body ? JSON.parse(body) : null,
+    queued_at: Date.now()
+  };
+  await transaction(['outbox'], 'readwrite', tx => { tx.objectStore('outbox').put(write); });
+  if (self.registration.sync) {
+    self.registration.sync.register('replay-writes').catch(() => {});
+  }
+  return new Response(JSON.stringify({
+    status: 'success',
+    queued: true,
+    message: 'You are offline; the change will be saved when the connection is back'
+  }), { status: 202, headers: { 'Content-Type': 'application/json' } });
+}
+
+async function replayOutbox() {
+  const writes = await transaction(['outbox'], 'readonly', tx => requestValue(tx.objectStore('outbox').getAll()));
+  writes.sort((a, b) => a.queued_at - b.queued_at);
+
+  for (let start = 0; start < writes.length; start += BATCH_SIZE) {
+    const batch = writes.slice(start, start + BATCH_SIZE);
+    const response = await fetch('/api/sync/batch', {
+      method: 'POST',
+      credentials: 'same-origin',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ writes: batch })
+    });
+    if (!isJson(response)) {
+      return;  // signed out, or the server is unreachable; try again later
+    }
+    const data = await response.json();
+    if (!response.ok || !data.results) {
+      return;
+    }
+    // Rejected writes are dropped too: replaying them again would fail the same way
+    await transaction(['outbox'], 'readwrite', tx => {
+      const outbox = tx.objectStore('outbox');
+      data.results.forEach(result => outbox.delete(result.id));
+    });
+  }
+}
+
+
+// Change feed
+
+function isJson(response) {
+  return !response.redirected && (response.headers.get('Content-Type') || '').includes('application/json');
+}
+
+async function pullChanges() {
+  let since = (await getMeta('version')) || 0;
+  const initial = since;
+  const user = await getMeta('user_id');
+  const changed = new Set();
+
+  for (;;) {
+    const response = await fetch(`/api/sync?since=${since}`, { credentials: 'same-origin' });
+    if (!response.ok || !isJson(response)) {
+      break;
+    }
+    const data = await response.json();
+    if (user && data.user_id !== user && !data.full) {
+      // Someone else signed in on this device: start over from a full copy
+      since = 0;
+      await forgetUser();
+      continue;
+    }
+    await applyChanges(data);
+    Object.keys(data.changes).forEach(collection => changed.add(collection));
+    since = data.version;
+    if (!data.more) {
+      break;
+    }
+  }
+  // The first copy is not news to the open pages
+  return initial ? [...changed] : [];
+}
+
+function applyChanges(data) {
+  return transaction(['documents', 'meta'], 'readwrite', tx => {
+    const documents = tx.objectStore('documents');
+    if (data.full) {
+      documents.clear();
+    }
+    Object.entries(data.changes).forEach(([collection, change]) => {
+      change.inserted.concat(change.updated).forEach(doc => documents.put(Object.assign({ collection }, doc)));
+      change.deleted.forEach(id => documents.delete([collection, id]));
+    });
+    const meta = tx.objectStore('meta');
+    meta.put(data.version, 'version');
+    meta.put(data.user_id, 'user_id');
+  });
+}
+
+async function forgetUser() {
+  await transaction(['documents', 'meta'], 'readwrite', tx => {
+    tx.objectStore('documents').clear();
+    tx.objectStore('meta').clear();
+  });
+  await caches.delete(API_CACHE);
+}
+
+let syncing = null;
+
+function syncNow() {
+  if (!syncing) {
+    syncing = (async () => {
+      await replayOutbox();
+      const collections = await pullChanges();
+      if (collections.length) {
+        const windows = await self.clients.matchAll({ type: 'window' });
+        windows.forEach(client => client.postMessage({ type: 'changes', collections }));
+      }
+    })().catch(error => console.log('Sync failed: ', error)).finally(() => { syncing = null; });
+  }
+  return syncing;
+}
+
+
+// Offline answers from the local store
+
+function formatDate(value, format) {
+  if (!value) {
+    return value === undefined ? undefined : null;
+  }
+  if (format === 'date') {
+    return value.slice(0, 10);
+  }
+  return format === 'datetime' ? value.slice(0, 19).replace('T', ' ') : value.slice(0, 19);
+}
+
+async function localResponse(pathname) {
+  const endpoint = LOCAL_ENDPOINTS[pathname];
+  if (!endpoint || !(await getMeta('version'))) {
+    return null;
+  }
+  const docs = await transaction(['documents'], 'readonly',
+    tx => requestValue(tx.objectStore('documents').index('collection').getAll(endpoint.collection)));
+
+  if (endpoint.sort) {
+    const [field, direction] = endpoint.sort;
+    docs.sort((a, b) => (a[field] < b[field] ? -direction : a[field] > b[field] ? direction : 0));
+  }
+  const items = docs.map(doc => {
+    const item = Object.assign({}, doc);
+    delete item.collection;
+    Object.entries(endpoint.dates).forEach(([field, format]) => {
+      if (field in item) {
+        item[field] = formatDate(item[field], format);
+      }
+    });
+    return item;
+  });
+
+  let body = items;
+  if (endpoint.keyed) {
+    body = {};
+    items.forEach(item => {
+      const id = item._id;
+      delete item._id;
+      delete item.user_id;
+      delete item.created_at;
+      body[id] = item;
+    });
+  }
+  return new Response(JSON.stringify(body), { headers: { 'Content-Type': 'application/json', 'X-Offline': 'local' } });
+}
+
+
+// Fetch strategies
+
+async function networkFirst(request, cacheName) {
+  try {
+    const response = await fetch(request);
+    if (response.ok && !response.redirected) {
+      const cache = await caches.open(cacheName);
+      cache.put(request, response.clone());
+    }
+    return response;
+  } catch (error) {
+    const cached = await caches.match(request);
+    if (cached) {
+      return cached;
+    }
+    const local = await localResponse(new URL(request.url).pathname);
+    if (local) {
+      return local;
+    }
+    throw error;
+  }
+}
+
+async function staleWhileRevalidate(request) {
+  const cache = await caches.open(SHELL_CACHE);
+  const cached = await cache.match(request);
+  const refresh = fetch(request).then(response => {
+    if (response.ok) {
+      cache.put(request, response.clone());
+    }
+    return response;
+  });
+  return cached || refresh;
+}
+
+async function writeOrQueue(request) {
+  const queued = request.clone();
+  try {
+    return await fetch(request);
+  } catch (error) {
+    return queueWrite(queued);
+  }
+}
+
+
+self.addEventListener('install', event => {
+  event.waitUntil(caches.open(SHELL_CACHE).then(cache => cache.addAll(SHELL_FILES)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(keys => Promise.all(keys.filter(key => ![SHELL_CACHE, API_CACHE].includes(key)).map(key => caches.delete(key))))
+      .then(() => self.clients.claim())
+  );
 });
 
-installButton.addEventListener('click', async () => {
-  if (deferredPrompt) {
-    deferredPrompt.prompt();
-    const { outcome } = await deferredPrompt.userChoice;
-    if (outcome === 'accepted') {
-      installButton.style.display = 'none';
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) {
+    return;
+  }
+
+  if (request.method !== 'GET') {
+    if (WRITE_PATH.test(url.pathname)) {
+      event.respondWith(writeOrQueue(request));
     }
-    deferredPrompt = null;
+    return;
+  }
+  if (url.pathname.startsWith('/api/sync') || url.pathname === '/api/stream') {
+    return;
   }
-});
\ No newline at end of file
+  if (url.pathname.startsWith('/static/')) {
+    event.respondWith(staleWhileRevalidate(request));
+  } else if (url.pathname.startsWith('/api/')) {
+    event.respondWith(networkFirst(request, API_CACHE));
+  } else if (request.mode === 'navigate') {
+    event.respondWith(networkFirst(request, SHELL_CACHE));
+  }
+});
+
+self.addEventListener('message', event => {
+  if (event.data && event.data.type === 'sync') {
+    event.waitUntil(syncNow());
+  } else if (event.data && event.data.type === 'logout') {
+    event.waitUntil(forgetUser());
+  }
+});
+
+self.addEventListener('sync', event => {
+  if (event.tag === 'replay-writes') {
+    event.waitUntil(syncNow());
+  }
+});
@@ -0,0 +1,145 @@
+"""The app on mongomock, counting commands the way mongo_metrics counts them.
+
+mongomock sends no commands, so the driver's command listener never fires;
+instead every top-level collection call adds to g.mongo_commands as many
+commands as pymongo would send for it. Calls made from inside another one
+(the $unionWith sub-pipeline) are part of that command and are not counted.
+
+It is also taught the few aggregation operators mongomock lacks and the app
+uses: $unionWith, and $toDate and date arithmetic for bucketed storage. The
+`storage` fixture runs a test in both TRANSACTION_STORAGE modes.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+import os
+import sys
+import threading
+import uuid
+
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+import mongomock.aggregate
+import mongomock.collection
+from flask import g, has_request_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017')
+# The cheapest cost bcrypt accepts, so logins do not dominate the run time
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import database
+
+database.client = mongomock.MongoClient()
+database.db = database.client.money_event_manager
+
+COMMANDS = [
+    'find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one',
+    'delete_one', 'delete_many', 'find_one_and_update', 'find_one_and_delete', 'find_one_and_replace',
+    'aggregate', 'count_documents', 'distinct', 'bulk_write'
+]
+
+_nesting = threading.local()
+
+
+def _command_count(name, args, kwargs):
+    if name != 'bulk_write':
+        return 1
+    requests = args[0] if args else kwargs['requests']
+    kinds = [type(request).__name__.replace('One', '').replace('Many', '') for request in requests]
+    if not kwargs.get('ordered', True):
+        # Unordered bulk writes send one command per kind of write
+        return len(Counter(kinds))
+    return sum(1 for i, kind in enumerate(kinds) if i == 0 or kinds[i - 1] != kind)
+
+
+def _counted(name):
+    method = getattr(mongomock.collection.Collection, name)
+
+    def counted(self, *args, **kwargs):
+        depth = getattr(_nesting, 'depth', 0)
+        if depth == 0 and has_request_context():
+            g.mongo_commands = g.get('mongo_commands', 0) + _command_count(name, args, kwargs)
+        _nesting.depth = depth + 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _nesting.depth = depth
+
+    counted.__wrapped__ = method
+    return counted
+
+
+def _union_with(in_collection, db, options):
+    # mongomock has no $unionWith; archive.WithArchive reads the archive through it
+    other = db.get_collection(options['coll']).aggregate(options.get('pipeline', []))
+    return list(in_collection) + list(other)
+
+
+_convert = mongomock.aggregate._Parser._handle_type_convertion_operator
+_arithmetic = mongomock.aggregate._Parser._handle_arithmetic_operator
+
+
+def _to_date(parser, operator, values):
+    # transactions.BucketedCollection derives created_at from the item's ObjectId
+    if operator != '$toDate':
+        return _convert(parser, operator, values)
+    value = parser.parse(values)
+    return value.generation_time.replace(tzinfo=None) if hasattr(value, 'generation_time') else value
+
+
+def _add(parser, operator, values):
+    # $add of a date and milliseconds gives a date
+    if operator == '$add':
+        parsed = [parser.parse(value) for value in values]
+        dates = [value for value in parsed if isinstance(value, datetime)]
+        if dates:
+            milliseconds = sum(value for value in parsed if not isinstance(value, datetime))
+            return dates[0] + timedelta(milliseconds=milliseconds)
+    return _arithmetic(parser, operator, values)
+
+
+for _name in COMMANDS:
+    setattr(mongomock.collection.Collection, _name, _counted(_name))
+mongomock.aggregate._PIPELINE_HANDLERS['$unionWith'] = _union_with
+mongomock.aggregate.type_convertion_operators.append('$toDate')
+mongomock.aggregate._Parser._handle_type_convertion_operator = _to_date
+mongomock.aggregate._Parser._handle_arithmetic_operator = _add
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture(scope='session')
+def db(app):
+    return database.db
+
+
+@pytest.fixture
+def login(app, db):
+    """Creates a user with no data and returns (logged-in test client, user id)."""
+    from models import User
+
+    def login(username=None, password='secret'):
+        username = username or f'user-{uuid.uuid4().hex[:8]}'
+        user_id = User.create_user(db, username, f'{username}@example.com', password)
+        client = app.test_client()
+        response = client.post('/login', data={'username': username, 'password': password})
+        assert response.status_code == 302
+        return client, user_id
+
+    return login
+
+
+@pytest.fixture(params=['documents', 'buckets'])
+def storage(request, monkeypatch):
+    """Runs the test once per TRANSACTION_STORAGE mode."""
+    import transactions
+    monkeypatch.setattr(transactions, 'TRANSACTION_STORAGE', request.param)
+    return request.param
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+import archive
+import changelog
+import items
+import rollups
+import transactions
+from database import db
+
+NOW = datetime(2024, 6, 15)
+
+
+def _archive(user_id):
+    """One pass over the user's data only, so other tests' data stays put."""
+    return {name: archive.move(name, dict(query, user_id=user_id)) for name, query in archive.rules(NOW)}
+
+
+def _ids(response):
+    data = response.get_json()
+    # Events and tasks come keyed by id
+    return sorted(data) if isinstance(data, dict) else sorted(document['_id'] for document in data)
+
+
+def _rollups(user_id):
+    return sorted((doc['kind'], doc['month'], doc['category'], doc['total'], doc['count'])
+                  for doc in db[rollups.ROLLUP_COLLECTION].find({'user_id': user_id}))
+
+
+def _seed(user_id):
+    old = [items.create('incomes', {'amount': 100, 'source': 'Salary', 'date': '2021-03-01'}, user_id),
+           items.create('expenses', {'amount': 20, 'category': 'Food', 'date': '2021-03-05'}, user_id)]
+    recent = [items.create('incomes', {'amount': 50, 'source': 'Gift', 'date': '2024-06-01'}, user_id),
+              items.create('expenses', {'amount': 5, 'category': 'Food', 'date': '2024-06-02'}, user_id)]
+    return old, recent
+
+
+def test_old_records_move_to_the_archive(storage, login):
+    client, user_id = login()
+    (old_income, old_expense), (income, expense) = _seed(user_id)
+    old_event = items.create('events', {'title': 'Conference', 'start': '2022-05-01T09:00',
+                                        'end': '2022-05-01T17:00'}, user_id)
+    standup = items.create('events', {'title': 'Standup', 'start': '2022-05-01T09:00', 'recurring': True,
+                                      'recurrence_pattern': 'daily'}, user_id)
+    old_task = items.create('tasks', {'name': 'Taxes', 'due_date': '2023-04-01'}, user_id)
+    items.update('tasks', user_id, str(old_task['_id']), {'completed': True})
+    db.tasks.update_one({'_id': old_task['_id']}, {'$set': {'completed_date': datetime(2023, 4, 1)}})
+    totals = _rollups(user_id)
+
+    _archive(user_id)
+
+    assert _ids(client.get('/api/get_incomes')) == [str(income['_id'])]
+    assert _ids(client.get('/api/get_incomes?include_archived=true')) == sorted(
+        [str(income['_id']), str(old_income['_id'])])
+    assert _ids(client.get('/api/get_expenses')) == [str(expense['_id'])]
+    assert _ids(client.get('/api/get_events')) == [str(standup['_id'])]
+    assert _ids(client.get('/api/get_events?include_archived=true')) == sorted(
+        [str(standup['_id']), str(old_event['_id'])])
+    assert _ids(client.get('/api/get_tasks')) == []
+    assert archive.collection('incomes').find_one({'_id': old_income['_id']})['amount'] == 100
+    # Summaries keep counting archived transactions
+    assert _rollups(user_id) == totals
+    # A second pass finds nothing left to move
+    assert not any(_archive(user_id).values())
+
+
+def test_synced_clients_see_archived_records_as_deleted(storage, login):
+    client, user_id = login()
+    (old_income, old_expense), _ = _seed(user_id)
+    since = client.get('/api/sync?since=0').get_json()['version']
+
+    _archive(user_id)
+
+    changes = client.get(f'/api/sync?since={since}').get_json()['changes']
+    assert changes['incomes']['deleted'] == [str(old_income['_id'])]
+    assert changes['expenses']['deleted'] == [str(old_expense['_id'])]
+
+
+def test_an_interrupted_pass_is_picked_up(login):
+    _, user_id = login()
+    old = items.create('tasks', {'name': 'Taxes', 'due_date': '2023-04-01', 'completed': True}, user_id)
+    db.tasks.update_one({'_id': old['_id']}, {'$set': {'completed_date': datetime(2023, 4, 1)}})
+    # Copied by a pass that stopped before removing it from the live collection
+    db[archive.ARCHIVE_PREFIX + 'tasks'].insert_one(db.tasks.find_one({'_id': old['_id']}))
+
+    assert _archive(user_id)['tasks'] == 1
+    assert db.tasks.count_documents({'user_id': user_id}) == 0
+    assert db[archive.ARCHIVE_PREFIX + 'tasks'].count_documents({'user_id': user_id}) == 1
+
+
+def test_archived_records_can_be_edited_and_deleted(storage, login):
+    client, user_id = login()
+    (old_income, old_expense), _ = _seed(user_id)
+    _archive(user_id)
+    version = changelog.current_version(user_id)
+
+    assert items.update('incomes', user_id, str(old_income['_id']), {'amount': 120})
+    assert archive.collection('incomes').find_one({'_id': old_income['_id']})['amount'] == 120
+    assert transactions.collection('incomes').find_one({'_id': old_income['_id']}) is None
+    assert ('income', '2021-03', 'Salary', 120, 1) in _rollups(user_id)
+
+    response = client.delete(f"/api/delete_item/expenses/{old_expense['_id']}")
+    assert response.status_code == 200
+    assert archive.collection('expenses').find_one({'_id': old_expense['_id']}) is None
+    assert not any(row[:3] == ('expense', '2021-03', 'Food') and row[4] for row in _rollups(user_id))
+    assert changelog.current_version(user_id) == version + 2
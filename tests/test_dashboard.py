@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import query_budget
+
+
+def test_dashboard_bundles_every_panel(login):
+    client, _ = login()
+    today = datetime.now().date()
+    client.post('/api/add_income', json={'amount': 500, 'source': 'Salary', 'date': str(today)})
+    client.post('/api/add_expense', json={'amount': 120, 'category': 'Rent', 'date': str(today)})
+    client.post('/api/add_bill', json={'name': 'Power', 'amount': 40, 'recurring': False,
+                                       'due_date': str(today + timedelta(days=3))})
+    client.post('/api/add_task', json={'name': 'File taxes', 'due_date': str(today)})
+    client.post('/api/add_goal', json={'name': 'Bike', 'target_amount': 400, 'current_amount': 100})
+
+    with query_budget.recording() as log:
+        bundle = client.get('/api/dashboard').get_json()
+
+    assert bundle['summary']['balance'] == 380
+    assert bundle['summary']['current_month'] == {'income': 500, 'expense': 120}
+    assert bundle['top_expense_categories'] == [{'name': 'Rent', 'total': 120}]
+    assert [t['type'] for t in bundle['recent_transactions']] == ['income', 'expense']
+    assert bundle['bills']['count'] == 1 and bundle['bills']['total'] == 40
+    assert [task['name'] for task in bundle['tasks']] == ['File taxes']
+    assert bundle['goals'][0]['progress'] == 25.0
+    # The panels' commands, run on the executor, are counted for the request
+    assert log[0]['commands'] >= len(bundle)
+
+
+def test_upcoming_events_include_repeats_of_earlier_series(login):
+    client, _ = login()
+    now = datetime.now()
+    series_start = (now - timedelta(days=30)).replace(hour=23, minute=59, second=0, microsecond=0)
+    client.post('/api/add_event', json={'title': 'Weekly call', 'recurring': True, 'recurrence_pattern': 'weekly',
+                                        'start': series_start.strftime('%Y-%m-%dT%H:%M')})
+    client.post('/api/add_event', json={'title': 'Last month', 'start': series_start.strftime('%Y-%m-%dT%H:%M')})
+    tomorrow = (now + timedelta(days=1)).strftime('%Y-%m-%dT10:00')
+    client.post('/api/add_event', json={'title': 'Dentist', 'start': tomorrow})
+
+    upcoming = client.get('/api/dashboard?days=14').get_json()['events']
+
+    calls = [event['start'] for event in upcoming if event['title'] == 'Weekly call']
+    assert len(calls) == 2 and all(datetime.fromisoformat(start) >= now for start in calls)
+    assert 'Dentist' in [event['title'] for event in upcoming]
+    assert 'Last month' not in [event['title'] for event in upcoming]
+    assert [event['start'] for event in upcoming] == sorted(event['start'] for event in upcoming)
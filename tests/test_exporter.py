@@ -0,0 +1,67 @@
+from datetime import datetime
+import gzip
+import json
+
+import pytest
+
+import exporter
+from database import db
+
+
+def _baseline_export(user_id):
+    """The export as the original endpoint built it, in memory."""
+    user_data = {}
+    for collection in exporter.EXPORT_COLLECTIONS:
+        items = list(db[collection].find({'user_id': user_id}))
+        for item in items:
+            item['_id'] = str(item['_id'])
+            for key, value in item.items():
+                if isinstance(value, datetime):
+                    item[key] = value.isoformat()
+        user_data[collection] = items
+    return json.dumps(user_data, indent=2).encode('utf-8')
+
+
+@pytest.fixture
+def user(login):
+    client, user_id = login()
+    client.post('/api/add_income', json={'amount': 1200, 'source': 'Salary', 'date': '2024-01-31'})
+    client.post('/api/add_income', json={'amount': 35.5, 'source': 'Café "tips"', 'date': '2024-02-01',
+                                         'description': 'line one\nline two'})
+    client.post('/api/add_event', json={'title': 'Gym', 'start': '2024-02-03T07:00', 'recurring': True,
+                                        'recurrence_pattern': 'weekly'})
+    client.post('/api/add_goal', json={'name': 'Trip', 'target_amount': 900})
+    return client, user_id
+
+
+@pytest.fixture
+def user_id(user):
+    return user[1]
+
+
+@pytest.mark.parametrize('chunk_size', [exporter.CHUNK_SIZE, 7])
+def test_legacy_export_is_byte_for_byte_the_original(user_id, monkeypatch, chunk_size):
+    monkeypatch.setattr(exporter, 'CHUNK_SIZE', chunk_size)
+    exported = b''.join(exporter.stream_export(user_id))
+    assert exported == _baseline_export(user_id)
+
+
+def test_compressed_and_compact_formats_hold_the_same_documents(user_id):
+    legacy = json.loads(_baseline_export(user_id))
+    compact = json.loads(gzip.decompress(b''.join(exporter.stream_export(user_id, 'json', compress=True))))
+    assert compact == legacy
+
+    lines = [json.loads(line) for line in b''.join(exporter.stream_export(user_id, 'ndjson')).splitlines()]
+    by_collection = {collection: [] for collection in exporter.EXPORT_COLLECTIONS}
+    for line in lines:
+        by_collection[line.pop('_collection')].append(line)
+    assert by_collection == legacy
+
+
+def test_export_endpoint_filters_by_date(user):
+    client, _ = user
+    response = client.get('/api/export_data?format=json&collections=incomes&from=2024-02-01&to=2024-02-29')
+    assert response.status_code == 200
+    assert [income['source'] for income in json.loads(response.get_data())['incomes']] == ['Café "tips"']
+    assert client.get('/api/export_data?format=xml').status_code == 400
+
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+import random
+
+import pytest
+
+from freebusy import BusyIndex
+
+DAY = datetime(2024, 6, 3)
+
+
+def _at(hours, minutes=0):
+    return DAY + timedelta(hours=hours, minutes=minutes)
+
+
+def _brute_force(occurrences, start, end):
+    return sorted(o for o in occurrences if o[1] is not None and o[1] > o[0] and o[0] < end and o[1] > start)
+
+
+def test_busy_merges_overlapping_and_touching_occurrences():
+    index = BusyIndex([(_at(9), _at(10), 'a'), (_at(9, 30), _at(11), 'b'), (_at(11), _at(12), 'c'),
+                       (_at(14), _at(15), 'd'), (_at(16), None, 'reminder')])
+    assert index.busy() == [(_at(9), _at(12)), (_at(14), _at(15))]
+    assert index.overlaps(_at(11, 59), _at(13))
+    assert not index.overlaps(_at(12), _at(14))
+
+
+def test_conflicts_with_one_long_event():
+    week = (DAY - timedelta(days=3), DAY + timedelta(days=4), 'conference')
+    meetings = [(_at(hour), _at(hour, 30), f'm{hour}') for hour in range(8, 18)]
+    index = BusyIndex(meetings + [week])
+
+    assert index.conflicts(_at(12, 10), _at(12, 20)) == [week, (_at(12), _at(12, 30), 'm12')]
+    assert index.conflicts(_at(12, 30), _at(13)) == [week]
+    assert index.conflicts(DAY + timedelta(days=5), DAY + timedelta(days=6)) == []
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_conflicts_match_a_brute_force_scan(seed):
+    rng = random.Random(seed)
+    occurrences = []
+    for i in range(rng.randint(0, 60)):
+        start = _at(0, rng.randint(0, 24 * 60))
+        length = rng.choice([0, 15, 30, 60, 240, 24 * 60 * 3])
+        occurrences.append((start, start + timedelta(minutes=length) if length else None, f'e{i}'))
+    index = BusyIndex(occurrences)
+
+    for _ in range(50):
+        start = _at(0, rng.randint(-600, 26 * 60))
+        end = start + timedelta(minutes=rng.randint(1, 600))
+        assert index.conflicts(start, end) == _brute_force(occurrences, start, end)
+
+
+def test_free_slots():
+    index = BusyIndex([(_at(9), _at(10), 'a'), (_at(10, 20), _at(12), 'b'), (_at(13), _at(17), 'c')])
+    slots = list(index.free_slots(_at(8), _at(18), minutes=30))
+    assert slots == [(_at(8), _at(9)), (_at(12), _at(13)), (_at(17), _at(18))]
+    assert list(index.free_slots(_at(8), _at(18), minutes=30, limit=1)) == [(_at(8), _at(9))]
+
+
+def test_freebusy_endpoints(login):
+    client, _ = login()
+    client.post('/api/add_event', json={'title': 'Gym', 'start': '2024-06-03T07:00', 'end': '2024-06-03T08:00',
+                                        'recurring': True, 'recurrence_pattern': 'daily'})
+    response = client.get('/api/freebusy/check?start=2024-06-05T07:30&end=2024-06-05T09:00').get_json()
+    assert response['conflict'] is True
+    assert [c['start'] for c in response['conflicts']] == ['2024-06-05T07:00:00']
+
+    busy = client.get('/api/freebusy?from=2024-06-04&to=2024-06-05').get_json()['busy']
+    assert busy == [{'start': '2024-06-04T07:00:00', 'end': '2024-06-04T08:00:00'},
+                    {'start': '2024-06-05T07:00:00', 'end': '2024-06-05T08:00:00'}]
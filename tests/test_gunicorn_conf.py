@@ -0,0 +1,36 @@
+import os
+import runpy
+from types import SimpleNamespace
+
+from routes import stream
+import warmup
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+
+
+def _worker(config):
+    return SimpleNamespace(cfg=SimpleNamespace(threads=config['threads']), wsgi=None)
+
+
+def test_workers_are_threaded_and_stream(monkeypatch):
+    monkeypatch.delenv('GUNICORN_WORKER_CLASS', raising=False)
+    monkeypatch.delenv('GUNICORN_THREADS', raising=False)
+    monkeypatch.delenv('STREAM_MAX_CONNECTIONS', raising=False)
+    monkeypatch.setattr(stream, 'STREAM_MAX_CONNECTIONS', stream.STREAM_MAX_CONNECTIONS)
+    monkeypatch.setattr(warmup, 'start_warm_up', lambda app: None)
+
+    config = runpy.run_path(CONFIG)
+    assert config['worker_class'] == 'gthread'
+    config['post_worker_init'](_worker(config))
+    assert stream.STREAM_MAX_CONNECTIONS == config['threads'] - 2 > 0
+
+
+def test_thread_count_from_the_environment(monkeypatch):
+    monkeypatch.setenv('GUNICORN_THREADS', '4')
+    monkeypatch.delenv('STREAM_MAX_CONNECTIONS', raising=False)
+    monkeypatch.setattr(stream, 'STREAM_MAX_CONNECTIONS', stream.STREAM_MAX_CONNECTIONS)
+    monkeypatch.setattr(warmup, 'start_warm_up', lambda app: None)
+
+    config = runpy.run_path(CONFIG)
+    config['post_worker_init'](_worker(config))
+    assert stream.STREAM_MAX_CONNECTIONS == 2
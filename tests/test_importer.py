@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta
+import io
+import json
+
+import pytest
+
+import archive
+import importer
+import rollups
+import transactions
+from database import db
+
+
+class _Inline:
+    """Runs import jobs on the request thread, so they have finished when the upload returns."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture(autouse=True)
+def inline_jobs(monkeypatch):
+    monkeypatch.setattr(importer, '_executor', _Inline())
+
+
+def _upload(client, content, filename='data.ndjson', overwrite=False):
+    response = client.post('/api/import_data', data={
+        'file': (io.BytesIO(content.encode('utf-8')), filename), 'overwrite': str(overwrite).lower()
+    })
+    assert response.status_code == 202
+    return client.get(f"/api/import_status/{response.get_json()['job_id']}").get_json()['job']
+
+
+def _ndjson(*items):
+    return ''.join(json.dumps(item) + '\n' for item in items)
+
+
+def _incomes(user_id):
+    return sorted(doc['source'] for doc in transactions.collection('incomes').find({'user_id': user_id}))
+
+
+def _assert_no_leftovers(user_id):
+    for collection in importer.IMPORT_SCHEMAS:
+        assert db[importer.IMPORT_STAGING_PREFIX + collection].count_documents({}) == 0
+    for collection in ('incomes', 'expenses'):
+        assert db[collection].count_documents({importer.IMPORT_TAG: {'$exists': True}}) == 0
+    assert db[transactions.BUCKET_COLLECTION].count_documents({importer.IMPORT_TAG: {'$exists': True}}) == 0
+
+
+@pytest.fixture
+def account(login, storage):
+    client, user_id = login()
+    client.post('/api/add_income', json={'amount': 100, 'source': 'Old salary', 'date': '2024-01-05'})
+    client.post('/api/add_expense', json={'amount': 30, 'category': 'Old rent', 'date': '2024-01-06'})
+    client.post('/api/add_task', json={'name': 'Old task', 'due_date': '2024-01-07'})
+    return client, user_id
+
+
+NEW_DATA = _ndjson(
+    {'_collection': 'incomes', 'amount': 250, 'source': 'New salary', 'date': '2024-02-01'},
+    {'_collection': 'incomes', 'amount': 50, 'source': 'New gift', 'date': '2024-03-01T10:30:00'},
+    {'_collection': 'tasks', 'name': 'New task', 'due_date': '2024-02-02', 'completed': 'false'}
+)
+
+
+def test_overwrite_replaces_only_the_collections_in_the_file(account):
+    client, user_id = account
+    archive.collection('incomes').insert_many([
+        {'user_id': user_id, 'amount': 5, 'source': 'Archived', 'date': datetime(2020, 1, 1)}])
+
+    job = _upload(client, NEW_DATA, overwrite=True)
+
+    assert job['state'] == 'completed'
+    assert job['collections'] == {'incomes': 2, 'tasks': 1}
+    assert _incomes(user_id) == ['New gift', 'New salary']
+    assert archive.collection('incomes').find_one({'user_id': user_id}) is None
+    assert [task['name'] for task in db.tasks.find({'user_id': user_id})] == ['New task']
+    # Not in the file, so left alone
+    assert transactions.collection('expenses').find_one({'user_id': user_id})['category'] == 'Old rent'
+    assert rollups.summary_totals(user_id) == {'income': 300, 'expense': 30}
+    _assert_no_leftovers(user_id)
+
+
+def test_merge_keeps_the_existing_data(account):
+    client, user_id = account
+    job = _upload(client, NEW_DATA)
+    assert job['state'] == 'completed'
+    assert _incomes(user_id) == ['New gift', 'New salary', 'Old salary']
+    assert rollups.summary_totals(user_id)['income'] == 400
+    _assert_no_leftovers(user_id)
+
+
+def test_failed_publish_keeps_the_old_data(account, monkeypatch):
+    client, user_id = account
+    publish = importer._publish
+
+    def fail_on_tasks(job_id, collection):
+        # incomes is published in full first, then tasks fails part way
+        publish(job_id, collection)
+        if collection == 'tasks':
+            raise ConnectionError('connection lost')
+    monkeypatch.setattr(importer, '_publish', fail_on_tasks)
+
+    job = _upload(client, NEW_DATA, overwrite=True)
+
+    assert job['state'] == 'failed'
+    assert 'connection lost' in job['errors']
+    assert _incomes(user_id) == ['Old salary']
+    assert [task['name'] for task in db.tasks.find({'user_id': user_id})] == ['Old task']
+    assert rollups.summary_totals(user_id) == {'income': 100, 'expense': 30}
+    _assert_no_leftovers(user_id)
+
+
+def test_stale_job_takes_back_what_it_published(account):
+    _, user_id = account
+    job_id = db[importer.JOB_COLLECTION].insert_one({
+        'user_id': user_id, 'status': 'running', 'errors': [],
+        'updated_at': datetime.now() - timedelta(minutes=importer.IMPORT_STALE_MINUTES + 1)
+    }).inserted_id
+    transactions.collection('incomes').insert_one({
+        'user_id': user_id, 'amount': 1, 'source': 'Half imported', 'date': datetime(2024, 4, 1),
+        importer.IMPORT_TAG: str(job_id)})
+
+    assert importer.clean_up_stale_jobs() == 1
+    assert _incomes(user_id) == ['Old salary']
+    assert db[importer.JOB_COLLECTION].find_one({'_id': job_id})['status'] == 'failed'
+
+
+@pytest.mark.parametrize('value, expected', [
+    (True, True), ('true', True), ('Yes', True), ('1', True), (1, True),
+    (False, False), ('false', False), ('0', False), ('no', False), (0, False), ('', False)
+])
+def test_parse_bool(value, expected):
+    assert importer.parse_bool(value) is expected
+
+
+def test_convert_item_rejects_bad_values():
+    with pytest.raises(ValueError, match='Invalid boolean'):
+        importer.convert_item('bills', {'name': 'Power', 'amount': 1, 'due_date': '2024-01-01',
+                                        'recurring': 'maybe'}, 'u')
+    with pytest.raises(ValueError, match='Missing field: amount'):
+        importer.convert_item('incomes', {'source': 'x', 'date': '2024-01-01', 'amount': None}, 'u')
+    with pytest.raises(TypeError, match='Invalid date'):
+        importer.convert_item('incomes', {'source': 'x', 'date': 20240101, 'amount': 1}, 'u')
+
+
+def test_bad_lines_are_reported_and_skipped(login):
+    client, user_id = login()
+    content = _ndjson(
+        {'_collection': 'bills', 'name': 'Power', 'amount': 40, 'due_date': '2024-01-09',
+         'recurring': 'false', 'paid': 'yes'},
+        [1, 2],
+        'text',
+        {'_collection': 'incomes', 'source': 'No amount', 'date': '2024-01-01'}
+    )
+    job = _upload(client, content)
+
+    assert job['state'] == 'completed'
+    assert (job['processed'], job['inserted'], job['skipped']) == (4, 1, 3)
+    assert job['errors'] == ['Line 2 is not a JSON object', 'Line 3 is not a JSON object',
+                             'incomes: Missing field: amount']
+    bill = db.bills.find_one({'user_id': user_id})
+    assert (bill['recurring'], bill['paid']) == (False, True)
+
+
+def test_json_export_layout_round_trips(login):
+    client, user_id = login()
+    client.post('/api/add_expense', json={'amount': 9.99, 'category': 'Books', 'date': '2024-05-05'})
+    exported = client.get('/api/export_data').get_data(as_text=True)
+
+    other, other_id = login()
+    job = _upload(other, exported, filename='export.json')
+
+    assert job['state'] == 'completed'
+    expense = db.expenses.find_one({'user_id': other_id})
+    assert (expense['category'], expense['amount'], expense['date']) == ('Books', 9.99, datetime(2024, 5, 5))
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+import archive
+import items
+
+
+def _pages(client, path, limit, cursor=None):
+    """Every page of a list endpoint from `cursor` on, following next_cursor."""
+    pages = []
+    while True:
+        url = f'{path}{"&" if "?" in path else "?"}limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        data = response.get_json()
+        pages.append(data['items'])
+        if not data['next_cursor']:
+            return pages
+        assert data['next_cursor'] != cursor, 'next_cursor does not advance'
+        cursor = data['next_cursor']
+
+
+def _expected(docs):
+    """Ids in the endpoints' order: newest date first, ties by newest _id."""
+    return [str(doc['_id']) for doc in sorted(docs, key=lambda doc: (doc['date'], doc['_id']), reverse=True)]
+
+
+@pytest.fixture
+def expenses(login):
+    client, user_id = login()
+    # Several on each day, so pages break inside runs of equal dates
+    docs = [items.create('expenses', {'amount': n, 'category': 'Food', 'date': f'2024-03-{1 + n // 3:02d}'}, user_id)
+            for n in range(11)]
+    return client, user_id, docs
+
+
+def test_pages_cover_everything_once_in_order(storage, expenses):
+    client, _, docs = expenses
+    pages = _pages(client, '/api/get_expenses', 4)
+    assert [len(page) for page in pages] == [4, 4, 3]
+    assert [item['_id'] for page in pages for item in page] == _expected(docs)
+
+
+def test_an_exact_final_page_has_no_cursor(storage, expenses):
+    client, _, docs = expenses
+    pages = _pages(client, '/api/get_expenses', 11)
+    assert [len(page) for page in pages] == [11]
+
+
+def test_writes_between_pages_do_not_shift_them(storage, expenses):
+    client, user_id, docs = expenses
+    first = client.get('/api/get_expenses?limit=5').get_json()
+    # A newer expense lands before the pages already read
+    items.create('expenses', {'amount': 99, 'category': 'Food', 'date': '2024-03-31'}, user_id)
+    rest = _pages(client, '/api/get_expenses', 5, first['next_cursor'])
+    seen = [item['_id'] for item in first['items']] + [item['_id'] for page in rest for item in page]
+    assert seen == _expected(docs)
+
+
+def test_date_filters_and_fields_apply_to_every_page(storage, expenses):
+    client, _, docs = expenses
+    pages = _pages(client, '/api/get_expenses?from=2024-03-02&to=2024-03-03&fields=amount', 2)
+    within = [doc for doc in docs if datetime(2024, 3, 2) <= doc['date'] < datetime(2024, 3, 4)]
+    assert [item['_id'] for page in pages for item in page] == _expected(within)
+    assert all(set(item) == {'_id', 'amount', 'date'} for page in pages for item in page)
+
+
+def test_pages_run_on_into_the_archive(storage, login):
+    client, user_id = login()
+    docs = [items.create('incomes', {'amount': 10, 'source': 'Salary', 'date': f'{year}-01-15'}, user_id)
+            for year in (2019, 2020, 2024, 2024)]
+    archive.move('incomes', {'user_id': user_id, 'date': {'$lt': datetime(2021, 1, 1)}})
+    archive.move('transaction_buckets', {'user_id': user_id, 'month': {'$lt': '2021-01'}})
+
+    live = _pages(client, '/api/get_incomes', 1)
+    assert [item['_id'] for page in live for item in page] == _expected(docs[2:])
+    everything = _pages(client, '/api/get_incomes?include_archived=true', 1)
+    assert [item['_id'] for page in everything for item in page] == _expected(docs)
+
+
+@pytest.mark.parametrize('query', ['cursor=not-a-cursor', 'fields=amount,password', 'from=March'])
+def test_bad_list_queries_are_rejected(login, query):
+    client, _ = login()
+    response = client.get(f'/api/get_incomes?{query}')
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
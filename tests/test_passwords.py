@@ -0,0 +1,35 @@
+import threading
+
+import bcrypt
+import pytest
+
+import passwords
+from database import db
+
+
+def test_rehashes_on_login_when_the_cost_changed(app, login, monkeypatch):
+    login('rehash', 'secret')
+    old_hash = db.users.find_one({'username': 'rehash'})['password']
+    monkeypatch.setattr(passwords, 'BCRYPT_ROUNDS', passwords.hash_rounds(old_hash) + 1)
+
+    response = app.test_client().post('/login', data={'username': 'rehash', 'password': 'secret'})
+
+    assert response.status_code == 302
+    new_hash = db.users.find_one({'username': 'rehash'})['password']
+    assert passwords.hash_rounds(new_hash) == passwords.BCRYPT_ROUNDS
+    assert bcrypt.checkpw(b'secret', new_hash)
+
+
+def test_slow_hash_is_reported_as_busy(app, login, monkeypatch):
+    login('slow-hash', 'secret')
+    release = threading.Event()
+    monkeypatch.setattr(passwords, 'HASH_TIMEOUT', 0.05)
+    monkeypatch.setattr(bcrypt, 'checkpw', lambda *args: release.wait(5))
+    try:
+        with pytest.raises(passwords.PasswordHasherBusy):
+            passwords.check_password('secret', b'$2b$04$unused')
+
+        response = app.test_client().post('/login', data={'username': 'slow-hash', 'password': 'secret'})
+        assert response.status_code == 503
+    finally:
+        release.set()
@@ -0,0 +1,141 @@
+"""Every endpoint declaring a @query_budget stays within it (see query_budget.py).
+
+Each request runs with the caches cold, which is what the budgets assume:
+an empty response cache and a Flask-Login user lookup that goes to MongoDB.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import cache
+import models
+import query_budget
+import seed
+from routes import events
+
+PASSWORD = 'benchmark'
+
+TODAY = datetime.now().date()
+MONTH = TODAY.strftime('%Y-%m')
+WINDOW = f'from={TODAY - timedelta(days=7)}&to={TODAY + timedelta(days=21)}'
+
+
+def _batch(db, user_id):
+    expense = db.expenses.find_one({'user_id': user_id})
+    task = db.tasks.find_one({'user_id': user_id})
+    return {'operations': [
+        {'op': 'create', 'type': 'incomes', 'data': {'amount': 10, 'source': 'Gift', 'date': str(TODAY)}},
+        {'op': 'create', 'type': 'events', 'data': {'title': 'Dentist', 'start': f'{TODAY}T10:00'}},
+        {'op': 'update', 'type': 'expenses', 'id': str(expense['_id']), 'data': {'amount': 12.5}},
+        {'op': 'update', 'type': 'tasks', 'id': str(task['_id']), 'data': {'completed': True}},
+        {'op': 'delete', 'type': 'expenses', 'id': str(db.expenses.find_one(
+            {'user_id': user_id, '_id': {'$ne': expense['_id']}})['_id'])},
+        {'op': 'create', 'type': 'goals', 'data': {'name': 'Car', 'target_amount': 5000}},
+        {'op': 'create', 'type': 'tasks', 'data': {'name': 'Taxes', 'due_date': str(TODAY)}}
+    ]}
+
+
+# (endpoint, method, path, JSON body or a function of (db, user_id) building it)
+REQUESTS = [
+    ('money.add_income', 'POST', '/api/add_income',
+     {'amount': 100, 'source': 'Salary', 'date': str(TODAY), 'description': 'March'}),
+    ('money.add_expense', 'POST', '/api/add_expense',
+     {'amount': 20, 'category': 'Food', 'date': str(TODAY)}),
+    ('money.get_incomes', 'GET', '/api/get_incomes', None),
+    ('money.get_incomes', 'GET', '/api/get_incomes?include_archived=true&limit=20', None),
+    ('money.get_expenses', 'GET', f'/api/get_expenses?from={TODAY.replace(day=1)}&to={TODAY}', None),
+    ('money.get_expenses', 'GET', '/api/get_expenses?include_archived=true', None),
+    ('money.get_budgets', 'GET', '/api/get_budgets', None),
+    ('money.get_bills', 'GET', '/api/get_bills', None),
+    ('money.get_financial_summary', 'GET', '/api/get_financial_summary', None),
+    ('events.add_event', 'POST', '/api/add_event',
+     {'title': 'Standup', 'start': f'{TODAY}T09:00', 'end': f'{TODAY}T09:15',
+      'recurring': True, 'recurrence_pattern': 'daily'}),
+    ('events.add_task', 'POST', '/api/add_task', {'name': 'Call bank', 'due_date': str(TODAY)}),
+    ('events.get_events', 'GET', '/api/get_events', None),
+    ('events.get_events', 'GET', '/api/get_events?include_archived=true', None),
+    ('events.get_calendar', 'GET', f'/api/calendar?{WINDOW}', None),
+    ('events.get_calendar', 'GET', f'/api/calendar?{WINDOW}&include_archived=true', None),
+    ('events.get_freebusy', 'GET', f'/api/freebusy?{WINDOW}', None),
+    ('events.check_freebusy', 'GET', f'/api/freebusy/check?start={TODAY}T09:00&end={TODAY}T10:00', None),
+    ('events.get_free_slots', 'GET', f'/api/freebusy/slots?{WINDOW}&minutes=60', None),
+    ('events.get_tasks', 'GET', '/api/get_tasks', None),
+    ('events.get_tasks', 'GET', '/api/get_tasks?include_archived=true', None),
+    ('items.batch', 'POST', '/api/items/batch', _batch),
+    ('dashboard.get_dashboard', 'GET', '/api/dashboard', None),
+    ('reports.get_goals', 'GET', '/api/get_goals', None),
+    ('reports.category_totals', 'GET', '/api/reports/category_totals', None),
+    ('reports.top_categories', 'GET', '/api/reports/top_categories?n=3', None),
+    ('reports.income_expense', 'GET', '/api/reports/income_expense', None),
+    ('reports.budget_vs_actual', 'GET', '/api/reports/budget_vs_actual', None),
+    ('settings.get_notification_settings', 'GET', '/api/get_notification_settings', None),
+    ('sync.sync', 'GET', '/api/sync?since=0', None),
+]
+
+
+@pytest.fixture(scope='module')
+def user(app, db):
+    username, = seed.seed(db, users=1, years=1, password=PASSWORD, prefix='budget')
+    return str(db.users.find_one({'username': username})['_id']), username
+
+
+@pytest.fixture
+def client(app, user):
+    client = app.test_client()
+    response = client.post('/login', data={'username': user[1], 'password': PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def measure(monkeypatch):
+    """Runs one request with cold caches; returns (response, the request's counts)."""
+    monkeypatch.setattr(query_budget, 'QUERY_BUDGET_MODE', 'raise')
+
+    def measure(client, method, path, user_id=None, **kwargs):
+        cache.backend.clear()
+        events._busy_indexes.clear()
+        if user_id:
+            models.User.invalidate(user_id)
+        with query_budget.recording() as log:
+            response = client.open(path, method=method, **kwargs)
+        assert len(log) == 1
+        return response, log[0]
+
+    return measure
+
+
+def _budgeted_endpoints(app):
+    with app.app_context():
+        return {endpoint for endpoint in app.view_functions if query_budget._budget_for(endpoint)}
+
+
+def test_every_budgeted_endpoint_is_measured(app):
+    measured = {endpoint for endpoint, _, _, _ in REQUESTS} | {'auth.login', 'auth.register'}
+    assert _budgeted_endpoints(app) == measured
+
+
+@pytest.mark.parametrize('endpoint, method, path, body', REQUESTS, ids=[request[2] for request in REQUESTS])
+def test_within_budget(client, db, user, measure, endpoint, method, path, body):
+    if callable(body):
+        body = body(db, user[0])
+    response, counts = measure(client, method, path, user[0], json=body)
+    assert response.status_code < 400, response.get_data(as_text=True)
+    assert counts['endpoint'] == endpoint
+    assert counts['commands'] <= counts['budget']['commands']
+
+
+def test_login_within_budget(app, user, measure):
+    response, counts = measure(app.test_client(), 'POST', '/login',
+                               data={'username': user[1], 'password': PASSWORD})
+    assert response.status_code == 302
+    assert counts['commands'] <= counts['budget']['commands']
+
+
+def test_register_within_budget(app, measure):
+    response, counts = measure(app.test_client(), 'POST', '/register', data={
+        'username': 'budget-new', 'email': 'budget-new@example.com',
+        'password': PASSWORD, 'confirm-password': PASSWORD
+    })
+    assert response.status_code == 302
+    assert counts['commands'] <= counts['budget']['commands']
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import recurrence
+
+
+def _starts(start, end, pattern, window_start, window_end):
+    return [occurrence for occurrence, _ in recurrence.iter_occurrences(start, end, pattern, window_start, window_end)]
+
+
+def test_daily_jumps_to_the_window():
+    start = datetime(2020, 1, 1, 9)
+    starts = _starts(start, start + timedelta(hours=1), 'daily', datetime(2024, 3, 1), datetime(2024, 3, 4))
+    assert starts == [datetime(2024, 3, 1, 9), datetime(2024, 3, 2, 9), datetime(2024, 3, 3, 9)]
+
+
+def test_an_occurrence_running_into_the_window_is_included():
+    start = datetime(2024, 1, 1, 22)
+    occurrences = list(recurrence.iter_occurrences(start, start + timedelta(hours=4), 'weekly',
+                                                   datetime(2024, 1, 9), datetime(2024, 1, 10)))
+    assert occurrences == [(datetime(2024, 1, 8, 22), datetime(2024, 1, 9, 2))]
+
+
+def test_monthly_clamps_without_drifting():
+    starts = _starts(datetime(2024, 1, 31), None, 'monthly', datetime(2024, 1, 1), datetime(2024, 6, 1))
+    assert [start.day for start in starts] == [31, 29, 31, 30, 31]
+
+
+def test_yearly_on_a_leap_day():
+    starts = _starts(datetime(2020, 2, 29), None, 'yearly', datetime(2021, 1, 1), datetime(2025, 1, 1))
+    assert starts == [datetime(2021, 2, 28), datetime(2022, 2, 28), datetime(2023, 2, 28), datetime(2024, 2, 29)]
+
+
+@pytest.mark.parametrize('pattern', [None, 'fortnightly'])
+def test_single_events_only_overlap_once(pattern):
+    start = datetime(2024, 5, 1, 10)
+    assert _starts(start, None, pattern, datetime(2024, 5, 1), datetime(2024, 5, 2)) == [start]
+    assert _starts(start, None, pattern, datetime(2024, 5, 2), datetime(2024, 5, 3)) == []
+
+
+def test_next_occurrence():
+    start = datetime(2024, 1, 1, 8)
+    assert recurrence.next_occurrence(start, 'weekly', datetime(2024, 1, 2)) == datetime(2024, 1, 8, 8)
+    assert recurrence.next_occurrence(start, 'weekly', datetime(2024, 1, 8, 8)) == datetime(2024, 1, 8, 8)
+    assert recurrence.next_occurrence(start, None, datetime(2024, 1, 2)) is None
+
+
+def test_calendar_expands_series_that_began_before_the_window(login):
+    client, _ = login()
+    client.post('/api/add_event', json={'title': 'Standup', 'start': '2024-01-01T09:00', 'end': '2024-01-01T09:15',
+                                        'recurring': True, 'recurrence_pattern': 'daily'})
+    client.post('/api/add_event', json={'title': 'Review', 'start': '2024-03-02T14:00'})
+    client.post('/api/add_event', json={'title': 'Offsite', 'start': '2024-02-28T09:00', 'end': '2024-03-02T17:00'})
+
+    calendar = client.get('/api/calendar?from=2024-03-01&to=2024-03-02').get_json()
+
+    assert [(entry['title'], entry['start']) for entry in calendar] == [
+        ('Offsite', '2024-02-28T09:00:00'),
+        ('Standup', '2024-03-01T09:00:00'),
+        ('Standup', '2024-03-02T09:00:00'),
+        ('Review', '2024-03-02T14:00:00'),
+    ]
+    assert client.get('/api/calendar?from=2024-01-01&to=2025-06-01').status_code == 400
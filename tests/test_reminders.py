@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+import uuid
+
+import pytest
+
+from models import User
+import reminders
+
+# Far from the seeded data, which is around today
+NOW = datetime(2031, 5, 10, 8, 0)
+
+
+class RecordingSender:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.messages = []
+
+    def send(self, messages):
+        if self.fail:
+            raise OSError('SMTP server unavailable')
+        self.messages.extend(messages)
+
+    def to(self, email):
+        return [message for message in self.messages if message['To'] == email]
+
+
+@pytest.fixture
+def user(db):
+    username = f'reminder-{uuid.uuid4().hex[:8]}'
+    user_id = User.create_user(db, username, f'{username}@example.com', 'secret')
+    return user_id, f'{username}@example.com'
+
+
+@pytest.fixture
+def task(db, user):
+    # Due tomorrow, reminded on the day at the user's 09:00
+    due = NOW.replace(hour=0) + timedelta(days=1)
+    db.tasks.insert_one({'user_id': user[0], 'name': 'Renew passport', 'due_date': due, 'completed': False})
+    return due.replace(hour=9)
+
+
+def _run(scheduler, now):
+    scheduler.scan(now)
+    return scheduler.deliver(scheduler.due(now))
+
+
+def test_overlapping_schedulers_send_once(user, task):
+    first, second = RecordingSender(), RecordingSender()
+    for sender in (first, second):
+        _run(reminders.ReminderScheduler(sender, now=task - timedelta(hours=1)), task)
+    assert len(first.to(user[1]) + second.to(user[1])) == 1
+
+
+def test_a_restarted_scheduler_does_not_send_again(user, task):
+    sender = RecordingSender()
+    scheduler = reminders.ReminderScheduler(sender, now=task - timedelta(minutes=30))
+    _run(scheduler, task)
+    # Its catch-up window covers the reminder already sent
+    restarted = reminders.ReminderScheduler(sender, now=task + timedelta(minutes=5))
+    _run(restarted, task + timedelta(minutes=5))
+    assert len(sender.to(user[1])) == 1
+
+
+def test_a_failed_send_is_retried_once(db, user, task):
+    sender = RecordingSender(fail=True)
+    scheduler = reminders.ReminderScheduler(sender, now=task - timedelta(minutes=30))
+    _run(scheduler, task)
+    assert sender.to(user[1]) == []
+    # The claim is released so the retry is not taken for a duplicate
+    assert db[reminders.LOG_COLLECTION].count_documents({'user_id': user[0]}) == 0
+
+    sender.fail = False
+    # Failed reminders go back on the heap RETRY_DELAY from the real clock
+    retry_at = datetime.now() + reminders.RETRY_DELAY + timedelta(seconds=1)
+    scheduler.deliver(scheduler.due(retry_at))
+    scheduler.deliver(scheduler.due(retry_at))
+    assert len(sender.to(user[1])) == 1
+
+
+def test_settings_changed_after_loading_are_honoured(db, user, task):
+    sender = RecordingSender()
+    scheduler = reminders.ReminderScheduler(sender, now=task - timedelta(minutes=30))
+    scheduler.scan(task)
+    assert [reminder['user_id'] for _, _, reminder in scheduler.heap].count(user[0]) == 1
+    db.users.update_one({'email': user[1]}, {'$set': {'notification_settings.events': False}})
+    scheduler.deliver(scheduler.due(task))
+    assert sender.to(user[1]) == []
+
+
+def test_each_occurrence_of_a_recurring_event_is_sent(db, user):
+    start = datetime(2031, 5, 1, 10)
+    db.events.insert_one({'user_id': user[0], 'title': 'Standup', 'start': start, 'end': start + timedelta(minutes=15),
+                          'recurring': True, 'recurrence_pattern': 'daily', 'next_occurrence': None})
+    sender = RecordingSender()
+    fire_at = NOW.replace(hour=10) - timedelta(minutes=reminders.EVENT_REMINDER_MINUTES)
+    scheduler = reminders.ReminderScheduler(sender, now=fire_at - timedelta(minutes=1))
+    _run(scheduler, fire_at)
+    _run(scheduler, fire_at)
+    _run(scheduler, fire_at + timedelta(days=1))
+    subjects = [message['Subject'] for message in sender.to(user[1])]
+    assert subjects == ["Event 'Standup' starts 2031-05-10 10:00", "Event 'Standup' starts 2031-05-11 10:00"]
@@ -0,0 +1,80 @@
+from collections import defaultdict
+
+import pytest
+
+import rollups
+from database import db
+
+
+def _raw_totals(user_id):
+    """{(kind, month, category): (total, count)} summed straight from the transactions."""
+    totals = defaultdict(lambda: [0, 0])
+    for kind, (collection, category_field) in rollups.ROLLUP_SOURCES.items():
+        for doc in db[collection].find({'user_id': user_id}):
+            entry = totals[(kind, rollups.month_key(doc['date']), doc[category_field])]
+            entry[0] += doc['amount']
+            entry[1] += 1
+    return {key: tuple(value) for key, value in totals.items()}
+
+
+def _stored_totals(user_id):
+    return {
+        (doc['kind'], doc['month'], doc['category']): (doc['total'], doc['count'])
+        for doc in db[rollups.ROLLUP_COLLECTION].find({'user_id': user_id, 'count': {'$gt': 0}})
+    }
+
+
+def _batch(client, *operations):
+    response = client.post('/api/items/batch', json={'operations': list(operations)})
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+
+def test_rollups_follow_every_kind_of_write(login):
+    client, user_id = login()
+    for amount, source, date in [(100, 'Salary', '2024-01-31'), (40, 'Gift', '2024-02-01'), (60, 'Salary', '2024-02-15')]:
+        assert client.post('/api/add_income', json={'amount': amount, 'source': source, 'date': date}).status_code == 200
+    for amount, category in [(12.5, 'Food'), (7.25, 'Food'), (30, 'Rent')]:
+        assert client.post('/api/add_expense', json={'amount': amount, 'category': category,
+                                                     'date': '2024-02-10'}).status_code == 200
+
+    gift = db.incomes.find_one({'user_id': user_id, 'source': 'Gift'})
+    rent = db.expenses.find_one({'user_id': user_id, 'category': 'Rent'})
+    food = db.expenses.find_one({'user_id': user_id, 'category': 'Food', 'amount': 12.5})
+    results = _batch(
+        client,
+        # Moves the gift to another month and category
+        {'op': 'update', 'type': 'incomes', 'id': str(gift['_id']),
+         'data': {'amount': 45, 'source': 'Bonus', 'date': '2024-03-05'}},
+        {'op': 'delete', 'type': 'expenses', 'id': str(rent['_id'])},
+        {'op': 'create', 'type': 'expenses', 'data': {'amount': 3, 'category': 'Food', 'date': '2024-03-01'}}
+    )
+    assert [result['status'] for result in results] == ['updated', 'deleted', 'created']
+    assert client.delete(f"/api/delete_item/expenses/{food['_id']}").status_code == 200
+
+    assert _stored_totals(user_id) == pytest.approx(_raw_totals(user_id))
+    assert rollups.summary_totals(user_id) == pytest.approx({'income': 205, 'expense': 10.25})
+    assert rollups.summary_totals(user_id, '2024-02', '2024-03') == pytest.approx({'income': 60, 'expense': 7.25})
+    assert rollups.category_totals(user_id, 'income') == pytest.approx([('Salary', 160), ('Bonus', 45)])
+    assert rollups.rebuild_rollups(user_id, repair=False) == []
+
+
+def test_rebuild_repairs_drift(login):
+    client, user_id = login()
+    client.post('/api/add_expense', json={'amount': 20, 'category': 'Fuel', 'date': '2024-05-02'})
+    db[rollups.ROLLUP_COLLECTION].update_one({'user_id': user_id}, {'$inc': {'total': 5}})
+
+    drift = rollups.rebuild_rollups(user_id)
+    assert [(entry['category'], entry['stored'], entry['expected']) for entry in drift] == [('Fuel', 25, 20)]
+    assert rollups.rebuild_rollups(user_id, repair=False) == []
+
+
+def test_backfill_builds_missing_rollups_once(login):
+    client, user_id = login()
+    client.post('/api/add_income', json={'amount': 80, 'source': 'Salary', 'date': '2024-06-01'})
+    expected = _stored_totals(user_id)
+    db[rollups.ROLLUP_COLLECTION].delete_many({})
+
+    assert rollups.backfill() is True
+    assert _stored_totals(user_id) == expected
+    assert rollups.backfill() is False
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from werkzeug.http import http_date
+
+from serialization import Schema, ID, DATE, HTTP_DATE, Default
+
+
+def test_http_date_matches_flask(db):
+    created = [datetime(2031, 5, 4, 8, 3, 9, 123456), datetime(2024, 2, 29, 23, 59, 59), datetime(2025, 12, 1)]
+    db.schema_dates.insert_many([{'created_at': value} for value in created] + [{'created_at': None}])
+    schema = Schema(_id=ID, created_at=HTTP_DATE, fallback=Default('never', HTTP_DATE))
+    documents = schema.find(db.schema_dates, {}, sort=[('_id', 1)])
+    assert [document['created_at'] for document in documents] == [http_date(value) for value in created] + [None]
+    assert documents[0]['fallback'] == 'never'
+
+
+def test_budgets_and_goals_keep_http_dates(db, login):
+    client, user_id = login()
+    client.post('/api/add_budget', json={'category': 'Food', 'amount': 300, 'month': '2031-05'})
+    client.post('/api/add_goal', json={'name': 'Car', 'target_amount': 5000, 'target_date': '2032-01-01'})
+    for path, collection in [('/api/get_budgets', db.budgets), ('/api/get_goals', db.goals)]:
+        stored = collection.find_one({'user_id': user_id})
+        document, = client.get(path).get_json()
+        assert document['created_at'] == http_date(stored['created_at'])
+    assert document['target_date'] == datetime(2032, 1, 1).strftime(DATE)
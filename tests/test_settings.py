@@ -0,0 +1,17 @@
+import database
+
+
+def test_update_profile_rejects_a_taken_username_or_email(login, db):
+    for keys, options in database.INDEXES['users']:
+        db.users.create_index(keys, **options)
+    client, _ = login('profile-a')
+    login('profile-b')
+
+    for change in ({'username': 'profile-b'}, {'email': 'profile-b@example.com'}):
+        response = client.post('/api/update_profile', json=change)
+        assert response.status_code == 400
+        assert response.get_json() == {'status': 'error', 'message': 'Username or email already exists'}
+
+    response = client.post('/api/update_profile', json={'username': 'profile-c'})
+    assert response.status_code == 200
+    assert db.users.find_one({'username': 'profile-c'})['email'] == 'profile-a@example.com'
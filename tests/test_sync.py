@@ -0,0 +1,144 @@
+import pytest
+
+import changelog
+import items
+
+
+def _version(client):
+    return client.get('/api/sync?since=0').get_json()['version']
+
+
+def _changes(client, since, limit=500):
+    return client.get(f'/api/sync?since={since}&limit={limit}').get_json()
+
+
+def _replay(client, *writes):
+    return client.post('/api/sync/batch', json={'writes': [
+        dict(write, id=write.get('id', str(index))) for index, write in enumerate(writes)
+    ]})
+
+
+def _ids(documents):
+    return sorted(document['_id'] for document in documents)
+
+
+def test_changes_are_collapsed_per_document(login):
+    client, user_id = login()
+    kept = items.create('incomes', {'amount': 10, 'source': 'Gift', 'date': '2024-03-01'}, user_id)
+    dropped = items.create('expenses', {'amount': 5, 'category': 'Food', 'date': '2024-03-01'}, user_id)
+    since = _version(client)
+
+    added = items.create('incomes', {'amount': 20, 'source': 'Salary', 'date': '2024-03-02'}, user_id)
+    items.update('incomes', user_id, str(added['_id']), {'amount': 25})
+    gone = items.create('expenses', {'amount': 7, 'category': 'Fuel', 'date': '2024-03-02'}, user_id)
+    items.delete('expenses', user_id, str(gone['_id']))
+    items.update('incomes', user_id, str(kept['_id']), {'amount': 11})
+    items.update('incomes', user_id, str(kept['_id']), {'amount': 12})
+    items.delete('expenses', user_id, str(dropped['_id']))
+
+    data = _changes(client, since)
+    assert not data['full'] and not data['more']
+    incomes, expenses = data['changes']['incomes'], data['changes']['expenses']
+    assert [(document['_id'], document['amount']) for document in incomes['inserted']] == [(str(added['_id']), 25)]
+    assert [(document['_id'], document['amount']) for document in incomes['updated']] == [(str(kept['_id']), 12)]
+    assert expenses == {'inserted': [], 'updated': [], 'deleted': [str(dropped['_id'])]}
+    assert _changes(client, data['version'])['changes'] == {}
+
+
+def test_changes_come_in_pages(login):
+    client, user_id = login()
+    since = _version(client)
+    created = [items.create('tasks', {'name': f'Task {n}', 'due_date': '2024-03-01'}, user_id) for n in range(5)]
+
+    seen, version, more = [], since, True
+    while more:
+        data = _changes(client, version, limit=2)
+        assert len(data['changes'].get('tasks', {}).get('inserted', [])) <= 2
+        seen += data['changes'].get('tasks', {}).get('inserted', [])
+        version, more = data['version'], data['more']
+    assert _ids(seen) == _ids([{'_id': str(task['_id'])} for task in created])
+
+
+def test_a_reset_sends_everything(login):
+    client, user_id = login()
+    since = _version(client)
+    items.create('goals', {'name': 'Car', 'target_amount': 5000}, user_id)
+    changelog.record_reset(user_id)
+    data = _changes(client, since)
+    assert data['full']
+    assert len(data['changes']['goals']['inserted']) == 1
+
+
+def test_batch_applies_item_writes_once(db, login):
+    client, user_id = login()
+    task = items.create('tasks', {'name': 'Call bank', 'due_date': '2024-03-01'}, user_id)
+    expense = items.create('expenses', {'amount': 5, 'category': 'Food', 'date': '2024-03-01'}, user_id)
+    writes = [
+        {'id': 'a', 'method': 'POST', 'path': '/api/add_income',
+         'body': {'amount': 100, 'source': 'Salary', 'date': '2024-03-01'}},
+        {'id': 'b', 'method': 'PUT', 'path': f"/api/update_task/{task['_id']}", 'body': {'completed': True}},
+        {'id': 'c', 'method': 'DELETE', 'path': f"/api/delete_item/expenses/{expense['_id']}", 'body': None},
+        {'id': 'd', 'method': 'POST', 'path': '/api/add_event',
+         'body': {'title': 'Dentist', 'start': '2024-03-01T10:00'}}
+    ]
+    first = _replay(client, *writes)
+    assert first.status_code == 200
+    assert [result['status'] for result in first.get_json()['results']] == [200, 200, 200, 200]
+
+    # A retried batch (say the response was lost) gets the same results and changes nothing
+    assert _replay(client, *writes).get_json() == first.get_json()
+    assert db.incomes.count_documents({'user_id': user_id}) == 1
+    assert db.events.count_documents({'user_id': user_id}) == 1
+    assert db.tasks.find_one({'_id': task['_id']})['completed'] is True
+    assert db.expenses.count_documents({'user_id': user_id}) == 0
+
+
+def test_each_write_is_recorded_as_it_is_applied(db, login, monkeypatch):
+    client, user_id = login()
+    task = items.create('tasks', {'name': 'Call bank', 'due_date': '2024-03-01'}, user_id)
+    writes = [
+        {'id': 'a', 'method': 'POST', 'path': '/api/add_income',
+         'body': {'amount': 100, 'source': 'Salary', 'date': '2024-03-01'}},
+        {'id': 'b', 'method': 'PUT', 'path': f"/api/update_task/{task['_id']}", 'body': {'completed': True}}
+    ]
+    update = items.update
+
+    def unavailable(*args):
+        raise RuntimeError('connection reset')
+
+    monkeypatch.setattr(items, 'update', unavailable)
+    assert _replay(client, *writes).status_code == 500
+    monkeypatch.setattr(items, 'update', update)
+
+    results = _replay(client, *writes).get_json()['results']
+    assert [result['status'] for result in results] == [200, 200]
+    assert db.incomes.count_documents({'user_id': user_id}) == 1
+    assert db.tasks.find_one({'_id': task['_id']})['completed'] is True
+
+
+@pytest.mark.parametrize('write, status', [
+    ({'method': 'POST', 'path': '/api/update_profile', 'body': {'username': 'someone-else'}}, 400),
+    ({'method': 'GET', 'path': '/api/get_incomes', 'body': None}, 400),
+    ({'method': 'POST', 'path': '/api/add_income', 'body': {'source': 'Salary'}}, 400),
+    ({'method': 'POST', 'path': '/api/add_income', 'body': ['not', 'an', 'object']}, 400),
+    ({'method': 'DELETE', 'path': '/api/delete_item/nothing/0123456789ab0123456789ab', 'body': None}, 400),
+    ({'method': 'DELETE', 'path': '/api/delete_item/tasks/0123456789ab0123456789ab', 'body': None}, 404),
+])
+def test_writes_that_are_rejected(db, login, write, status):
+    client, user_id = login()
+    result, = _replay(client, write).get_json()['results']
+    assert result['status'] == status
+    assert result['body']['status'] == 'error'
+    assert db.incomes.count_documents({'user_id': user_id}) == 0
+    assert db.users.count_documents({'username': 'someone-else'}) == 0
+
+
+def test_a_conflicting_event_is_rejected_when_asked(db, login):
+    client, user_id = login()
+    items.create('events', {'title': 'Standup', 'start': '2024-03-01T09:00', 'end': '2024-03-01T10:00'}, user_id)
+    result, = _replay(client, {'method': 'POST', 'path': '/api/add_event', 'body': {
+        'title': 'Dentist', 'start': '2024-03-01T09:30', 'end': '2024-03-01T10:30', 'on_conflict': 'reject'
+    }}).get_json()['results']
+    assert result['status'] == 409
+    assert len(result['body']['conflicts']) == 1
+    assert db.events.count_documents({'user_id': user_id}) == 1
@@ -0,0 +1,147 @@
+from datetime import datetime
+import uuid
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+import transactions
+
+
+class FailingBuckets:
+    """The bucket collection, failing the bulk_write requests that match `fails`."""
+
+    def __init__(self, collection, fails):
+        self.collection = collection
+        self.fails = fails
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, requests, ordered=True):
+        failing = [index for index, request in enumerate(requests) if self.fails(request._doc)]
+        passing = [request for index, request in enumerate(requests) if index not in failing]
+        if passing:
+            self.collection.bulk_write(passing, ordered=ordered)
+        if failing:
+            raise BulkWriteError({'writeErrors': [{'index': index, 'code': 2, 'errmsg': 'injected failure'}
+                                                  for index in failing]})
+
+
+@pytest.fixture
+def incomes(db):
+    view = transactions.BucketedCollection('incomes')
+    view.user_id = f'user-{uuid.uuid4().hex[:8]}'
+    return view
+
+
+def _income(user_id, day, amount=10):
+    return {'_id': ObjectId(), 'user_id': user_id, 'amount': amount, 'source': 'Salary', 'date': day,
+            'description': ''}
+
+
+def _buckets(view):
+    return list(view.buckets.find({'user_id': view.user_id, 'kind': view.kind}).sort('month', 1))
+
+
+def _fail_on(monkeypatch, view, fails):
+    buckets = FailingBuckets(view.buckets, fails)
+    monkeypatch.setattr(transactions.BucketedCollection, 'buckets', property(lambda self: buckets))
+
+
+def _is_push(update):
+    return '$push' in update
+
+
+def _is_pull(update):
+    return '$pull' in update
+
+
+def test_buckets_hold_at_most_bucket_size(monkeypatch, incomes):
+    monkeypatch.setattr(transactions, 'BUCKET_SIZE', 3)
+    incomes.insert_many([_income(incomes.user_id, datetime(2024, 3, day)) for day in range(1, 6)])
+    for day in range(6, 9):
+        incomes.insert_one(_income(incomes.user_id, datetime(2024, 3, day)))
+    # One write of four creates fills the bucket with room and starts another
+    incomes.write(incomes.user_id, [('create', doc['_id'], doc) for doc in
+                                    [_income(incomes.user_id, datetime(2024, 3, day)) for day in range(9, 13)]], {})
+
+    assert all(bucket['count'] <= 3 for bucket in _buckets(incomes))
+    assert sum(bucket['count'] for bucket in _buckets(incomes)) == 12
+    assert len(list(incomes.find({'user_id': incomes.user_id}))) == 12
+    assert transactions.verify(incomes.user_id) == []
+
+
+def test_a_month_move_changes_bucket(incomes):
+    kept = _income(incomes.user_id, datetime(2024, 3, 1), 5)
+    moved = _income(incomes.user_id, datetime(2024, 3, 2), 10)
+    incomes.insert_many([kept, moved])
+
+    old = incomes.find_one_and_update({'_id': moved['_id']}, {'$set': {'date': datetime(2024, 4, 2), 'amount': 12}})
+    assert old['date'] == datetime(2024, 3, 2)
+    assert [(bucket['month'], bucket['count'], bucket['total_minor']) for bucket in _buckets(incomes)] == [
+        ('2024-03', 1, 500), ('2024-04', 1, 1200)]
+
+    # The emptied bucket goes
+    incomes.find_one_and_update({'_id': kept['_id']}, {'$set': {'date': datetime(2024, 4, 1)}})
+    assert [(bucket['month'], bucket['count'], bucket['total_minor']) for bucket in _buckets(incomes)] == [
+        ('2024-04', 2, 1700)]
+    assert transactions.verify(incomes.user_id) == []
+
+
+def test_a_failed_push_leaves_the_transaction_where_it_was(monkeypatch, incomes):
+    doc = _income(incomes.user_id, datetime(2024, 3, 2))
+    incomes.insert_one(doc)
+    _fail_on(monkeypatch, incomes, _is_push)
+
+    failed = incomes.write(incomes.user_id, [('update', doc['_id'], {'date': datetime(2024, 4, 2)})],
+                           {doc['_id']: doc})
+    assert failed == {0: 'injected failure'}
+    assert [(bucket['month'], bucket['count']) for bucket in _buckets(incomes)] == [('2024-03', 1)]
+    assert incomes.find_one({'_id': doc['_id']})['date'] == datetime(2024, 3, 2)
+
+
+def test_a_failed_pull_takes_the_new_copy_back_out(monkeypatch, incomes):
+    doc = _income(incomes.user_id, datetime(2024, 3, 2))
+    incomes.insert_one(doc)
+    calls = []
+
+    def fails(update):
+        calls.append(update)
+        # Only the first pull, from the old month, fails
+        return _is_pull(update) and len([call for call in calls if _is_pull(call)]) == 1
+
+    _fail_on(monkeypatch, incomes, fails)
+    failed = incomes.write(incomes.user_id, [('update', doc['_id'], {'date': datetime(2024, 4, 2)})],
+                           {doc['_id']: doc})
+    assert failed == {0: 'injected failure'}
+    assert [(bucket['month'], bucket['count']) for bucket in _buckets(incomes)] == [('2024-03', 1)]
+    assert [found['date'] for found in incomes.find({'user_id': incomes.user_id})] == [datetime(2024, 3, 2)]
+
+
+def test_other_writes_in_the_batch_are_unaffected_by_a_failed_move(monkeypatch, incomes):
+    moved, updated = _income(incomes.user_id, datetime(2024, 3, 2)), _income(incomes.user_id, datetime(2024, 3, 3))
+    incomes.insert_many([moved, updated])
+    _fail_on(monkeypatch, incomes, _is_push)
+
+    failed = incomes.write(incomes.user_id, [
+        ('update', moved['_id'], {'date': datetime(2024, 5, 1)}),
+        ('update', updated['_id'], {'amount': 30})
+    ], {moved['_id']: moved, updated['_id']: updated})
+    assert set(failed) == {0}
+    assert incomes.find_one({'_id': updated['_id']})['amount'] == 30
+
+
+def test_failed_single_writes_raise(monkeypatch, incomes):
+    doc = _income(incomes.user_id, datetime(2024, 3, 2))
+    incomes.insert_one(doc)
+    assert incomes.find_one_and_update({'_id': ObjectId()}, {'$set': {'amount': 1}}) is None
+    assert incomes.find_one_and_delete({'_id': ObjectId()}) is None
+
+    _fail_on(monkeypatch, incomes, lambda update: True)
+    with pytest.raises(BulkWriteError):
+        incomes.find_one_and_update({'_id': doc['_id']}, {'$set': {'amount': 1}})
+    with pytest.raises(BulkWriteError):
+        incomes.find_one_and_delete({'_id': doc['_id']})
+    with pytest.raises(BulkWriteError):
+        incomes.insert_one(_income(incomes.user_id, datetime(2024, 3, 3)))
@@ -0,0 +1,397 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import os
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.results import InsertOneResult, InsertManyResult
+from database import db, ARCHIVE_PREFIX
+
+# Transaction storage
+# Incomes and expenses are stored one document per transaction by default.
+# With TRANSACTION_STORAGE=buckets they are stored in monthly bucket documents
+# instead, one per (user, kind, month) holding up to BUCKET_SIZE transactions:
+#
+#   {user_id, kind, month: 'YYYY-MM', count, total_minor,
+#    items: [{_id, amount_minor, date, source|category, description}, ...]}
+#
+# Amounts are integer minor units (cents) and user_id is stored once per
+# bucket. created_at is not stored either: it is the creation time of the
+# item's ObjectId in server local time, like every other timestamp, unless an
+# imported or migrated value differs from it. Each bucket records the UTC
+# offset (utc_offset, in ms) of its items, so a change to daylight saving time
+# starts a new bucket.
+# A month's transactions are one document to read and its count and total are
+# kept on the bucket by every write.
+#
+# collection() hands out db.incomes / db.expenses, or in bucket mode a view that
+# answers the collection methods the app uses (find, aggregate, insert,
+# find_one_and_update/delete, delete_many, update_many) with documents shaped
+# like the per-transaction ones, so readers do not need to know which storage
+# is in use.
+#
+# Switching over: run `flask migrate-transactions` (copies the documents into
+# buckets and verifies them; safe to repeat), set TRANSACTION_STORAGE=buckets,
+# then `flask migrate-transactions --drop-source` to remove the old documents.
+# Archived transactions (see archive.py) are migrated the same way, into
+# archived_transaction_buckets.
+#
+# Imports tag what they write with import_job until they have finished (see
+# importer.py). Tagged transactions go to buckets of their own carrying the tag,
+# so delete_many and update_many can select them, or everything else, by it.
+
+TRANSACTION_STORAGE = os.environ.get('TRANSACTION_STORAGE', 'documents').lower()
+BUCKET_COLLECTION = 'transaction_buckets'
+BUCKET_SIZE = int(os.environ.get('TRANSACTION_BUCKET_SIZE', 1000))
+MINOR_UNITS = 100
+
+# collection -> (kind, fields kept on each bucket item besides _id and the amount)
+BUCKETED_COLLECTIONS = {
+    'incomes': ('income', ['source', 'date', 'description']),
+    'expenses': ('expense', ['category', 'date', 'description'])
+}
+
+MIGRATION_BATCH_SIZE = 5000
+
+
+def to_minor(amount):
+    return int(round(amount * MINOR_UNITS))
+
+
+def _month(value):
+    return value.strftime('%Y-%m')
+
+
+def _utc_offset(item_id):
+    """The server's UTC offset when the ObjectId was generated, in milliseconds."""
+    return int(item_id.generation_time.astimezone().utcoffset().total_seconds() * 1000)
+
+
+def _object_id_time(item_id):
+    """When the ObjectId was generated, in server local time."""
+    return item_id.generation_time.astimezone().replace(tzinfo=None)
+
+
+def is_bucketed(collection):
+    return TRANSACTION_STORAGE == 'buckets' and collection in BUCKETED_COLLECTIONS
+
+
+def collection(name):
+    """The collection to read and write `name` through for the configured storage."""
+    return BucketedCollection(name) if is_bucketed(name) else db[name]
+
+
+class BucketedCollection:
+    """Incomes or expenses stored in monthly buckets, seen as one document per transaction."""
+
+    def __init__(self, name, bucket_collection=BUCKET_COLLECTION):
+        self.name = name
+        self.bucket_collection = bucket_collection
+        self.kind, self.fields = BUCKETED_COLLECTIONS[name]
+
+    @property
+    def buckets(self):
+        return db[self.bucket_collection]
+
+    # Reading
+
+    def _bucket_match(self, query):
+        """The part of a transaction query that can be answered on the buckets themselves."""
+        match = {'kind': self.kind}
+        if 'user_id' in query:
+            match['user_id'] = query['user_id']
+        if '_id' in query:
+            match['items._id'] = query['_id']
+
+        date = query.get('date')
+        if isinstance(date, datetime):
+            match['month'] = _month(date)
+        elif isinstance(date, dict):
+            months = {}
+            for op in ('$gte', '$gt'):
+                if isinstance(date.get(op), datetime):
+                    months['$gte'] = _month(date[op])
+            if isinstance(date.get('$lte'), datetime):
+                months['$lte'] = _month(date['$lte'])
+            if isinstance(date.get('$lt'), datetime):
+                months['$lte'] = _month(date['$lt'] - timedelta(microseconds=1))
+            if months:
+                match['month'] = months
+        return match
+
+    def stages(self, query):
+        """Stages turning the matching buckets into the matching transaction documents."""
+        document = {'_id': '$items._id', 'user_id': '$user_id',
+                    'amount': {'$divide': ['$items.amount_minor', MINOR_UNITS]}}
+        document.update({field: f'$items.{field}' for field in self.fields})
+        # Buckets written before utc_offset was recorded compacted against UTC
+        document['created_at'] = {'$ifNull': ['$items.created_at', {
+            '$add': [{'$toDate': '$items._id'}, {'$ifNull': ['$utc_offset', 0]}]}]}
+        return [
+            {'$match': self._bucket_match(query)},
+            {'$unwind': '$items'},
+            {'$replaceRoot': {'newRoot': document}},
+            {'$match': query}
+        ]
+
+    def aggregate(self, pipeline, **kwargs):
+        # A leading $match is pushed down to the buckets as far as it can be
+        pipeline = list(pipeline)
+        query = pipeline.pop(0)['$match'] if pipeline and '$match' in pipeline[0] else {}
+        return self.buckets.aggregate(self.stages(query) + pipeline, **kwargs)
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, batch_size=None):
+        pipeline = [{'$match': filter or {}}]
+        if sort:
+            pipeline.append({'$sort': dict(sort)})
+        if limit:
+            pipeline.append({'$limit': limit})
+        if projection:
+            pipeline.append({'$project': projection})
+        return self.aggregate(pipeline, **({'batchSize': batch_size} if batch_size else {}))
+
+    def find_one(self, filter=None, projection=None):
+        return next(iter(self.find(filter, projection, limit=1)), None)
+
+    # Writing
+
+    def _item(self, doc):
+        item = {'_id': doc['_id'], 'amount_minor': to_minor(doc['amount'])}
+        for field in self.fields:
+            if field in doc:
+                item[field] = doc[field]
+        created_at = doc.get('created_at')
+        if created_at and (created_at.tzinfo or abs(created_at - _object_id_time(doc['_id'])) > timedelta(seconds=1)):
+            item['created_at'] = created_at
+        return item
+
+    def _pushes(self, user_id, docs):
+        """(upsert, positions in docs) appending docs to the user's buckets.
+
+        One upsert per month and UTC offset, and per BUCKET_SIZE items; each goes
+        to a bucket with room for all of its items, or starts a new one.
+        """
+        groups = defaultdict(list)
+        for position, doc in enumerate(docs):
+            groups[(_month(doc['date']), _utc_offset(doc['_id']), doc.get('import_job'))].append(position)
+        pushes = []
+        for (month, offset, import_job), positions in groups.items():
+            for start in range(0, len(positions), BUCKET_SIZE):
+                chunk = positions[start:start + BUCKET_SIZE]
+                items = [self._item(docs[position]) for position in chunk]
+                pushes.append((UpdateOne(
+                    {'user_id': user_id, 'kind': self.kind, 'month': month, 'utc_offset': offset,
+                     'import_job': import_job or {'$exists': False},
+                     'count': {'$lte': BUCKET_SIZE - len(items)}},
+                    {'$push': {'items': {'$each': items}},
+                     '$inc': {'count': len(items), 'total_minor': sum(item['amount_minor'] for item in items)}},
+                    upsert=True
+                ), chunk))
+        return pushes
+
+    def _push(self, user_id, docs):
+        return [request for request, _ in self._pushes(user_id, docs)]
+
+    def _pull(self, user_id, old):
+        # The month keeps it to the item's own bucket while a move has it in two
+        return UpdateOne(
+            {'user_id': user_id, 'kind': self.kind, 'month': _month(old['date']), 'items._id': old['_id']},
+            {'$pull': {'items': {'_id': old['_id']}},
+             '$inc': {'count': -1, 'total_minor': -to_minor(old['amount'])}}
+        )
+
+    def _set(self, user_id, old, fields):
+        update = {'$set': {f'items.$.{field}': fields[field] for field in self.fields if field in fields}}
+        if 'amount' in fields:
+            update['$set']['items.$.amount_minor'] = to_minor(fields['amount'])
+            update['$inc'] = {'total_minor': to_minor(fields['amount']) - to_minor(old['amount'])}
+        return UpdateOne({'user_id': user_id, 'kind': self.kind, 'items._id': old['_id']}, update)
+
+    def _bulk_write(self, requests, owners):
+        """Run requests unordered; returns {position in writes: error message} for those that failed."""
+        failed = {}
+        if requests:
+            try:
+                self.buckets.bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get('writeErrors', []):
+                    for position in owners[error['index']]:
+                        failed[position] = error.get('errmsg', 'Write failed')
+        return failed
+
+    def write(self, user_id, writes, existing):
+        """Apply (op, item_id, payload) writes in one unordered bulk_write, two if any changes month.
+
+        op is 'create' (payload is the new document), 'update' (payload is the
+        $set) or 'delete'; `existing` maps the updated and deleted ids to their
+        current documents. Returns {position in writes: error message}.
+
+        An update that changes the month is a push onto a bucket of the new
+        month, then a pull from the old one in a second bulk_write once the push
+        has succeeded, so a failure leaves the transaction where it was.
+        """
+        requests, owners, created, moves = [], [], [], []
+        for position, (op, item_id, payload) in enumerate(writes):
+            if op == 'create':
+                created.append((position, payload))
+                continue
+            old = existing[item_id]
+            if op == 'delete':
+                requests.append(self._pull(user_id, old))
+                owners.append([position])
+            elif 'date' in payload and _month(payload['date']) != _month(old['date']):
+                created.append((position, dict(old, **payload)))
+                moves.append((position, old))
+            else:
+                requests.append(self._set(user_id, old, payload))
+                owners.append([position])
+
+        for request, chunk in self._pushes(user_id, [doc for _, doc in created]):
+            requests.append(request)
+            owners.append([created[index][0] for index in chunk])
+
+        failed = self._bulk_write(requests, owners)
+        moves = [(position, old) for position, old in moves if position not in failed]
+        unmoved = self._bulk_write([self._pull(user_id, old) for _, old in moves],
+                                   [[position] for position, _ in moves])
+        if unmoved:
+            # Take the new copies back out rather than keep the transaction in two buckets
+            self.buckets.bulk_write([self._pull(user_id, dict(old, **writes[position][2]))
+                                     for position, old in moves if position in unmoved], ordered=False)
+            failed.update(unmoved)
+        if moves or any(op == 'delete' for op, _, _ in writes):
+            self.buckets.delete_many({'user_id': user_id, 'kind': self.kind, 'count': {'$lte': 0}})
+        return failed
+
+    @staticmethod
+    def _raise_failed(failed):
+        if failed:
+            raise BulkWriteError({'writeErrors': [{'index': 0, 'errmsg': failed[0]}]})
+
+    def insert_one(self, doc):
+        doc.setdefault('_id', ObjectId())
+        self._raise_failed(self.write(doc['user_id'], [('create', doc['_id'], doc)], {}))
+        return InsertOneResult(doc['_id'], True)
+
+    def insert_many(self, docs, ordered=True):
+        docs = list(docs)
+        by_user = defaultdict(list)
+        for doc in docs:
+            doc.setdefault('_id', ObjectId())
+            by_user[doc['user_id']].append(doc)
+        requests = [request for user_id, user_docs in by_user.items() for request in self._push(user_id, user_docs)]
+        if requests:
+            self.buckets.bulk_write(requests, ordered=ordered)
+        return InsertManyResult([doc['_id'] for doc in docs], True)
+
+    def find_one_and_update(self, filter, update):
+        """Apply a {'$set': ...} update to one transaction; returns the document before it.
+
+        Returns None if nothing matches; raises BulkWriteError if the write fails.
+        """
+        old = self.find_one(filter)
+        if old is not None:
+            self._raise_failed(self.write(old['user_id'], [('update', old['_id'], update['$set'])], {old['_id']: old}))
+        return old
+
+    def find_one_and_delete(self, filter):
+        old = self.find_one(filter)
+        if old is not None:
+            self._raise_failed(self.write(old['user_id'], [('delete', old['_id'], None)], {old['_id']: old}))
+        return old
+
+    def _user_filter(self, filter):
+        if set(filter) - {'user_id', 'import_job'}:
+            raise ValueError(f'Bucketed {self.name} can only be filtered on user_id and import_job here')
+        return dict(filter, kind=self.kind)
+
+    def delete_many(self, filter):
+        return self.buckets.delete_many(self._user_filter(filter))
+
+    def update_many(self, filter, update):
+        """Update whole buckets, which only hold user_id and import_job in common with their items."""
+        return self.buckets.update_many(self._user_filter(filter), update)
+
+
+# Migration
+
+def _user_query(user_id):
+    return {'user_id': user_id} if user_id else {}
+
+
+def _sources():
+    """(document collection, bucket view) pairs to migrate, archives included."""
+    for name in BUCKETED_COLLECTIONS:
+        yield name, BucketedCollection(name)
+        yield ARCHIVE_PREFIX + name, BucketedCollection(name, ARCHIVE_PREFIX + BUCKET_COLLECTION)
+
+
+def migrate(user_id=None):
+    """Copy incomes and expenses documents into buckets; returns {collection: copied}.
+
+    Transactions already in a bucket are skipped, so the migration can be run
+    again after an interruption or to pick up documents written meanwhile.
+    """
+    copied = {}
+    for name, view in _sources():
+        copied[name] = 0
+        cursor = db[name].find(_user_query(user_id)).sort([('user_id', 1), ('_id', 1)]).batch_size(MIGRATION_BATCH_SIZE)
+        batch, current_user, done = [], None, set()
+
+        def flush():
+            pending = [doc for doc in batch if doc['_id'] not in done]
+            if pending:
+                view.buckets.bulk_write(view._push(current_user, pending), ordered=True)
+                copied[name] += len(pending)
+            batch.clear()
+
+        for doc in cursor:
+            if doc['user_id'] != current_user:
+                flush()
+                current_user = doc['user_id']
+                done = set(view.buckets.distinct('items._id', {'user_id': current_user, 'kind': view.kind}))
+            batch.append(doc)
+            if len(batch) >= MIGRATION_BATCH_SIZE:
+                flush()
+        flush()
+    return copied
+
+
+def verify(user_id=None):
+    """Compare the buckets with the documents and with themselves; returns a list of problems.
+
+    Users without documents (never migrated, or already dropped) only get the
+    buckets' own consistency checked.
+    """
+    problems = []
+    for name, view in _sources():
+        expected = defaultdict(lambda: [0, 0])
+        for doc in db[name].find(_user_query(user_id), {'user_id': 1, 'date': 1, 'amount': 1}).batch_size(
+                MIGRATION_BATCH_SIZE):
+            entry = expected[(doc['user_id'], _month(doc['date']))]
+            entry[0] += 1
+            entry[1] += to_minor(doc['amount'])
+
+        stored = defaultdict(lambda: [0, 0])
+        for bucket in view.buckets.find(dict(_user_query(user_id), kind=view.kind)):
+            key = (bucket['user_id'], bucket['month'])
+            items = bucket.get('items', [])
+            if bucket['count'] != len(items) or bucket['total_minor'] != sum(item['amount_minor'] for item in items):
+                problems.append(f"{name} {key[0]} {key[1]}: bucket {bucket['_id']} count/total do not match its items")
+            if any(_month(item['date']) != bucket['month'] for item in items):
+                problems.append(f"{name} {key[0]} {key[1]}: bucket {bucket['_id']} holds items from another month")
+            stored[key][0] += len(items)
+            stored[key][1] += sum(item['amount_minor'] for item in items)
+
+        users = {user for user, _ in expected}
+        for key in sorted({key for key in set(expected) | set(stored) if key[0] in users}, key=str):
+            want, have = expected.get(key, (0, 0)), stored.get(key, (0, 0))
+            if tuple(want) != tuple(have):
+                problems.append(f'{name} {key[0]} {key[1]}: documents have {want[0]} totalling {want[1]}, '
+                                f'buckets {have[0]} totalling {have[1]} (minor units)')
+    return problems
+
+
+def drop_source(user_id=None):
+    """Delete the per-transaction documents once they live in buckets; returns {collection: deleted}."""
+    return {name: db[name].delete_many(_user_query(user_id)).deleted_count for name, _ in _sources()}
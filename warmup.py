@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+import database
+import importer
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Worker warmup
+# Run once in every worker after it has forked (see gunicorn.conf.py): opens
+# WARMUP_CONNECTIONS pooled connections to MongoDB, ensures the indexes and
+# compiles every Jinja template, so the first real requests do not pay for it.
+# It also fails the import jobs left behind by recycled workers (importer.py)
+# and builds the monthly rollups on the first boot after they were introduced.
+# /ready (routes/health.py) answers 503 until the warmup has finished.
+
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', os.environ.get('MONGO_MIN_POOL_SIZE') or 2))
+ENSURE_INDEXES = os.environ.get('ENSURE_INDEXES', 'true').lower() == 'true'
+
+_state = {'state': 'pending', 'pid': None, 'started': None, 'finished': None, 'steps': {}, 'error': None}
+_lock = threading.Lock()
+
+
+def _connect_pool():
+    client = database.get_client()
+    # Concurrent pings check out (and so open) that many connections at once
+    with ThreadPoolExecutor(max_workers=max(WARMUP_CONNECTIONS, 1), thread_name_prefix='warmup') as pool:
+        list(pool.map(lambda _: client.admin.command('ping'), range(max(WARMUP_CONNECTIONS, 1))))
+
+
+def _ensure_indexes():
+    if ENSURE_INDEXES:
+        database.ensure_indexes()
+
+
+def _compile_templates(app):
+    # get_template compiles and caches the template in the environment
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+
+def _steps(app):
+    return [
+        ('mongodb_pool', _connect_pool),
+        ('indexes', _ensure_indexes),
+        ('import_jobs', importer.clean_up_stale_jobs),
+        ('rollups', rollups.backfill),
+        ('templates', lambda: _compile_templates(app))
+    ]
+
+
+def warm_up(app):
+    """Run every warmup step in this process; returns the resulting status."""
+    with _lock:
+        if _state['pid'] == os.getpid() and _state['state'] in ('running', 'ready'):
+            return status()
+        # Start over in a forked child even if the parent had warmed up
+        _state.update(state='running', pid=os.getpid(), started=datetime.now(), finished=None, steps={}, error=None)
+
+    for name, step in _steps(app):
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.exception('Warmup step %s failed', name)
+            _state.update(state='failed', error=f'{name}: {e}', finished=datetime.now())
+            return status()
+        _state['steps'][name] = round((time.perf_counter() - started) * 1000, 1)
+
+    _state.update(state='ready', finished=datetime.now())
+    logger.info('Worker %s warmed up: %s', os.getpid(), _state['steps'])
+    return status()
+
+
+def start_warm_up(app):
+    """Warm up on a background thread so the worker can answer /ready meanwhile."""
+    thread = threading.Thread(target=warm_up, args=(app,), name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready():
+    return _state['state'] == 'ready' and _state['pid'] == os.getpid()
+
+
+def status():
+    """Warmup state of this process, for the readiness endpoint."""
+    current = dict(_state, steps=dict(_state['steps']))
+    if current['pid'] != os.getpid():
+        current.update(state='pending', started=None, finished=None, steps={}, error=None)
+    return current